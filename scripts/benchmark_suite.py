@@ -0,0 +1,353 @@
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from build_corpus import chunks, list_protocol_pages
+from common import OUTPUT_FORMATS, PROTOCOLS_DIR, RESULTS_DIR, STREAMABLE_FORMATS, \
+    add_labelling_args, add_shared_docs_args, add_wikidata_store_args, get_labelling_options, \
+    get_shared_docs_options, BioProtocolScrapper
+from run_track_summaries import SUMMARY_BACKENDS, SUMMARY_MODELS
+
+parentdir = os.path.dirname('..')
+sys.path.insert(0,parentdir)
+from src.data_reader import PARSER_BACKENDS
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BENCHMARK_BASELINE_FILE_PATH = os.path.join(RESULTS_DIR, 'benchmarks', 'baseline.json')
+STAGES = ['fetch', 'parse', 'clean', 'predict', 'summarize', 'serialize']
+# stage whose outputs are the inputs of each stage
+STAGE_INPUTS = {'parse': 'fetch', 'clean': 'parse', 'predict': 'clean', 'summarize': 'clean',
+                'serialize': 'predict'}
+# metrics compared with the baseline, and whether higher values are better
+COMPARED_METRICS = {'throughput': True, 'p95_latency': False, 'peak_rss_mb': False}
+
+
+class ProtocolPagesRequestHandler(BaseHTTPRequestHandler):
+    """ Serve saved protocol pages as a local stand-in of bio-protocol.org.
+
+    /<pr_id> returns the page of the protocol, and /<pr_id>.<n> returns
+    the same page, so corpora larger than the saved pages can be fetched
+    as distinct protocols.
+    """
+    def do_GET(self):
+        pr_id = self.path.strip('/').split('.')[0]
+        path = self.server.pages.get(pr_id)
+        if path is None:
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_pages_server(pages):
+    """ Serve the (pr_id, path) pages on a free local port and return the server. """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ProtocolPagesRequestHandler)
+    server.pages = dict(pages)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def get_corpus_urls(server, pages, size):
+    host, port = server.server_address
+    pr_ids = [pr_id for pr_id, _ in pages]
+    return [f"http://{host}:{port}/{pr_ids[idx % len(pr_ids)]}" +
+            (f".{idx // len(pr_ids)}" if idx >= len(pr_ids) else '') for idx in range(size)]
+
+def timed_batches(batches, latencies):
+    """ Yield each batch and record the time spent processing it before the next one is requested. """
+    for batch in batches:
+        start = time.perf_counter()
+        yield batch
+        latencies.append(time.perf_counter() - start)
+
+def setup_fetch(options, context):
+    scrapper = BioProtocolScrapper(throttle_time=0, concurrency=options['concurrency'])
+    return lambda batches: [page for batch in batches for page in scrapper.fetch_urls(batch).items()]
+
+def setup_parse(options, context):
+    from src.data_reader import parse_protocol
+
+    return lambda batches: [parse_protocol(html, pr_id, options['parser'])
+                            for batch in batches for pr_id, html in batch]
+
+def setup_clean(options, context):
+    from predict_protocol import build_protocols_df
+
+    return lambda batches: pd.concat([build_protocols_df(batch) for batch in batches],
+                                     ignore_index=True)
+
+def setup_predict(options, context):
+    from common import load_final_pipe, with_wikidata_store
+
+    final_pipe = load_final_pipe(shared_docs=options['shared_docs'], labelling=options['labelling'])
+    # the store is only used while predicting, so the fetch stage is never sent through it
+    transform = with_wikidata_store(final_pipe.transform, options['wikidata_args'])
+    return lambda batches: [topics for batch in batches for topics in transform(batch)]
+
+def setup_summarize(options, context):
+    from run_track_summaries import get_model_predictions, load_summary_model
+
+    model, tokenizer = load_summary_model(options['summary_model'], options['summary_backend'])
+    return lambda batches: [summary for batch in batches
+                            for summary in get_model_predictions(model, tokenizer, batch, len(batch))]
+
+def setup_serialize(options, context):
+    from common import show_results, stream_results
+
+    protocols_df, topics, format = context['protocols_df'], context['topics'], context['format']
+    out_file = os.path.join(context['out_dir'], f"results.{format}")
+
+    def get_results(batches):
+        for batch in batches:
+            yield protocols_df.iloc[batch], protocols_df['full_text_cleaned'].values[batch], \
+                [topics[idx] for idx in batch]
+
+    def serialize(batches):
+        results = get_results(batches)
+        if format in STREAMABLE_FORMATS:
+            stream_results(results, out_file, format)
+        else:
+            # formats that can not be streamed get the whole corpus as a single batch
+            for batch_protocols_df, protocols, batch_topics in results:
+                show_results(batch_protocols_df, protocols, batch_topics, out_file, format)
+        return os.path.getsize(out_file)
+    return serialize
+
+STAGE_SETUPS = {
+    'fetch': setup_fetch,
+    'parse': setup_parse,
+    'clean': setup_clean,
+    'predict': setup_predict,
+    'summarize': setup_summarize,
+    'serialize': setup_serialize
+}
+
+def run_stage(stage, items, batch_size, repeat, options, context=None):
+    """ Run a stage over the items in batches of batch_size items, repeat times.
+
+    This function is run in a new process for each stage and corpus size,
+    so the peak memory reported only includes the memory used by it.
+    Models are loaded once, before the timed runs.
+    """
+    start = time.perf_counter()
+    run = STAGE_SETUPS[stage](options, context)
+    setup_time = time.perf_counter() - start
+    times = []
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = run(timed_batches(chunks(items, batch_size), latencies))
+        times.append(time.perf_counter() - start)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return outputs, setup_time, times, latencies, peak_rss_mb
+
+def benchmark_stage(stage, items, batch_size, repeat, options, context=None):
+    with ProcessPoolExecutor(max_workers=1,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        outputs, setup_time, times, latencies, peak_rss_mb = executor.submit(
+            run_stage, stage, items, batch_size, repeat, options, context).result()
+    time_taken = float(np.median(times))
+    return outputs, {
+        'setup_time': setup_time,
+        'time': time_taken,
+        'throughput': len(items) / time_taken,
+        'p50_latency': float(np.percentile(latencies, 50)),
+        'p95_latency': float(np.percentile(latencies, 95)),
+        'peak_rss_mb': peak_rss_mb
+    }
+
+def get_stages_to_run(stages):
+    """ Add the stages whose outputs are needed by the given ones, in execution order. """
+    stages_to_run = set()
+    for stage in stages:
+        while stage is not None:
+            stages_to_run.add(stage)
+            stage = STAGE_INPUTS.get(stage)
+    return [stage for stage in STAGES if stage in stages_to_run]
+
+def benchmark_corpus(urls, stages, args, options, out_dir):
+    results = {}
+    outputs = {}
+    for stage in stages:
+        if stage == 'serialize':
+            protocols_df = outputs['clean'][['pr_id', 'title', 'authors', 'full_text_cleaned']]
+            for format in args.formats:
+                logger.info(f'Benchmarking {format} serialization of {len(urls)} protocols...')
+                context = {'protocols_df': protocols_df, 'topics': outputs['predict'],
+                           'format': format, 'out_dir': out_dir}
+                batch_size = args.batch_size if format in STREAMABLE_FORMATS else len(protocols_df)
+                _, results[f'serialize:{format}'] = benchmark_stage(
+                    stage, list(range(len(protocols_df))), batch_size, args.repeat, options, context)
+            continue
+        logger.info(f'Benchmarking {stage} stage on {len(urls)} protocols...')
+        if stage == 'fetch':
+            items = urls
+        elif stage == 'predict':
+            items = list(outputs['clean']['full_text_cleaned'].values)
+        elif stage == 'summarize':
+            items = list(outputs['clean']['full_text_no_abstract_cleaned'].values)
+        else:
+            items = outputs[STAGE_INPUTS[stage]]
+        outputs[stage], results[stage] = benchmark_stage(stage, items, args.batch_size, args.repeat,
+                                                         options)
+    return results
+
+def compare_with_baseline(stages, baseline_stages, tolerance):
+    """ Return the relative change of each compared metric and the regressions beyond the tolerance. """
+    comparison = {}
+    regressions = []
+    for stage, sizes in stages.items():
+        for size, metrics in sizes.items():
+            baseline_metrics = baseline_stages.get(stage, {}).get(size)
+            if baseline_metrics is None:
+                continue
+            changes = {}
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                if not baseline_metrics.get(metric):
+                    continue
+                change = metrics[metric] / baseline_metrics[metric] - 1
+                changes[metric] = change
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append(f"{stage} on {size} protocols: {metric} changed by " +
+                                       f"{change:+.1%} ({baseline_metrics[metric]:.4g} -> " +
+                                       f"{metrics[metric]:.4g})")
+            comparison.setdefault(stage, {})[size] = changes
+    return comparison, regressions
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Measure the throughput, latency and memory usage " +
+        "of each stage of the prediction scripts on corpora of several sizes, built from saved " +
+        "protocol pages served by a local server, and compare them with a baseline")
+    parser.add_argument('--pages-dir', default=PROTOCOLS_DIR, help="Directory with the saved html " +
+        f"pages of the protocols. If no directory is specified, {PROTOCOLS_DIR} is used by default.")
+    parser.add_argument('--stages', choices=STAGES, nargs='+', default=STAGES, help="Stages to be " +
+        "benchmarked. The stages whose outputs they need are benchmarked too. By default, every " +
+        "stage is benchmarked.")
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[10, 50, 100], help="Number " +
+        "of protocols of each corpus. Saved pages are repeated if there are fewer pages than " +
+        "protocols. By default, corpora of 10, 50 and 100 protocols are used.")
+    parser.add_argument('-b', '--batch-size', type=int, default=8, help="Number of protocols " +
+        "processed together by each stage, whose latency is measured. By default, 8 protocols " +
+        "are processed together.")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Number of times each stage " +
+        "is run on each corpus. The median time is reported. By default, stages are run 3 times.")
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help="Number of protocols " +
+        "downloaded in parallel. By default, 4 protocols are downloaded in parallel.")
+    parser.add_argument('--parser', choices=PARSER_BACKENDS, default='soup', help="Backend used " +
+        "to parse the protocol pages. By default, the BeautifulSoup backend is used.")
+    parser.add_argument('-f', '--formats', choices=sorted(OUTPUT_FORMATS), nargs='+',
+        default=sorted(OUTPUT_FORMATS), help="Output formats whose writers are benchmarked. " +
+        "By default, every output format is benchmarked.")
+    parser.add_argument('-m', '--summary-model', choices=SUMMARY_MODELS, nargs='?',
+        default='distillbart_cnn_protocols', help="Summarization model to be benchmarked. " +
+        "If no model is set, distillbart_cnn_protocols is used by default.")
+    parser.add_argument('--summary-backend', choices=SUMMARY_BACKENDS, default='torch',
+        help="Backend used to run the summarization model. By default, torch is used.")
+    parser.add_argument('-o', '--output', help="Name of the JSON file where the report will be " +
+        "saved. If no output file is specified, the report will be written to the console instead.",
+        nargs='?', default=None)
+    parser.add_argument('--baseline', default=BENCHMARK_BASELINE_FILE_PATH, help="Report the " +
+        f"results are compared with. If no file is specified, {BENCHMARK_BASELINE_FILE_PATH} is " +
+        "used by default, if it exists.")
+    parser.add_argument('--save-baseline', action='store_true', default=False, help="If present, " +
+        "the report is also saved as the new baseline.")
+    parser.add_argument('--tolerance', type=float, default=.2, help="Relative change of the " +
+        "throughput, p95 latency or peak memory usage of a stage over the baseline that is " +
+        "considered a regression. By default, changes over 20%% are regressions.")
+    add_shared_docs_args(parser)
+    add_labelling_args(parser)
+    add_wikidata_store_args(parser)
+    return parser.parse_args()
+
+def main(args):
+    pages = list_protocol_pages(args.pages_dir)
+    if not pages:
+        raise ValueError(f"No protocol pages found in {args.pages_dir}")
+    stages = get_stages_to_run(args.stages)
+    options = {
+        'concurrency': args.concurrency,
+        'parser': args.parser,
+        'shared_docs': get_shared_docs_options(args),
+        'labelling': get_labelling_options(args),
+        'wikidata_args': args,
+        'summary_model': args.summary_model,
+        'summary_backend': args.summary_backend
+    }
+    server = start_pages_server(pages)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            for size in args.sizes:
+                urls = get_corpus_urls(server, pages, size)
+                for stage, metrics in benchmark_corpus(urls, stages, args, options, out_dir).items():
+                    results.setdefault(stage, {})[str(size)] = metrics
+    finally:
+        server.shutdown()
+        server.server_close()
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'options': {
+            'num_pages': len(pages),
+            'stages': stages,
+            'batch_size': args.batch_size,
+            'repeat': args.repeat,
+            'concurrency': args.concurrency,
+            'parser': args.parser
+        },
+        'stages': results
+    }
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['baseline'] = {'file': args.baseline, 'created': baseline.get('created')}
+        report['comparison'], regressions = compare_with_baseline(results, baseline['stages'],
+                                                                  args.tolerance)
+        report['regressions'] = regressions
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f'Baseline saved to {args.baseline}')
+    for regression in regressions:
+        logger.warning(f'Regression: {regression}')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
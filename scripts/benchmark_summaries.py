@@ -0,0 +1,97 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from rouge_score import rouge_scorer
+
+from common import load_protocols_corpus
+from run_track_summaries import SUMMARY_BACKENDS, SUMMARY_MODELS
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_backend(model_name, backend, protocols, batch_size):
+    """ Summarize the protocols with the given backend.
+
+    This function is run in a new process for each backend, so
+    the peak memory reported only includes the memory used by it.
+    """
+    from run_track_summaries import get_model_predictions, load_summary_model
+
+    start = time.perf_counter()
+    model, tokenizer = load_summary_model(model_name, backend)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    summaries = get_model_predictions(model, tokenizer, protocols, batch_size)
+    predict_time = time.perf_counter() - start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return summaries, load_time, predict_time, peak_rss_mb
+
+def compute_rouge_scores(references, predictions):
+    scorer = rouge_scorer.RougeScorer(['rouge1', 'rougeL'], use_stemmer=True)
+    scores = [scorer.score(reference, prediction)
+              for reference, prediction in zip(references, predictions)]
+    return {
+        'rouge1': float(np.mean([score['rouge1'].fmeasure for score in scores])),
+        'rougeL': float(np.mean([score['rougeL'].fmeasure for score in scores]))
+    }
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Compare the latency, memory usage and quality " +
+        "of the summaries computed with each summarization backend")
+    parser.add_argument('-m', '--model', choices=SUMMARY_MODELS, help="Summarization model to be " +
+        "benchmarked. If no model is set, distillbart_cnn_protocols is used by default.",
+        nargs='?', default='distillbart_cnn_protocols')
+    parser.add_argument('--backends', choices=SUMMARY_BACKENDS, nargs='+', default=SUMMARY_BACKENDS,
+        help="Backends to be compared. The torch backend is used as the baseline.")
+    parser.add_argument('-n', '--num-protocols', type=int, default=50, help="Number of protocols " +
+        "from the track dataset that are summarized. By default, 50 protocols are used.")
+    parser.add_argument('-b', '--batch-size', type=int, default=8, help="Maximum number of " +
+        "protocols summarized together. By default, up to 8 protocols are batched.")
+    parser.add_argument('-o', '--output', help="Name of the JSON file where the results will be " +
+        "saved. If no output file is specified, results will be written to the console instead.",
+        nargs='?', default=None)
+    return parser.parse_args()
+
+def main(args):
+    protocols_df = load_protocols_corpus(['full_text_no_abstract_cleaned', 'abstract']) \
+        .head(args.num_protocols)
+    protocols = list(protocols_df['full_text_no_abstract_cleaned'].values)
+    abstracts = list(protocols_df['abstract'].values)
+    backends = ['torch'] + [backend for backend in args.backends if backend != 'torch']
+    results = {}
+    baseline_summaries = None
+    for backend in backends:
+        logger.info(f'Benchmarking {backend} backend...')
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            summaries, load_time, predict_time, peak_rss_mb = executor.submit(
+                run_backend, args.model, backend, protocols, args.batch_size).result()
+        if baseline_summaries is None:
+            baseline_summaries = summaries
+        results[backend] = {
+            'load_time': load_time,
+            'predict_time': predict_time,
+            'latency_per_protocol': predict_time / len(protocols),
+            'peak_rss_mb': peak_rss_mb,
+            'rouge_vs_abstract': compute_rouge_scores(abstracts, summaries),
+            'rouge_vs_torch': compute_rouge_scores(baseline_summaries, summaries)
+        }
+    res = {'model': args.model, 'num_protocols': len(protocols), 'backends': results}
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(res, f, indent=2)
+    else:
+        print(json.dumps(res, indent=2))
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
@@ -0,0 +1,70 @@
+import argparse
+import json
+import logging
+import time
+
+from common import load_final_pipe, load_protocols_corpus, add_shared_docs_args, \
+    add_wikidata_store_args, use_wikidata_store
+from shared_docs import SharedDocsPipe
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def time_transform(pipe, protocols):
+    start = time.perf_counter()
+    topics = pipe.transform(protocols)
+    elapsed = time.perf_counter() - start
+    return topics, {
+        'time': elapsed,
+        'protocols_per_second': len(protocols) / elapsed
+    }
+
+def get_topics_summary(topics):
+    return [[(str(t[0]), t[0].score) for t in protocol_topics] for protocol_topics in topics]
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Compare the throughput of the topic extraction " +
+        "model when each branch parses the protocols on its own and when parsed documents are shared")
+    parser.add_argument('-n', '--num-protocols', type=int, default=100, help="Number of protocols " +
+        "from the track dataset whose topics are predicted. By default, 100 protocols are used.")
+    parser.add_argument('-o', '--output', help="Name of the JSON file where the results will be " +
+        "saved. If no output file is specified, results will be written to the console instead.",
+        nargs='?', default=None)
+    add_shared_docs_args(parser)
+    add_wikidata_store_args(parser)
+    return parser.parse_args()
+
+def main(args):
+    protocols_df = load_protocols_corpus(['full_text_cleaned']).head(args.num_protocols)
+    protocols = list(protocols_df['full_text_cleaned'].values)
+    shared_docs = {'batch_size': args.nlp_batch_size, 'n_process': args.nlp_processes,
+                   'disable': args.nlp_disable}
+    final_pipe = load_final_pipe()
+    # the wrapper restores the models of the pipeline after each run, so both share it
+    shared_docs_pipe = SharedDocsPipe(final_pipe, **shared_docs)
+    with use_wikidata_store(args):
+        # the first run fills the Wikidata store, so both timed runs send the same requests
+        logger.info('Warming up...')
+        baseline_topics = final_pipe.transform(protocols)
+        logger.info('Benchmarking separate parsing...')
+        _, baseline = time_transform(final_pipe, protocols)
+        logger.info('Benchmarking shared parsing...')
+        shared_topics, shared = time_transform(shared_docs_pipe, protocols)
+    res = {
+        'num_protocols': len(protocols),
+        'options': shared_docs,
+        'separate': baseline,
+        'shared': shared,
+        'speedup': baseline['time'] / shared['time'],
+        'identical_topics': get_topics_summary(shared_topics) == get_topics_summary(baseline_topics)
+    }
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(res, f, indent=2)
+    else:
+        print(json.dumps(res, indent=2))
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
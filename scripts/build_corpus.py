@@ -0,0 +1,104 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+
+from common import CORPUS_FILE_PATH, PROTOCOLS_DIR, PROTOCOLS_FILE_PATH
+from corpus_store import CorpusStore
+from predict_protocol import build_protocols_df
+
+parentdir = os.path.dirname('..')
+sys.path.insert(0,parentdir)
+from src.data_reader import PARSER_BACKENDS, parse_protocols
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def chunks(iterable, n):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def list_protocol_pages(protocols_dir):
+    return [(os.path.basename(path).split('.')[0], path)
+            for path in sorted(glob.glob(os.path.join(protocols_dir, '*.html')))]
+
+def get_corpus_order(pr_ids, positions=None, protocols_file_path=PROTOCOLS_FILE_PATH):
+    """ Sort the protocol ids in the order of the corpus.
+
+    This keeps the order of the results of the track scripts, which
+    follows the order of the corpus. positions are the ones stored in
+    the corpus by a previous update. The protocols dataframe saved by
+    the notebooks is only read when there are no stored positions, to
+    build the corpus in its order. Protocols without a position follow
+    the ones with it, in their given order.
+    """
+    if not positions:
+        if not os.path.exists(protocols_file_path):
+            return list(pr_ids)
+        import pandas as pd
+
+        positions = {pr_id: position for position, pr_id in
+                     enumerate(pd.read_pickle(protocols_file_path)['pr_id'].tolist())}
+    num_positions = max(positions.values()) + 1 if positions else 0
+    return sorted(pr_ids, key=lambda pr_id: positions.get(pr_id, num_positions))
+
+def update_corpus(store, pages, parse_workers=1, parser='soup', batch_size=256):
+    """ Parse the new and changed pages and store their protocols.
+
+    Pages are parsed in batches of batch_size pages, so only the pages
+    of the current batch are kept in memory. Returns the number of
+    protocols that were parsed.
+    """
+    num_parsed = 0
+    for changed_pages in chunks(store.iter_changed_pages(pages), batch_size):
+        parsed_protocols = parse_protocols([(pr_id, html) for pr_id, html, *_ in changed_pages],
+                                           workers=parse_workers, backend=parser)
+        store.put(build_protocols_df(parsed_protocols), changed_pages)
+        num_parsed += len(changed_pages)
+        logger.info(f'{num_parsed} protocols parsed...')
+    return num_parsed
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Build or update the corpus of parsed protocols " +
+        "from the protocol pages, only parsing the pages that are new or changed")
+    parser.add_argument('-i', '--input', default=PROTOCOLS_DIR, help="Directory with the html " +
+        f"pages of the protocols. If no directory is specified, {PROTOCOLS_DIR} is used by default.")
+    parser.add_argument('-o', '--output', default=CORPUS_FILE_PATH, help="Corpus file to be built " +
+        f"or updated. If no file is specified, {CORPUS_FILE_PATH} is used by default.")
+    parser.add_argument('--parse-workers', type=int, default=1, help="Number of processes used " +
+        "to parse the changed pages. If no value is specified, pages are parsed in the main process.")
+    parser.add_argument('--parser', choices=PARSER_BACKENDS, default='soup', help="Backend used " +
+        "to parse the protocol pages. If no backend is specified, soup is used by default.")
+    parser.add_argument('--keep-missing', action='store_true', default=False, help="If present, " +
+        "protocols whose page was removed from the input directory are kept in the corpus.")
+    parser.add_argument('--export-pickle', action='store_true', default=False, help="If present, " +
+        f"the whole corpus is also saved as a dataframe to {PROTOCOLS_FILE_PATH}, which is the " +
+        "file read by the notebooks.")
+    return parser.parse_args()
+
+def main(args):
+    start = time.perf_counter()
+    store = CorpusStore(args.output)
+    pages = list_protocol_pages(args.input)
+    logger.info(f'Checking {len(pages)} protocol pages...')
+    num_parsed = update_corpus(store, pages, args.parse_workers, args.parser)
+    num_removed = 0 if args.keep_missing else store.remove_missing([pr_id for pr_id, _ in pages])
+    store.set_positions(get_corpus_order([pr_id for pr_id, _ in pages], store.get_positions()))
+    logger.info(f'Corpus updated in {time.perf_counter() - start:.1f}s: {num_parsed} protocols ' +
+                f'parsed, {num_removed} removed, {len(store)} in total')
+    if args.export_pickle:
+        store.read().to_pickle(PROTOCOLS_FILE_PATH)
+        logger.info(f'Corpus saved to {PROTOCOLS_FILE_PATH}')
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
@@ -1,140 +1,589 @@
-import csv
+import functools
+import hashlib
 import joblib
 import json
+import logging
 import os
 import requests
-import sys
+import threading
 import time
 
-from rdflib import BNode, Graph, Literal, Namespace, URIRef
-from rdflib.namespace import RDF, RDFS
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from urllib.parse import urlparse
 
-from herc_common.utils import add_text_topics_to_graph, load_object, EDMA, ITSRDF, NIF
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from instrumentation import DOCUMENT_BATCH_SIZE, METRICS_DOCUMENT_BATCH_SIZE, METRICS_FORMATS, Metrics
+from results_writer import RESULTS_FORMATS, get_results_columns, get_topics_parquet_type, \
+    iter_entries, open_output, open_results_writer
+from topic_cache import CachedTopicPipe, TopicCache
 
 
 BASE_URL = "https://bio-protocol.org/"
+DATA_DIR = 'data'
+PROTOCOLS_DIR = os.path.join(DATA_DIR, 'protocols')
+PAGE_CACHE_DIR = os.path.join(DATA_DIR, 'page_cache')
 RESULTS_DIR = 'results'
 NOTEBOOK_2_RESULTS_DIR = os.path.join(RESULTS_DIR, '2_data_exploration')
 NOTEBOOK_6_RESULTS_DIR = os.path.join(RESULTS_DIR, '6_complete_system')
 
 PROTOCOLS_FILE_PATH = os.path.join(NOTEBOOK_2_RESULTS_DIR, 'protocols_dataframe.pkl')
+CORPUS_FILE_PATH = os.path.join(NOTEBOOK_2_RESULTS_DIR, 'protocols_corpus.sqlite')
 FINAL_PIPE_FILE_PATH = os.path.join(NOTEBOOK_6_RESULTS_DIR, 'final_pipe.pkl')
+FINAL_PIPE_MMAP_FILE_PATH = os.path.join(NOTEBOOK_6_RESULTS_DIR, 'final_pipe.joblib')
+FINAL_PIPE_SOURCE_FILE_PATH = f"{FINAL_PIPE_MMAP_FILE_PATH}.source.json"
+TOPIC_CACHE_FILE_PATH = os.path.join(NOTEBOOK_6_RESULTS_DIR, 'topic_cache.sqlite')
+WIKIDATA_STORE_FILE_PATH = os.path.join(NOTEBOOK_6_RESULTS_DIR, 'wikidata_store.sqlite')
+
+RDF_FORMATS = {'json-ld', 'n3', 'xml', 'turtle', 'nt', 'nquads'}
+STREAMED_RDF_FORMATS = {'nt', 'nquads'}
+STREAMABLE_FORMATS = STREAMED_RDF_FORMATS | {'turtle'} | RESULTS_FORMATS
+OUTPUT_FORMATS = RDF_FORMATS | RESULTS_FORMATS
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseTimer():
+    """ Measure the time spent in each phase of a script.
+
+    Phases are timed with the phase context manager. If the timer
+    is disabled, phases are run without being measured. If metrics
+    are given, each phase is also recorded as a span of them.
+    """
+    def __init__(self, enabled=True, metrics=None):
+        self.enabled = enabled
+        self.metrics = metrics or Metrics(enabled=False)
+        self.timings = []
+
+    @contextmanager
+    def phase(self, name):
+        with self.metrics.span(name):
+            if not self.enabled:
+                yield
+                return
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.timings.append((name, time.perf_counter() - start))
+
+    def report(self):
+        if not self.enabled:
+            return
+        total = sum(duration for _, duration in self.timings)
+        lines = [f"{name:<40} {duration:8.3f}s" for name, duration in self.timings]
+        lines.append(f"{'total':<40} {total:8.3f}s")
+        logger.info('Startup profile:\n' + '\n'.join(lines))
 
-RDF_FORMATS = {'json-ld', 'n3', 'xml', 'turtle'}
-OUTPUT_FORMATS = RDF_FORMATS | {'csv', 'json'}
+
+
+class HostRateLimiter():
+    """ Space out requests sent to the same host.
+
+    Each call to wait reserves the next free slot for the
+    host of the given url, so concurrent workers never send
+    more than one request per min_interval seconds to it.
+    """
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next_slots = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slots.get(host, now))
+            self._next_slots[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
 
 
 class BioProtocolScrapper():
-    def __init__(self, throttle_time=.5,
+    def __init__(self, throttle_time=.5, concurrency=1,
+                 retries=3, backoff_factor=.5, timeout=30,
+                 cache=None, offline=False,
                  username=None, password=None):
+        if offline and cache is None:
+            raise ValueError("A page cache is required to fetch protocols in offline mode")
         self.throttle_time = throttle_time
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache = cache
+        self.offline = offline
+        self.rate_limiter = HostRateLimiter(throttle_time)
+        self.session = _create_session(concurrency, retries, backoff_factor)
         if username and password:
-            self.login(username, password)
+            self._login(username, password)
 
     def fetch_urls(self, url_list):
-        res = {}
-        for url in url_list:
-            id, content = self.fetch_url(url)
-            res[id] = content
-            time.sleep(self.throttle_time)
-        return res
+        return dict(self.iter_urls(url_list))
+
+    def iter_urls(self, url_list):
+        """ Yield the (id, html) pair of each url in order as it is fetched.
+
+        At most twice as many pages as concurrent workers are kept
+        in flight, so memory use does not grow with the number of urls.
+        """
+        max_pending = 2 * self.concurrency
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = deque()
+            for url in url_list:
+                pending.append(executor.submit(self.fetch_url, url))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
     def fetch_url(self, url):
         id = url.split('/')[-1] if '/' in url else url
-        response = requests.get(url)
-        return id, response.text
+        if self.cache is None:
+            return id, self._get(url).text
+        if not self.offline and self.cache.is_fresh(id, url):
+            return id, self.cache.get(id, url).html
+        cached_page = self.cache.get(id, url)
+        if self.offline:
+            if cached_page is None:
+                raise KeyError(f"Protocol {url} is not available in the page cache")
+            return id, cached_page.html
+        return id, self._revalidate(id, url, cached_page)
+
+    def _get(self, url, headers=None):
+        self.rate_limiter.wait(url)
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        # error pages left once the retries are exhausted must not be parsed as protocols
+        response.raise_for_status()
+        return response
+
+    def _revalidate(self, id, url, cached_page):
+        headers = {}
+        if cached_page is not None and cached_page.etag:
+            headers['If-None-Match'] = cached_page.etag
+        if cached_page is not None and cached_page.last_modified:
+            headers['If-Modified-Since'] = cached_page.last_modified
+        try:
+            response = self._get(url, headers)
+        except requests.RequestException as e:
+            if cached_page is None:
+                raise
+            logger.warning(f'Could not revalidate {url} ({e}), using the cached page')
+            return cached_page.html
+        if response.status_code == 304 and cached_page is not None:
+            self.cache.touch(id, url)
+            return cached_page.html
+        if response.status_code != 200:
+            if cached_page is None:
+                raise requests.HTTPError(f"Unexpected status {response.status_code} for url: {url}",
+                                         response=response)
+            logger.warning(f'Could not revalidate {url} (status {response.status_code}), ' +
+                           'using the cached page')
+            return cached_page.html
+        self.cache.put(id, url, response.text, response.headers.get('ETag'),
+                       response.headers.get('Last-Modified'))
+        return response.text
 
     def _login(self, user, password):
         payload = {'txtEmail': user, 'txtPassword': password}
         url = f'{BASE_URL}/ifrlogin.aspx/?sign=in&p=4'
-        requests.post(url, data=payload)
+        self.session.post(url, data=payload, timeout=self.timeout)
+
+def _create_session(pool_size, retries, backoff_factor):
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=RETRY_STATUS_CODES, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 def create_protocols_graph(protocols_df, protocols, topics):
-    g = Graph()
-    g.bind('edma', EDMA)
-    g.bind('itsrdf', ITSRDF)
-    g.bind('nif', NIF)
-    collection_element = URIRef(f"{EDMA}{joblib.hash(protocols_df)}")
-    g.add((collection_element, RDF.type, NIF.ContextCollection))
-    for idx, protocol_topics in enumerate(topics):
-        text = protocols[idx]
-        protocols_row = protocols_df.loc[idx]
-        pr_id = protocols_row['pr_id']
+    from rdflib.namespace import RDF
+    from herc_common.utils import add_text_topics_to_graph, NIF
+    from rdf_writer import CollectionHasher, create_nif_graph
+
+    g = create_nif_graph()
+    hasher = CollectionHasher()
+    context_elements = []
+    for pr_id, text, protocol_topics in zip(protocols_df['pr_id'].values, protocols, topics):
         uri = f"https://bio-protocol.org/{pr_id}"
-        context_element = add_text_topics_to_graph(uri, pr_id, text, protocol_topics, g)
+        context_elements.append(add_text_topics_to_graph(uri, pr_id, text, protocol_topics, g))
+        hasher.update(pr_id, text)
+    collection_element = hasher.uri()
+    g.add((collection_element, RDF.type, NIF.ContextCollection))
+    for context_element in context_elements:
         g.add((collection_element, NIF.hasContext, context_element))
     return g
 
-def load_final_pipe():
-    import string
-    import en_core_sci_lg
-    from collections import Counter
-    from tqdm import tqdm
+def load_protocols_corpus(columns=None, corpus_path=CORPUS_FILE_PATH):
+    """ Load the given columns of the protocols of the track dataset.
 
-    en_core_sci_lg.load()
-    return load_object(FINAL_PIPE_FILE_PATH)
+    Protocols are read from the corpus built by build_corpus.py, which
+    only reads the requested columns. If the corpus was not built, the
+    whole protocols dataframe saved by the notebooks is loaded instead.
+    """
+    if os.path.exists(corpus_path):
+        from corpus_store import CorpusStore
 
-def show_protocols_csv_results(protocols_df, protocols, topics, out_file):
-    fieldnames = ['protocol_id', 'topics']
-    if out_file is not None:
-        with open(out_file, 'w', encoding='utf-8') as f:
-            csvwriter = csv.DictWriter(f, fieldnames=fieldnames)
-            _write_csv_contents(csvwriter, protocols_df, protocols, topics)
-    else:
-        csvwriter = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-        _write_csv_contents(csvwriter, protocols_df, protocols, topics)
+        return CorpusStore(corpus_path).read(columns)
+    import pandas as pd
+
+    protocols_df = pd.read_pickle(PROTOCOLS_FILE_PATH)
+    return protocols_df if columns is None else protocols_df[list(columns)]
+
+def load_final_pipe(topic_cache_path=None, topic_cache_size=1024, timer=None, shared_docs=None,
+                    labelling=None, metrics=None, lazy=True):
+    """ Load the topic extraction pipeline.
+
+    If the memory-mapped artifact written by export_final_pipe.py
+    is available and was exported from the current pickled pipeline,
+    it is loaded instead of it. Its numpy arrays are mapped from disk
+    instead of being read, so loading is faster and processes using
+    the same artifact share those pages. If shared_docs is set, the
+    pipeline is wrapped with a SharedDocsPipe built with those keyword
+    arguments, and if labelling is set, its topic labellers are replaced
+    with the ParallelTopicLabellers built by parallelize_topic_labellers
+    with those keyword arguments. If metrics are enabled, the time spent
+    in each step of the pipeline is recorded in them. If a topic cache
+    is used and lazy is set, the pipeline is only loaded once a topic
+    missing from the cache has to be predicted.
+    """
+    timer = timer or PhaseTimer(enabled=False)
+    pipe_path = get_final_pipe_path()
+    load_pipe = functools.partial(_load_final_pipe, pipe_path, timer, shared_docs, labelling, metrics)
+    if topic_cache_path is None:
+        return load_pipe()
+    with timer.phase('Opening topic cache'):
+        cache = TopicCache(topic_cache_path, topic_cache_size * 1024 ** 2)
+        pipe_fingerprint = get_pipe_fingerprint(cache, pipe_path, shared_docs, labelling)
+    final_pipe = LazyPipe(load_pipe) if lazy else load_pipe()
+    return CachedTopicPipe(final_pipe, cache, pipe_fingerprint)
+
+def _load_final_pipe(pipe_path, timer, shared_docs, labelling, metrics):
+    with timer.phase('Importing scispaCy model'):
+        import string
+        import en_core_sci_lg
+        from collections import Counter
+        from tqdm import tqdm
+
+    with timer.phase('Loading scispaCy model'):
+        # loading the model registers its vectors, which the unpickled pipeline looks up by name
+        en_core_sci_lg.load()
+    with timer.phase('Loading topic extraction pipeline'):
+        if pipe_path == FINAL_PIPE_MMAP_FILE_PATH:
+            final_pipe = joblib.load(pipe_path, mmap_mode='r')
+        else:
+            from herc_common.utils import load_object
+
+            final_pipe = load_object(pipe_path)
+    if labelling is not None:
+        from parallel_labelling import parallelize_topic_labellers
+
+        parallelize_topic_labellers(final_pipe, **labelling)
+    pipeline = final_pipe
+    if shared_docs is not None:
+        from shared_docs import SharedDocsPipe
+
+        final_pipe = SharedDocsPipe(final_pipe, **shared_docs)
+    if metrics is not None and metrics.enabled:
+        from instrumentation import instrument_pipeline
+
+        # steps are wrapped once SharedDocsPipe has found the spaCy models in them
+        instrument_pipeline(pipeline, metrics)
+    return final_pipe
+
+def get_final_pipe_path():
+    """ Return the memory-mapped artifact of the pipeline if it is up to date, or the pickled one. """
+    if not os.path.exists(FINAL_PIPE_MMAP_FILE_PATH):
+        return FINAL_PIPE_FILE_PATH
+    if not os.path.exists(FINAL_PIPE_FILE_PATH) or \
+            is_artifact_up_to_date(FINAL_PIPE_FILE_PATH, FINAL_PIPE_MMAP_FILE_PATH,
+                                   FINAL_PIPE_SOURCE_FILE_PATH):
+        return FINAL_PIPE_MMAP_FILE_PATH
+    logger.warning(f'{FINAL_PIPE_MMAP_FILE_PATH} was not exported from the current ' +
+                   f'{FINAL_PIPE_FILE_PATH}, so it is not used. Run export_final_pipe.py to ' +
+                   'export it again.')
+    return FINAL_PIPE_FILE_PATH
+
+def get_file_signature(path, with_hash=True):
+    stat = os.stat(path)
+    signature = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if with_hash:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(block)
+        signature['sha1'] = sha1.hexdigest()
+    return signature
+
+def write_artifact_source(source_path, source_info_path):
+    """ Save the signature of the file an artifact was exported from. """
+    with open(source_info_path, 'w', encoding='utf-8') as f:
+        json.dump(get_file_signature(source_path), f)
+
+def is_artifact_up_to_date(source_path, artifact_path, source_info_path):
+    """ Check if an artifact was exported from the current version of its source file.
+
+    The source is only hashed again if its size or modification time
+    changed. Artifacts exported without saving the signature of their
+    source are up to date if they are newer than it.
+    """
+    if not os.path.exists(source_info_path):
+        return os.stat(artifact_path).st_mtime_ns >= os.stat(source_path).st_mtime_ns
+    with open(source_info_path, 'r', encoding='utf-8') as f:
+        source_info = json.load(f)
+    signature = get_file_signature(source_path, with_hash=False)
+    if (signature['size'], signature['mtime']) == (source_info['size'], source_info['mtime']):
+        return True
+    return signature['size'] == source_info['size'] and \
+        get_file_signature(source_path)['sha1'] == source_info['sha1']
+
+
+class LazyPipe():
+    """ Load a pipeline with load_pipe the first time it transforms any document. """
+    def __init__(self, load_pipe):
+        self.load_pipe = load_pipe
+        self._pipe = None
+        self._lock = threading.Lock()
+
+    @property
+    def pipe(self):
+        with self._lock:
+            if self._pipe is None:
+                self._pipe = self.load_pipe()
+            return self._pipe
+
+    def transform(self, X):
+        return self.pipe.transform(X)
+
+def get_pipe_options(shared_docs=None, labelling=None):
+    """ Return the options given to load_final_pipe that change the topics it predicts. """
+    pipe_options = []
+    if labelling is not None and labelling.get('centrality_error') is not None:
+        pipe_options.append(f"centrality_error={labelling['centrality_error']}")
+    if shared_docs is not None and shared_docs.get('disable'):
+        pipe_options.append(f"disable={','.join(sorted(shared_docs['disable']))}")
+    return pipe_options
+
+def get_pipe_fingerprint(cache, pipe_path, shared_docs=None, labelling=None):
+    """ Identify the topics predicted by a pipeline file with the given options in a topic cache. """
+    # options that change the topics are part of the fingerprint of the cached topics
+    return ':'.join([cache.file_fingerprint(pipe_path)] + get_pipe_options(shared_docs, labelling))
+
+def add_topic_cache_args(parser):
+    parser.add_argument('--topic-cache', default=TOPIC_CACHE_FILE_PATH, help="File where the " +
+        "topics predicted for each protocol are cached. If no file is specified, " +
+        f"{TOPIC_CACHE_FILE_PATH} is used by default.")
+    parser.add_argument('--topic-cache-size', type=int, default=1024, help="Maximum size of the " +
+        "topic cache in megabytes. By default, up to 1024 MB of topics are cached.")
+    parser.add_argument('--no-topic-cache', action='store_true', default=False, help="If present, " +
+        "the topics of every protocol are predicted again and the topic cache is not used.")
+
+def get_topic_cache_path(args):
+    return None if args.no_topic_cache else args.topic_cache
+
+def add_shared_docs_args(parser):
+    parser.add_argument('--nlp-batch-size', type=int, default=32, help="Number of protocols " +
+        "parsed together by the scispaCy model. By default, 32 protocols are parsed together.")
+    parser.add_argument('--nlp-processes', type=int, default=1, help="Number of processes used " +
+        "to parse the protocols. If no value is specified, protocols are parsed in the main process.")
+    parser.add_argument('--nlp-disable', nargs='*', default=[], help="Components of the scispaCy " +
+        "model that are not run, like parser. They must not be used by the topic extraction model.")
+    parser.add_argument('--no-shared-docs', action='store_true', default=False, help="If present, " +
+        "each branch of the topic extraction model parses the protocols on its own.")
+
+def get_shared_docs_options(args):
+    if args.no_shared_docs:
+        return None
+    return {'batch_size': args.nlp_batch_size, 'n_process': args.nlp_processes,
+            'disable': args.nlp_disable}
+
+def add_labelling_args(parser):
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes used to build " +
+        "the Wikidata graphs of the protocols and label their topics. If no value is specified, " +
+        "topics are labelled in the main process.")
+    parser.add_argument('--labelling-chunk-size', type=int, default=4, help="Number of protocols " +
+        "sent together to each labelling process. By default, 4 protocols are sent together.")
+    parser.add_argument('--centrality-error', type=float, default=None, help="If present, the " +
+        "closeness centrality of the entities is approximated from sampled pivots, with this error " +
+        "bound relative to the diameter of the graph (e.g. 0.1). By default, it is computed exactly.")
+
+def get_labelling_options(args):
+    if args.workers == 1 and args.centrality_error is None:
+        return None
+    # the workers send their Wikidata requests through the store too
+    return {'workers': args.workers, 'chunksize': args.labelling_chunk_size,
+            'centrality_error': args.centrality_error,
+            'initializer': setup_wikidata_store, 'initargs': (args,)}
+
+def add_metrics_args(parser, profile=True):
+    parser.add_argument('--metrics-out', default=None, help="If present, file where the time " +
+        "spent in each phase of the script and step of the models, and the latency of each " +
+        "batch of protocols, are saved. Files ending in .prom or .txt are written in Prometheus text " +
+        "format, and any other file in JSON.")
+    parser.add_argument('--metrics-format', choices=METRICS_FORMATS, default=None, help="Format " +
+        "of the metrics file, which overrides the one given by its extension.")
+    if profile:
+        parser.add_argument('--profile', default=None, help="If present, file where a cProfile dump " +
+            "of the prediction stage is saved, which can be read with pstats, snakeviz or " +
+            "flameprof. Only the main process is profiled, not the processes started with " +
+            "--workers or --nlp-processes.")
+    parser.add_argument('--document-batch-size', type=int, default=None, help="Number of protocols " +
+        "predicted together, whose latency is recorded and progress logged. Use 1 to record the " +
+        f"latency of each protocol. By default, {DOCUMENT_BATCH_SIZE} protocols are predicted " +
+        f"together, or {METRICS_DOCUMENT_BATCH_SIZE} if --metrics-out is present.")
+
+@contextmanager
+def collect_metrics(args):
+    """ Yield the metrics of the script, which are saved as set in args once it finishes or fails. """
+    profile = getattr(args, 'profile', None)
+    metrics = Metrics(enabled=args.metrics_out is not None, profile=profile is not None)
+    try:
+        yield metrics
+    finally:
+        if args.metrics_out is not None:
+            metrics.write(args.metrics_out, args.metrics_format)
+        if profile is not None:
+            metrics.write_profile(profile)
+
+def add_wikidata_store_args(parser):
+    parser.add_argument('--wikidata-store', default=WIKIDATA_STORE_FILE_PATH, help="File where the " +
+        "responses of Wikidata used to link entities and build their graphs are stored. If no file " +
+        f"is specified, {WIKIDATA_STORE_FILE_PATH} is used by default.")
+    parser.add_argument('--no-wikidata-store', action='store_true', default=False, help="If present, " +
+        "every request is sent to Wikidata and the Wikidata store is not used.")
+    parser.add_argument('--wikidata-offline', action='store_true', default=False, help="If present, " +
+        "entities are only linked with the responses of the Wikidata store, and an error is raised " +
+        "if a response is missing.")
+    parser.add_argument('--wikidata-endpoint', default=None, help="If present, the responses " +
+        "missing from the Wikidata store are requested to this url instead of to Wikidata, like " +
+        "the one of wikidata_endpoint.py.")
+
+def get_wikidata_store(args):
+    """ Open the Wikidata store set in args, or return None if it is not used. """
+    if args.no_wikidata_store:
+        if args.wikidata_offline:
+            raise ValueError("A Wikidata store is required to link entities in offline mode")
+        return None
+    from wikidata_store import WikidataStore
+
+    return WikidataStore(args.wikidata_store)
+
+@contextmanager
+def use_wikidata_store(args, store=None):
+    """ Send the Wikidata requests made inside the block through the store set in args.
+
+    The store is only installed while the block runs, so the requests
+    of the rest of the script, like the ones of the scrapper, are sent
+    as usual. The store opened with get_wikidata_store can be passed
+    to reuse it across blocks.
+    """
+    store = get_wikidata_store(args) if store is None else store
+    if store is None:
+        yield None
+        return
+    from wikidata_store import install_wikidata_store
+
+    with install_wikidata_store(store, args.wikidata_offline, args.wikidata_endpoint) as adapter:
+        yield adapter
+
+def with_wikidata_store(transform, args, store=None):
+    """ Wrap transform so the Wikidata requests of each call go through the store set in args.
+
+    It is used when other work, like fetching protocol pages, runs
+    between the batches being predicted.
+    """
+    store = get_wikidata_store(args) if store is None else store
+
+    @functools.wraps(transform)
+    def transform_with_wikidata_store(X):
+        with use_wikidata_store(args, store):
+            return transform(X)
+
+    return transform_with_wikidata_store
+
+_process_wikidata_store = ExitStack()
+
+def setup_wikidata_store(args):
+    """ Send every Wikidata request of the process through the store set in args.
+
+    It is only meant for processes that do nothing but predict topics,
+    like the labelling workers, so it is used as their initializer.
+    """
+    return _process_wikidata_store.enter_context(use_wikidata_store(args))
 
 def show_protocols_graph_results(protocols_df, protocols, topics, format, out_file):
+    from rdf_writer import serialize_graph
+
+    if format in STREAMED_RDF_FORMATS:
+        _stream_graph_results([(protocols_df, protocols, topics)], out_file, format)
+        return
     g = create_protocols_graph(protocols_df, protocols, topics)
     if out_file is not None:
         g.serialize(destination=out_file, format=format)
     else:
-        print(g.serialize(format=format).decode("utf-8"))
-
-def show_protocols_json_results(protocols_df, protocols, topics, out_file):
-    res = {}
-    for idx, protocol_topics in enumerate(topics):
-        protocol_topics = [t[0] for t in protocol_topics]
-        protocol_row = protocols_df.loc[idx]
-        protocol_id = protocol_row['pr_id']
-        protocol_title = protocol_row['title']
-        protocol_authors = protocol_row['authors'].split('|')
-        source_url = f"https://bio-protocol.org/{protocol_id}"
-        res[str(protocol_id)] = {
-            'source_url': source_url,
-            'authors': protocol_authors,
-            'title': protocol_title,
-            'topics': [{
-                'labels': t.labels,
-                'external_ids': t.uris,
-                'descriptions': t.descs,
-                'score': t.score
-            } for t in protocol_topics]
-        }
-    _write_json_contents(res, out_file)
+        print(serialize_graph(g, format))
 
 def show_results(protocols_df, protocols, topics, out_file, format):
     if format in RDF_FORMATS:
         show_protocols_graph_results(protocols_df, protocols, topics, format, out_file)
-    elif format == 'csv':
-        show_protocols_csv_results(protocols_df, protocols, topics, out_file)
     else:
-        show_protocols_json_results(protocols_df, protocols, topics, out_file)
+        _stream_table_results([(protocols_df, protocols, topics)], out_file, format)
 
 
-def _write_csv_contents(csvwriter, protocols_df, protocols, topics):
-    csvwriter.writeheader()
-    for idx, protocol_topics in enumerate(topics):
-        protocol_topics = [t[0] for t in protocol_topics]
-        protocol_id = protocols_df.loc[idx]['pr_id']
-        csvwriter.writerow({
-            'protocol_id': protocol_id,
-            'topics': ' - '.join([str(t) for t in protocol_topics])
-        })
+def stream_results(results, out_file, format):
+    """ Write the results of each batch as soon as they are computed.
 
-def _write_json_contents(res, out_file):
-    if out_file is not None:
-        with open(out_file, 'w', encoding='utf-8') as f:
-            json.dump(res, f, indent=2, ensure_ascii=False)
+    results is an iterable of (protocols_df, protocols, topics) tuples.
+    The output is the same one produced by show_results for the whole
+    set of protocols, except for turtle, which is written in chunks that
+    produce an isomorphic graph. Every format but json-ld, n3 and xml
+    can be streamed.
+    """
+    if format in RESULTS_FORMATS:
+        _stream_table_results(results, out_file, format)
+    elif format in STREAMABLE_FORMATS:
+        _stream_graph_results(results, out_file, format)
+    else:
+        raise ValueError(f"Results in {format} format can not be streamed")
+
+
+def get_topics_columns(protocols_df, topics, format='json'):
+    if format == 'csv':
+        values = [' - '.join([str(t[0]) for t in protocol_topics]) for protocol_topics in topics]
     else:
-        print(json.dumps(res, indent=2, ensure_ascii=False))
+        values = [[{
+            'labels': t.labels,
+            'external_ids': t.uris,
+            'descriptions': t.descs,
+            'score': t.score
+        } for t, *_ in protocol_topics] for protocol_topics in topics]
+    return get_results_columns(protocols_df, 'topics', values, format)
+
+def _get_protocols_json_entries(protocols_df, topics):
+    return iter_entries(get_topics_columns(protocols_df, topics))
+
+def _stream_graph_results(results, out_file, format):
+    from herc_common.utils import add_text_topics_to_graph
+    from rdf_writer import StreamingGraphWriter
+
+    with open_output(out_file) as f:
+        writer = StreamingGraphWriter(f, format)
+        for protocols_df, protocols, topics in results:
+            for pr_id, text, protocol_topics in zip(protocols_df['pr_id'].values, protocols, topics):
+                uri = f"https://bio-protocol.org/{pr_id}"
+                writer.add_protocol(pr_id, text, functools.partial(add_text_topics_to_graph, uri,
+                                                                   pr_id, text, protocol_topics))
+            f.flush()
+        writer.close()
+
+def _stream_table_results(results, out_file, format):
+    with open_results_writer(out_file, format, 'topics', get_topics_parquet_type) as writer:
+        for protocols_df, protocols, topics in results:
+            writer.write(get_topics_columns(protocols_df, topics, format))
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import sqlite3
+
+import pandas as pd
+
+
+CORPUS_COLUMNS = ['pr_id', 'title', 'abstract', 'materials', 'procedure', 'equipment',
+                  'background', 'categories', 'authors', 'full_text', 'full_text_no_abstract',
+                  'full_text_cleaned', 'full_text_no_abstract_cleaned']
+
+
+class CorpusStore():
+    """ On-disk store of the parsed protocols of the track dataset.
+
+    Each protocol is a row of a SQLite table keyed by its id, with the
+    columns of the protocols dataframe and the size, modification time
+    and sha1 of the page it was parsed from. Pages whose size and
+    modification time did not change are skipped without reading them,
+    and pages whose content did not change are never parsed again. The
+    position of each protocol in the corpus is stored too, so protocols
+    are read in the same order as the rows of the protocols dataframe.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        column_defs = ', '.join(f"{column} TEXT" for column in CORPUS_COLUMNS[1:])
+        self.conn.execute("CREATE TABLE IF NOT EXISTS protocols (pr_id TEXT PRIMARY KEY, "
+                          f"size INTEGER, mtime INTEGER, content_hash TEXT, {column_defs}, "
+                          "position INTEGER)")
+        # corpora built before positions were stored get them on their next update
+        if 'position' not in {row[1] for row in self.conn.execute("PRAGMA table_info(protocols)")}:
+            self.conn.execute("ALTER TABLE protocols ADD COLUMN position INTEGER")
+        self.conn.commit()
+
+    def iter_changed_pages(self, pages):
+        """ Yield the pages that are new or whose content changed.
+
+        pages is a list of (pr_id, path) pairs, and the changed ones are
+        yielded as (pr_id, html, size, mtime, content_hash) tuples, so
+        only the pages being processed are kept in memory. Pages whose
+        content is unchanged but were touched get their size and
+        modification time updated.
+        """
+        stored = {pr_id: (size, mtime, content_hash) for pr_id, size, mtime, content_hash in
+                  self.conn.execute("SELECT pr_id, size, mtime, content_hash FROM protocols")}
+        touched_pages = []
+        for pr_id, path in pages:
+            stat = os.stat(path)
+            stored_page = stored.get(pr_id)
+            if stored_page is not None and stored_page[:2] == (stat.st_size, stat.st_mtime_ns):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            content_hash = hashlib.sha1(html.encode('utf-8')).hexdigest()
+            if stored_page is not None and stored_page[2] == content_hash:
+                touched_pages.append((stat.st_size, stat.st_mtime_ns, pr_id))
+            else:
+                yield pr_id, html, stat.st_size, stat.st_mtime_ns, content_hash
+        self.conn.executemany("UPDATE protocols SET size = ?, mtime = ? WHERE pr_id = ?",
+                              touched_pages)
+        self.conn.commit()
+
+    def put(self, protocols_df, pages):
+        """ Store the rows of protocols_df, parsed from the given changed pages. """
+        pages_info = {page[0]: page[2:] for page in pages}
+        # list columns are stored joined with '|', like in the protocols dataframe
+        rows = [(pr_id, *pages_info[pr_id], *('|'.join(value) if isinstance(value, list) else value
+                                              for value in values))
+                for pr_id, *values in zip(*(protocols_df[column].tolist() for column in CORPUS_COLUMNS))]
+        placeholders = ', '.join('?' * (len(CORPUS_COLUMNS) + 3))
+        self.conn.executemany("INSERT OR REPLACE INTO protocols (pr_id, size, mtime, content_hash, " +
+                              f"{', '.join(CORPUS_COLUMNS[1:])}) VALUES ({placeholders})", rows)
+        self.conn.commit()
+
+    def set_positions(self, pr_ids):
+        """ Set the position of the protocols in the corpus to the one of their id in pr_ids. """
+        self.conn.executemany("UPDATE protocols SET position = ? WHERE pr_id = ?",
+                              [(position, pr_id) for position, pr_id in enumerate(pr_ids)])
+        self.conn.commit()
+
+    def get_positions(self):
+        """ Return the position of every protocol that has one, keyed by its id. """
+        return {pr_id: position for pr_id, position in
+                self.conn.execute("SELECT pr_id, position FROM protocols WHERE position IS NOT NULL")}
+
+    def remove_missing(self, pr_ids):
+        """ Remove the protocols whose id is not in pr_ids and return their number. """
+        pr_ids = set(pr_ids)
+        missing_ids = [(pr_id,) for pr_id, in self.conn.execute("SELECT pr_id FROM protocols")
+                       if pr_id not in pr_ids]
+        self.conn.executemany("DELETE FROM protocols WHERE pr_id = ?", missing_ids)
+        self.conn.commit()
+        return len(missing_ids)
+
+    def read(self, columns=None):
+        """ Load the given columns of every protocol, in the order of the corpus. """
+        columns = CORPUS_COLUMNS if columns is None else list(columns)
+        unknown_columns = set(columns) - set(CORPUS_COLUMNS)
+        if unknown_columns:
+            raise ValueError(f"Unknown corpus columns: {', '.join(sorted(unknown_columns))}")
+        rows = self.conn.execute(f"SELECT {', '.join(columns)} FROM protocols ORDER BY position, pr_id")
+        return pd.DataFrame.from_records(list(rows), columns=columns)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM protocols").fetchone()[0]
@@ -0,0 +1,42 @@
+import argparse
+import logging
+import os
+
+import joblib
+
+from common import FINAL_PIPE_FILE_PATH, FINAL_PIPE_MMAP_FILE_PATH, write_artifact_source
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Export the topic extraction model to a " +
+        "memory-mapped artifact that is loaded faster by the prediction scripts")
+    parser.add_argument('-i', '--input', help="Pickled topic extraction model to be exported. " +
+        f"If no file is specified, {FINAL_PIPE_FILE_PATH} is used by default.",
+        nargs='?', default=FINAL_PIPE_FILE_PATH)
+    parser.add_argument('-o', '--output', help="Name of the file where the artifact will be saved. " +
+        f"If no file is specified, {FINAL_PIPE_MMAP_FILE_PATH} is used by default.",
+        nargs='?', default=FINAL_PIPE_MMAP_FILE_PATH)
+    return parser.parse_args()
+
+def main(args):
+    import string
+    import en_core_sci_lg
+    from collections import Counter
+    from tqdm import tqdm
+    from herc_common.utils import load_object
+
+    logger.info('Loading topic extraction model...')
+    final_pipe = load_object(args.input)
+    logger.info('Exporting topic extraction model...')
+    # arrays must be stored uncompressed to be memory-mapped when loaded
+    joblib.dump(final_pipe, args.output, compress=0)
+    # the prediction scripts ignore the artifact once the pickled model changes
+    write_artifact_source(args.input, f"{args.output}.source.json")
+    logger.info(f'Model exported to {args.output} ({os.path.getsize(args.output) / 1024 ** 2:.1f} MB)')
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
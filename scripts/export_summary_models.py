@@ -0,0 +1,62 @@
+import argparse
+import logging
+import os
+
+import torch
+
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+from run_track_summaries import QUANTIZED_MODEL_FILE_NAME, SUMMARY_MODELS, get_exported_model_dir, \
+    get_model_path
+
+
+EXPORT_BACKENDS = ['quantized', 'onnx']
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def export_quantized_model(model_name):
+    """ Save a copy of the model with its linear layers dynamically quantized to int8. """
+    model_path = get_model_path(model_name)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_path).to('cpu').eval()
+    quantized_model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    output_dir = get_exported_model_dir(model_name, 'quantized')
+    os.makedirs(output_dir, exist_ok=True)
+    torch.save(quantized_model, os.path.join(output_dir, QUANTIZED_MODEL_FILE_NAME))
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(output_dir)
+    return output_dir
+
+def export_onnx_model(model_name):
+    """ Save an ONNX Runtime version of the model. """
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    model_path = get_model_path(model_name)
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_path, export=True)
+    output_dir = get_exported_model_dir(model_name, 'onnx')
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(output_dir)
+    return output_dir
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Export the summarization models to the " +
+        "backends optimized for CPU inference")
+    parser.add_argument('-m', '--model', choices=SUMMARY_MODELS, help="Summarization model to be " +
+        "exported. If no model is set, every model is exported.", nargs='?', default=None)
+    parser.add_argument('--backend', choices=EXPORT_BACKENDS, help="Backend the models are " +
+        "exported to. If no backend is set, models are exported to every backend.",
+        nargs='?', default=None)
+    return parser.parse_args()
+
+def main(args):
+    models = [args.model] if args.model else SUMMARY_MODELS
+    backends = [args.backend] if args.backend else EXPORT_BACKENDS
+    exporters = {'quantized': export_quantized_model, 'onnx': export_onnx_model}
+    for model_name in models:
+        for backend in backends:
+            logger.info(f'Exporting {model_name} to the {backend} backend...')
+            output_dir = exporters[backend](model_name)
+            logger.info(f'Model saved to {output_dir}')
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
@@ -0,0 +1,272 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_FORMATS = ['json', 'prometheus']
+PROMETHEUS_EXTENSIONS = ('.prom', '.txt')
+PROMETHEUS_PREFIX = 'hercules_protocols'
+QUANTILES = [.5, .95, .99]
+# larger batches restart the spaCy and labelling processes of the pipeline less often
+DOCUMENT_BATCH_SIZE = 1024
+# smaller batches give a finer latency when metrics are collected
+METRICS_DOCUMENT_BATCH_SIZE = 32
+
+
+class Metrics():
+    """ Collect the timings of a script run.
+
+    Spans time each phase of the script and each step of the topic
+    extraction pipeline, and the latency of each batch of documents is
+    recorded along with their ids. If the metrics are disabled, nothing
+    is recorded. If profile is set, the calls to the models made by
+    transform_documents are profiled with cProfile, which only covers
+    the main process and not the processes started by the models.
+    """
+    def __init__(self, enabled=True, profile=False):
+        self.enabled = enabled
+        self.spans = defaultdict(list)
+        self.batch_latencies = defaultdict(list)
+        self.profiler = cProfile.Profile() if profile else None
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name].append(time.perf_counter() - start)
+
+    def observe_documents(self, stage, doc_ids, duration):
+        """ Record the latency of a batch of documents along with their ids.
+
+        The documents of a batch are transformed together, so the latency
+        is kept for the whole batch instead of being split among them.
+        With batches of a single document, it is the latency of each one.
+        """
+        if not self.enabled or not len(doc_ids):
+            return
+        self.batch_latencies[stage].append(([str(doc_id) for doc_id in doc_ids], duration))
+
+    def pop(self):
+        """ Return the records collected so far and start collecting new ones. """
+        records = Metrics(self.enabled)
+        records.spans, records.batch_latencies = self.spans, self.batch_latencies
+        self.spans, self.batch_latencies = defaultdict(list), defaultdict(list)
+        return records
+
+    def merge(self, other):
+        """ Add the records of other metrics, like the ones collected by a worker process. """
+        if not self.enabled:
+            return
+        for name, durations in other.spans.items():
+            self.spans[name].extend(durations)
+        for stage, latencies in other.batch_latencies.items():
+            self.batch_latencies[stage].extend(latencies)
+
+    @contextmanager
+    def profiled(self):
+        if self.profiler is None:
+            yield
+            return
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    def to_dict(self, num_slowest=10):
+        batches = {}
+        for stage, latencies in self.batch_latencies.items():
+            slowest = sorted(latencies, key=lambda latency: latency[1], reverse=True)[:num_slowest]
+            batches[stage] = dict(summarize([latency for _, latency in latencies]),
+                                  documents=sum(len(doc_ids) for doc_ids, _ in latencies),
+                                  slowest=[{'ids': doc_ids, 'latency': latency}
+                                           for doc_ids, latency in slowest])
+        return {
+            'spans': {name: summarize(durations) for name, durations in self.spans.items()},
+            'batches': batches
+        }
+
+    def to_prometheus(self):
+        lines = []
+        _add_prometheus_summary(lines, f'{PROMETHEUS_PREFIX}_span_seconds', 'span',
+                                "Time spent in each phase of the script and step of the pipeline.",
+                                self.spans)
+        _add_prometheus_summary(lines, f'{PROMETHEUS_PREFIX}_batch_latency_seconds', 'stage',
+                                "Time spent on each batch of protocols by each stage.",
+                                {stage: [latency for _, latency in latencies]
+                                 for stage, latencies in self.batch_latencies.items()})
+        metric = f'{PROMETHEUS_PREFIX}_documents_total'
+        lines.append(f'# HELP {metric} Number of protocols processed by each stage.')
+        lines.append(f'# TYPE {metric} counter')
+        for stage, latencies in self.batch_latencies.items():
+            num_documents = sum(len(doc_ids) for doc_ids, _ in latencies)
+            lines.append(f'{metric}{{stage="{_escape_label_value(stage)}"}} {num_documents}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, format=None):
+        """ Write the metrics to a file in JSON or Prometheus text format.
+
+        If no format is given, files ending in .prom or .txt are written
+        in Prometheus text format, and any other file in JSON.
+        """
+        if format is None:
+            format = 'prometheus' if path.endswith(PROMETHEUS_EXTENSIONS) else 'json'
+        with open(path, 'w', encoding='utf-8') as f:
+            if format == 'prometheus':
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+        logger.info(f'Metrics written to {path}')
+
+    def write_profile(self, path, num_functions=20):
+        """ Dump the profile in pstats format and log the most expensive functions. """
+        if self.profiler is None:
+            return
+        self.profiler.create_stats()
+        if not self.profiler.stats:
+            logger.warning('Nothing was profiled, so no profile was written')
+            return
+        self.profiler.dump_stats(path)
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(num_functions)
+        logger.info(f'Profile written to {path}\n{stream.getvalue()}')
+
+
+class TimedStep():
+    """ Wrap a step of a pipeline to record the time spent in its transform. """
+    def __init__(self, step, name, metrics):
+        self.step = step
+        self.name = name
+        self.metrics = metrics
+
+    def fit(self, X, y=None):
+        self.step.fit(X, y)
+        return self
+
+    def transform(self, X):
+        with self.metrics.span(self.name):
+            return self.step.transform(X)
+
+    def __getattr__(self, name):
+        # attributes that are not set yet are looked up in the step (e.g. while unpickling)
+        if name == 'step':
+            raise AttributeError(name)
+        return getattr(self.step, name)
+
+
+class ProgressLogger():
+    """ Log the number of processed protocols at most once every interval seconds. """
+    def __init__(self, stage, total=None, interval=30):
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self.num_done = 0
+        self.start = self.last_log = time.perf_counter()
+
+    def update(self, num_done):
+        self.num_done += num_done
+        now = time.perf_counter()
+        # the last update is always logged, so the total time of the stage is known
+        if self.num_done != self.total and now - self.last_log < self.interval:
+            return
+        self.last_log = now
+        elapsed = now - self.start
+        rate = self.num_done / elapsed if elapsed > 0 else 0
+        message = f'{self.stage}: {self.num_done}'
+        if self.total is not None:
+            message += f'/{self.total}'
+        message += f' protocols ({rate:.2f} protocols/s'
+        if self.total is not None and rate > 0:
+            message += f', {format_duration((self.total - self.num_done) / rate)} left'
+        logger.info(message + ')')
+
+
+def instrument_pipeline(estimator, metrics, prefix='final_pipe'):
+    """ Wrap each step of a pipeline with a TimedStep named after its path.
+
+    Pipelines and feature unions are explored recursively and modified
+    in place, so both them and their steps are timed.
+    """
+    if hasattr(estimator, 'steps'):
+        steps = estimator.steps
+    elif hasattr(estimator, 'transformer_list'):
+        steps = estimator.transformer_list
+    else:
+        return
+    for idx, (name, step) in enumerate(steps):
+        step_name = f'{prefix}/{name}'
+        instrument_pipeline(step, metrics, step_name)
+        steps[idx] = (name, TimedStep(step, step_name, metrics))
+
+def transform_documents(transform, X, doc_ids, metrics, batch_size=None, stage='predict',
+                        progress=None):
+    """ Apply transform to the documents in batches of batch_size documents.
+
+    The latency of each batch is recorded along with the ids of its
+    documents, and the progress is logged with the given ProgressLogger,
+    or with a new one for the documents in X. If no batch size is given,
+    batches of METRICS_DOCUMENT_BATCH_SIZE documents are used when the
+    metrics are enabled, and of DOCUMENT_BATCH_SIZE documents otherwise.
+    """
+    if batch_size is None:
+        batch_size = METRICS_DOCUMENT_BATCH_SIZE if metrics.enabled else DOCUMENT_BATCH_SIZE
+    X = list(X)
+    doc_ids = list(doc_ids)
+    progress = progress or ProgressLogger(stage, len(X))
+    results = []
+    for batch_start in range(0, len(X), batch_size):
+        batch = X[batch_start:batch_start + batch_size]
+        start = time.perf_counter()
+        with metrics.profiled():
+            results.extend(transform(batch))
+        metrics.observe_documents(stage, doc_ids[batch_start:batch_start + batch_size],
+                                  time.perf_counter() - start)
+        progress.update(len(batch))
+    return results
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'total': float(np.sum(values)),
+        'mean': float(np.mean(values)),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(np.max(values))
+    }
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
+def _add_prometheus_summary(lines, metric, label, help, values_by_label):
+    lines.append(f'# HELP {metric} {help}')
+    lines.append(f'# TYPE {metric} summary')
+    for label_value, values in values_by_label.items():
+        label_value = _escape_label_value(label_value)
+        for quantile in QUANTILES:
+            value = float(np.percentile(values, quantile * 100)) if values else float('nan')
+            lines.append(f'{metric}{{{label}="{label_value}",quantile="{quantile}"}} {value}')
+        lines.append(f'{metric}_sum{{{label}="{label_value}"}} {float(np.sum(values))}')
+        lines.append(f'{metric}_count{{{label}="{label_value}"}} {len(values)}')
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from collections import namedtuple
+
+
+CachedPage = namedtuple('CachedPage', ['html', 'etag', 'last_modified', 'content_hash'])
+
+
+class PageCache():
+    """ Persistent cache of the protocol pages fetched by the scrapper.
+
+    Every page is stored in a single gzip file named after the protocol
+    id and a hash of its url. The first line of the file holds the
+    validators returned by the server (ETag and Last-Modified) and
+    the hash of the html, which follows it. The modification time of
+    the file is used as the time the page was last validated, so
+    checking if an entry is fresh does not require reading it.
+
+    Pages are considered fresh for ttl seconds. A ttl of 0 forces
+    every page to be revalidated, while None disables expiration.
+    If seed_dir is given, raw pages saved as <protocol_id>.html (like
+    the ones written by the data fetching notebook) are used when
+    a page has not been cached yet.
+    """
+    def __init__(self, cache_dir, ttl=0, seed_dir=None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.seed_dir = seed_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, protocol_id, url):
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{protocol_id}-{url_hash}.html.gz")
+
+    def is_fresh(self, protocol_id, url):
+        try:
+            last_validated = os.stat(self.path(protocol_id, url)).st_mtime
+        except FileNotFoundError:
+            return False
+        return self.ttl is None or time.time() - last_validated < self.ttl
+
+    def get(self, protocol_id, url):
+        try:
+            with gzip.open(self.path(protocol_id, url), 'rt', encoding='utf-8') as f:
+                metadata = json.loads(f.readline())
+                html = f.read()
+        except FileNotFoundError:
+            return self._get_seed_page(protocol_id)
+        return CachedPage(html, metadata['etag'], metadata['last_modified'],
+                          metadata['content_hash'])
+
+    def put(self, protocol_id, url, html, etag=None, last_modified=None):
+        metadata = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': _hash_content(html)
+        }
+        path = self.path(protocol_id, url)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(metadata) + '\n')
+            f.write(html)
+        os.replace(tmp_path, path)
+
+    def touch(self, protocol_id, url):
+        os.utime(self.path(protocol_id, url))
+
+    def _get_seed_page(self, protocol_id):
+        if self.seed_dir is None:
+            return None
+        try:
+            with open(os.path.join(self.seed_dir, f"{protocol_id}.html"), 'r', encoding='utf-8') as f:
+                html = f.read()
+        except FileNotFoundError:
+            return None
+        return CachedPage(html, None, None, _hash_content(html))
+
+def _hash_content(html):
+    return hashlib.sha1(html.encode('utf-8')).hexdigest()
@@ -0,0 +1,161 @@
+import copy
+import functools
+import math
+import multiprocessing
+import random
+
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+
+
+_worker_labeller = None
+
+
+class ParallelTopicLabeller():
+    """ Label the topics of each document in a pool of processes.
+
+    The documents are split in chunks of chunksize documents that are
+    labelled by the wrapped TopicLabeller in workers processes. Since
+    the topics of a document only depend on its own entities, the
+    results are the same ones returned by the wrapped labeller. The
+    initializer, if any, is called with initargs in each process before
+    labelling any document.
+
+    The processes are started the first time they are needed and reused
+    by the following calls to transform, until close is called. They are
+    spawned instead of forked, since the labeller may be used while
+    other threads, like the ones fetching protocols, hold locks.
+    """
+    def __init__(self, labeller, workers=2, chunksize=4, initializer=None, initargs=()):
+        self.labeller = labeller
+        self.workers = workers
+        self.chunksize = chunksize
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor = None
+
+    def fit(self, X, y=None):
+        self.labeller.fit(X, y)
+        return self
+
+    def transform(self, X):
+        X = list(X)
+        if self.workers == 1 or len(X) <= self.chunksize:
+            return self.labeller.transform(X)
+        chunks = [X[start:start + self.chunksize] for start in range(0, len(X), self.chunksize)]
+        results = list(self.executor.map(_label_chunk, chunks))
+        if isinstance(results[0], np.ndarray):
+            return np.concatenate(results)
+        return [topics for chunk_topics in results for topics in chunk_topics]
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=(self.labeller, self.initializer, self.initargs))
+        return self._executor
+
+    def close(self):
+        """ Shut down the worker processes, which are started again if transform is called. """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __getstate__(self):
+        # the worker processes belong to this process, so copies start their own
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_executor', None)
+        self.__dict__.update(state)
+
+    def __getattr__(self, name):
+        # attributes that are not set yet are looked up in the labeller (e.g. while unpickling)
+        if name in ('labeller', '_executor'):
+            raise AttributeError(name)
+        return getattr(self.labeller, name)
+
+
+def _init_worker(labeller, initializer, initargs):
+    global _worker_labeller
+    _worker_labeller = labeller
+    if initializer is not None:
+        initializer(*initargs)
+
+def _label_chunk(X):
+    return _worker_labeller.transform(X)
+
+def approximate_closeness_centrality(G, epsilon=.1, seed=0):
+    """ Estimate the closeness centrality of every node from sampled pivots.
+
+    The distances from ceil(log(n) / epsilon ** 2) random pivots to
+    each node are used to estimate its average distance to the other
+    nodes, so the error of the estimate is within epsilon times the
+    diameter of the graph with high probability (Eppstein and Wang,
+    2004). Unreachable nodes are handled like the wf_improved option
+    of networkx. If as many pivots as nodes are needed, the exact
+    closeness centrality is returned instead.
+    """
+    n = len(G)
+    num_pivots = math.ceil(math.log(max(n, 2)) / epsilon ** 2)
+    if num_pivots >= n:
+        return nx.closeness_centrality(G)
+    pivots = random.Random(seed).sample(list(G), num_pivots)
+    distance_sums = dict.fromkeys(G, 0)
+    reached_counts = dict.fromkeys(G, 0)
+    for pivot in pivots:
+        # for directed graphs, closeness uses the distances to each node
+        for node, distance in nx.single_source_shortest_path_length(G, pivot).items():
+            if node != pivot:
+                distance_sums[node] += distance
+                reached_counts[node] += 1
+    centrality = {}
+    for node in G:
+        num_other_pivots = num_pivots - (node in pivots)
+        if reached_counts[node] == 0 or num_other_pivots == 0:
+            centrality[node] = 0.0
+            continue
+        reached_fraction = reached_counts[node] / num_other_pivots
+        average_distance = distance_sums[node] / reached_counts[node]
+        centrality[node] = reached_fraction / average_distance
+    return centrality
+
+def use_approximate_closeness(labeller, epsilon, seed=0):
+    """ Return a copy of the labeller that uses approximate_closeness_centrality. """
+    closeness_attrs = [attr for attr, value in vars(labeller).items()
+                       if value is nx.closeness_centrality]
+    if not closeness_attrs:
+        raise ValueError("The topic labeller does not use closeness centrality")
+    labeller = copy.copy(labeller)
+    for attr in closeness_attrs:
+        setattr(labeller, attr, functools.partial(approximate_closeness_centrality,
+                                                  epsilon=epsilon, seed=seed))
+    return labeller
+
+def parallelize_topic_labellers(estimator, workers=2, chunksize=4, centrality_error=None,
+                                initializer=None, initargs=()):
+    """ Replace the TopicLabeller steps of a pipeline with ParallelTopicLabellers.
+
+    Pipelines and feature unions are explored recursively and modified
+    in place. If centrality_error is set, the labellers use approximate
+    closeness centrality with that error bound.
+    """
+    if hasattr(estimator, 'steps'):
+        steps = estimator.steps
+    elif hasattr(estimator, 'transformer_list'):
+        steps = estimator.transformer_list
+    else:
+        return
+    for idx, (name, step) in enumerate(steps):
+        if type(step).__name__ == 'TopicLabeller':
+            if centrality_error is not None:
+                step = use_approximate_closeness(step, centrality_error)
+            steps[idx] = (name, ParallelTopicLabeller(step, workers, chunksize, initializer, initargs))
+        else:
+            parallelize_topic_labellers(step, workers, chunksize, centrality_error,
+                                        initializer, initargs)
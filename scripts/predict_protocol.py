@@ -1,5 +1,6 @@
 import argparse
 import logging
+import multiprocessing
 import pickle
 import os
 import re
@@ -7,40 +8,113 @@ import sys
 
 import pandas as pd
 
-from common import OUTPUT_FORMATS, load_final_pipe, show_results, BioProtocolScrapper
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+from common import OUTPUT_FORMATS, PAGE_CACHE_DIR, PROTOCOLS_DIR, STREAMABLE_FORMATS, load_final_pipe, \
+    add_topic_cache_args, add_wikidata_store_args, add_shared_docs_args, add_labelling_args, \
+    add_metrics_args, collect_metrics, get_topic_cache_path, get_shared_docs_options, \
+    get_labelling_options, get_wikidata_store, show_results, stream_results, use_wikidata_store, \
+    with_wikidata_store, BioProtocolScrapper, PhaseTimer
+from instrumentation import Metrics, ProgressLogger, transform_documents
+from page_cache import PageCache
 
 parentdir = os.path.dirname('..')
 sys.path.insert(0,parentdir)
-from src.data_reader import parse_protocol
+from src.data_reader import PARSER_BACKENDS, parse_protocols
+from src.protocol import ProtocolTable
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def join_procedure_steps(procedure):
-    return ' '.join(procedure.split('|'))
+    return procedure.replace('|', ' ')
 
 def clean(procedure):
     merged_procedure = join_procedure_steps(procedure)
-    return re.sub('\s+', ' ', merged_procedure).strip()
+    return collapse_whitespace(merged_procedure)
+
+def collapse_whitespace(text):
+    return re.sub('\s+', ' ', text).strip()
 
-def load_protocols_df(input, is_file):
+def read_protocols_urls(input, is_file):
     if is_file:
         with open(input, 'r', encoding='utf-8') as f:
-            protocols_urls = [line.rstrip('\n') for line in f]
-    else:
-        protocols_urls = [input]
-    scrapper = BioProtocolScrapper()
-    protocols_data = scrapper.fetch_urls(protocols_urls)
-    parsed_protocols = [parse_protocol(pr_content, pr_id)
-                        for pr_id, pr_content in protocols_data.items()]
-    df = pd.DataFrame([repo.to_dict() for repo in parsed_protocols])
-    df['full_text'] = df['title'] + '. ' + df['abstract'] + '. ' + df['procedure'] + '. ' + df['background']
-    df['full_text_no_abstract'] = df['title'] + '. ' + df['procedure'] + '. ' + df['background']
-    df['full_text_cleaned'] = df['full_text'].apply(lambda x: clean(x))
-    df['full_text_no_abstract_cleaned'] =df['full_text_no_abstract'].apply(lambda x: clean(x))
+            return [line.rstrip('\n') for line in f]
+    return [input]
+
+def build_protocols_df(parsed_protocols):
+    table = ProtocolTable.from_protocols(parsed_protocols)
+    # authors are written as lists, so they are not joined
+    df = table.to_pandas(list_fields=['authors'])
+    # the steps are joined with spaces from the table, instead of replacing the '|' of the column
+    procedures = table.join_column('procedure', ' ')
+    titles, abstracts, backgrounds = (table.texts[field] for field in ['title', 'abstract', 'background'])
+    df['full_text'] = [f"{title}. {abstract}. {procedure}. {background}" for title, abstract, procedure,
+                       background in zip(titles, abstracts, procedures, backgrounds)]
+    df['full_text_no_abstract'] = [f"{title}. {procedure}. {background}" for title, procedure, background
+                                   in zip(titles, procedures, backgrounds)]
+    df['full_text_cleaned'] = [collapse_whitespace(text) for text in df['full_text']]
+    df['full_text_no_abstract_cleaned'] = [collapse_whitespace(text) for text in df['full_text_no_abstract']]
     return df
 
+def load_protocols_df(input, is_file, concurrency=1, throttle_time=.5,
+                      cache=None, offline=False, parse_workers=1, parser='soup', metrics=None):
+    metrics = metrics or Metrics(enabled=False)
+    protocols_urls = read_protocols_urls(input, is_file)
+    scrapper = BioProtocolScrapper(throttle_time=throttle_time, concurrency=concurrency,
+                                   cache=cache, offline=offline)
+    with metrics.span('Fetching protocols'):
+        protocols_data = scrapper.fetch_urls(protocols_urls)
+    with metrics.span('Parsing protocols'):
+        parsed_protocols = parse_protocols(protocols_data.items(), workers=parse_workers,
+                                           backend=parser)
+    with metrics.span('Cleaning protocols'):
+        return build_protocols_df(parsed_protocols)
+
+def iter_protocols_dfs(input, is_file, batch_size, concurrency=1, throttle_time=.5,
+                       cache=None, offline=False, parser='soup', parse_workers=1):
+    """ Yield the protocols from the input in dataframes of batch_size rows.
+
+    The pages of each batch are parsed as soon as they are downloaded,
+    in parse_workers processes that are started once for the whole
+    input, and only the protocols of the current batch are kept in
+    memory. Repeated protocols are only returned once, like in
+    load_protocols_df.
+    """
+    protocols_urls = read_protocols_urls(input, is_file)
+    scrapper = BioProtocolScrapper(throttle_time=throttle_time, concurrency=concurrency,
+                                   cache=cache, offline=offline)
+    with ExitStack() as stack:
+        executor = None
+        if parse_workers > 1:
+            # the pages are downloaded in other threads, so the processes are not forked
+            executor = stack.enter_context(ProcessPoolExecutor(
+                max_workers=parse_workers, mp_context=multiprocessing.get_context('spawn')))
+        seen_ids = set()
+        batch = []
+        for pr_id, pr_content in scrapper.iter_urls(protocols_urls):
+            if pr_id in seen_ids:
+                continue
+            seen_ids.add(pr_id)
+            batch.append((pr_id, pr_content))
+            if len(batch) == batch_size:
+                yield build_protocols_df(parse_protocols(batch, backend=parser, executor=executor))
+                batch = []
+        if batch:
+            yield build_protocols_df(parse_protocols(batch, backend=parser, executor=executor))
+
+def predict_protocols_batches(protocols_dfs, transform, metrics=None, document_batch_size=None):
+    metrics = metrics or Metrics(enabled=False)
+    # the number of protocols is not known in advance, so progress is logged without a total
+    progress = ProgressLogger('predict')
+    for protocols_df in protocols_dfs:
+        protocols = protocols_df['full_text_cleaned'].values
+        yield protocols_df, protocols, transform_documents(transform, protocols,
+                                                           protocols_df['pr_id'].values, metrics,
+                                                           document_batch_size, progress=progress)
+
 def parseargs():
     parser = argparse.ArgumentParser(description="Run predictions for the protocols track dataset")
     parser.add_argument('input', type=str, help="URL of the protocol to extract " +
@@ -54,18 +128,84 @@ def parseargs():
     parser.add_argument('-o', '--output', help="Name of the file where the results will be saved. " +
         "If no output file is specified, results will be written to the console instead.",
         nargs='?', default=None)
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help="Number of protocols " +
+        "downloaded in parallel. If no value is specified, protocols are downloaded one at a time.")
+    parser.add_argument('-t', '--throttle', type=float, default=.5, help="Minimum number of seconds " +
+        "between two requests sent to the same host. By default, 0.5 seconds are used.")
+    parser.add_argument('--cache-dir', default=PAGE_CACHE_DIR, help="Directory where the downloaded " +
+        f"protocol pages are cached. If no directory is specified, {PAGE_CACHE_DIR} is used by default.")
+    parser.add_argument('--cache-ttl', type=float, default=86400, help="Number of seconds a cached " +
+        "page is used without revalidating it with the server. By default, pages are revalidated " +
+        "after one day.")
+    parser.add_argument('--no-cache', action='store_true', default=False, help="If present, " +
+        "protocol pages are always downloaded and the page cache is not used.")
+    parser.add_argument('--offline', action='store_true', default=False, help="If present, " +
+        "protocol pages are only read from the page cache and no requests are sent.")
+    parser.add_argument('--parse-workers', type=int, default=1, help="Number of processes " +
+        "used to parse the downloaded protocols. If no value is specified, protocols are parsed " +
+        "in the main process.")
+    parser.add_argument('--parser', choices=PARSER_BACKENDS, default='soup', help="Backend used " +
+        "to parse the protocol pages. The fast backend extracts every section in a single pass " +
+        "over the page. If no backend is specified, soup is used by default.")
+    parser.add_argument('--stream', action='store_true', default=False, help="If present, " +
+        "protocols are processed in batches and their results are written as soon as they " +
+        "are available. Every format but json-ld, n3 and xml can be streamed.")
+    parser.add_argument('--batch-size', type=int, default=32, help="Number of protocols " +
+        "processed together when the --stream flag is set. By default, 32 protocols are used.")
+    parser.add_argument('--profile-startup', action='store_true', default=False, help="If present, " +
+        "the time spent in each phase of the script is reported once it finishes.")
+    add_topic_cache_args(parser)
+    add_shared_docs_args(parser)
+    add_labelling_args(parser)
+    add_wikidata_store_args(parser)
+    add_metrics_args(parser)
     return parser.parse_args()
 
 def main(args):
-    logger.info('Loading protocol data...')
-    protocols_df = load_protocols_df(args.input, args.isFile)
+    with collect_metrics(args) as metrics:
+        timer = PhaseTimer(enabled=args.profile_startup, metrics=metrics)
+        cache = None if args.no_cache else PageCache(args.cache_dir, args.cache_ttl, PROTOCOLS_DIR)
+        # the store is opened before fetching the protocols, so a wrong setup fails early
+        wikidata_store = get_wikidata_store(args)
+        if args.stream and args.format in STREAMABLE_FORMATS:
+            stream_main(args, cache, timer, metrics, wikidata_store)
+            timer.report()
+            return
+        if args.stream:
+            logger.warning(f'Results in {args.format} format can not be streamed, ' +
+                           'processing every protocol at once...')
+        logger.info('Loading protocol data...')
+        with timer.phase('Loading protocol data'):
+            protocols_df = load_protocols_df(args.input, args.isFile, args.concurrency, args.throttle,
+                                             cache, args.offline, args.parse_workers, args.parser,
+                                             metrics)
+        logger.info('Loading topic extraction model...')
+        final_pipe = load_final_pipe(get_topic_cache_path(args), args.topic_cache_size, timer,
+                                     get_shared_docs_options(args), get_labelling_options(args),
+                                     metrics)
+        protocols = protocols_df['full_text_cleaned'].values
+        logger.info('Predicting topics...')
+        with timer.phase('Predicting topics'), use_wikidata_store(args, wikidata_store):
+            topics = transform_documents(final_pipe.transform, protocols, protocols_df['pr_id'].values,
+                                         metrics, args.document_batch_size)
+        logger.info('Writting results...')
+        with timer.phase('Writting results'):
+            show_results(protocols_df, protocols, topics, args.output, args.format)
+        timer.report()
+
+def stream_main(args, cache, timer, metrics, wikidata_store=None):
     logger.info('Loading topic extraction model...')
-    final_pipe = load_final_pipe()
-    protocols = protocols_df['full_text_cleaned'].values
+    final_pipe = load_final_pipe(get_topic_cache_path(args), args.topic_cache_size, timer,
+                                 get_shared_docs_options(args), get_labelling_options(args), metrics)
     logger.info('Predicting topics...')
-    topics = final_pipe.transform(protocols)
-    logger.info('Writting results...')
-    show_results(protocols_df, protocols, topics, args.output, args.format)
+    protocols_dfs = iter_protocols_dfs(args.input, args.isFile, args.batch_size, args.concurrency,
+                                       args.throttle, cache, args.offline, args.parser,
+                                       args.parse_workers)
+    # protocol pages are fetched between batches, so the store is only used to predict them
+    transform = with_wikidata_store(final_pipe.transform, args, wikidata_store)
+    results = predict_protocols_batches(protocols_dfs, transform, metrics, args.document_batch_size)
+    with timer.phase('Predicting topics and writting results'):
+        stream_results(results, args.output, args.format)
 
 if __name__ == '__main__':
     args = parseargs()
@@ -0,0 +1,288 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import requests
+
+from common import PAGE_CACHE_DIR, PROTOCOLS_DIR, load_final_pipe, add_topic_cache_args, \
+    add_wikidata_store_args, add_shared_docs_args, get_topic_cache_path, \
+    get_shared_docs_options, with_wikidata_store, BioProtocolScrapper, _get_protocols_json_entries
+from page_cache import PageCache
+from predict_protocol import build_protocols_df, clean
+
+parentdir = os.path.dirname('..')
+sys.path.insert(0,parentdir)
+from src.data_reader import parse_protocols
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class BadRequestError(ValueError):
+    """ The body of a request is not valid. """
+    pass
+
+
+class NotFoundError(LookupError):
+    """ A protocol or endpoint requested is not available. """
+    pass
+
+
+class MicroBatcher():
+    """ Gather the documents sent by concurrent requests into batches.
+
+    Documents are queued and a single worker thread sends them to
+    predict_fn in batches of up to max_batch_size documents, waiting
+    at most max_wait seconds for a batch to be filled. Since only the
+    worker thread calls predict_fn, models are never used concurrently.
+    If a batch fails, its documents are predicted again one at a time,
+    so only the requests of the failing documents get the error.
+    """
+    def __init__(self, predict_fn, max_batch_size=16, max_wait=.05):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def predict(self, docs):
+        futures = []
+        for doc in docs:
+            future = Future()
+            self._queue.put((doc, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            docs = [doc for doc, _ in batch]
+            try:
+                results = self.predict_fn(docs)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                logger.warning(f'Batch of {len(batch)} documents failed ({e}), ' +
+                               'predicting them one at a time')
+                for doc, future in batch:
+                    self._predict_one(doc, future)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _predict_one(self, doc, future):
+        try:
+            result = self.predict_fn([doc])[0]
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+
+class PredictionService():
+    """ Models and helpers shared by every request sent to the server. """
+    def __init__(self, topics_batcher, summaries_batcher, scrapper):
+        self.topics_batcher = topics_batcher
+        self.summaries_batcher = summaries_batcher
+        self.scrapper = scrapper
+
+    def get_topics(self, body):
+        protocols_df = self._load_protocols_df(body)
+        topics = self.topics_batcher.predict(list(protocols_df['full_text_cleaned'].values))
+        return dict(_get_protocols_json_entries(protocols_df, topics))
+
+    def get_summaries(self, body):
+        if self.summaries_batcher is None:
+            raise NotFoundError("The server was started without a summarization model")
+        from run_track_summaries import _get_protocols_json_summaries
+
+        protocols_df = self._load_protocols_df(body)
+        protocols = list(protocols_df['full_text_no_abstract_cleaned'].values)
+        summaries = self.summaries_batcher.predict(protocols)
+        return dict(_get_protocols_json_summaries(protocols_df, summaries))
+
+    def _load_protocols_df(self, body):
+        """ Build the protocols dataframe from the input of a request.
+
+        Requests contain either a list of protocol urls ("urls"), an
+        object with the html of each protocol by id ("pages") or an
+        object with the text of each protocol by id ("texts").
+        """
+        if 'urls' in body:
+            urls = body['urls']
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                raise BadRequestError("The urls field must be a list of protocol urls")
+            try:
+                pages = self.scrapper.fetch_urls(urls)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    raise NotFoundError(f"Protocol {e.response.url} does not exist") from e
+                raise
+            return build_protocols_df(parse_protocols(pages.items()))
+        if 'pages' in body:
+            pages = _get_documents_field(body, 'pages')
+            try:
+                protocols = parse_protocols(pages.items())
+            except Exception as e:
+                # the parsers fail in many ways on pages that are not protocol pages
+                raise BadRequestError(f"The pages are not valid protocol pages: {e}") from e
+            return build_protocols_df(protocols)
+        if 'texts' in body:
+            texts = [clean(text) for text in _get_documents_field(body, 'texts').values()]
+            return pd.DataFrame({
+                'pr_id': list(body['texts'].keys()),
+                'title': '',
+                'authors': [[] for _ in texts],
+                'full_text_cleaned': texts,
+                'full_text_no_abstract_cleaned': texts
+            })
+        raise BadRequestError("Request body must contain one of the urls, pages or texts fields")
+
+
+def _get_documents_field(body, field):
+    documents = body[field]
+    if not isinstance(documents, dict) or \
+            not all(isinstance(document, str) for document in documents.values()):
+        raise BadRequestError(f"The {field} field must be an object with a string per protocol id")
+    return documents
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    ENDPOINTS = {
+        '/topics': PredictionService.get_topics,
+        '/summaries': PredictionService.get_summaries
+    }
+
+    def do_POST(self):
+        endpoint = self.ENDPOINTS.get(self.path.rstrip('/'))
+        if endpoint is None:
+            return self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(body, dict):
+                raise ValueError("Request body must be a JSON object")
+        except ValueError as e:
+            return self._send_json(400, {'error': str(e)})
+        try:
+            res = endpoint(self.server.service, body)
+        except BadRequestError as e:
+            return self._send_json(400, {'error': str(e)})
+        except NotFoundError as e:
+            return self._send_json(404, {'error': str(e)})
+        except Exception as e:
+            logger.exception('Error while processing request')
+            return self._send_json(500, {'error': str(e)})
+        self._send_json(200, res)
+
+    def address_string(self):
+        # clients connected through a unix socket have no address
+        return self.client_address[0] if self.client_address else 'unix-socket'
+
+    def _send_json(self, status, content):
+        data = json.dumps(content, indent=2, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service, host='127.0.0.1', port=8000, unix_socket=None):
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, PredictionRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), PredictionRequestHandler)
+    server.service = service
+    return server
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Serve topic and summary predictions for " +
+        "protocols over HTTP, keeping the models loaded between requests")
+    parser.add_argument('--host', default='127.0.0.1', help="Host the server listens on. " +
+        "By default, the server only listens on 127.0.0.1.")
+    parser.add_argument('-p', '--port', type=int, default=8000, help="Port the server listens on. " +
+        "By default, port 8000 is used.")
+    parser.add_argument('--unix-socket', default=None, help="If present, the server listens on " +
+        "this unix socket instead of a TCP port.")
+    parser.add_argument('-m', '--summary-model', default='distillbart_cnn_protocols',
+        help="Summarization model used by the /summaries endpoint. If no model is set, " +
+        "distillbart_cnn_protocols is used by default.")
+    parser.add_argument('--no-summaries', action='store_true', default=False, help="If present, " +
+        "no summarization model is loaded and the /summaries endpoint is disabled.")
+    parser.add_argument('--max-batch-size', type=int, default=16, help="Maximum number of " +
+        "documents sent together to a model. By default, up to 16 documents are batched.")
+    parser.add_argument('--max-wait', type=float, default=.05, help="Maximum number of seconds " +
+        "a document waits for a batch to be filled. By default, 0.05 seconds are used.")
+    parser.add_argument('--cache-dir', default=PAGE_CACHE_DIR, help="Directory where the downloaded " +
+        f"protocol pages are cached. If no directory is specified, {PAGE_CACHE_DIR} is used by default.")
+    parser.add_argument('--cache-ttl', type=float, default=86400, help="Number of seconds a cached " +
+        "page is used without revalidating it with the server. By default, pages are revalidated " +
+        "after one day.")
+    add_topic_cache_args(parser)
+    add_shared_docs_args(parser)
+    add_wikidata_store_args(parser)
+    return parser.parse_args()
+
+def main(args):
+    logger.info('Loading topic extraction model...')
+    # the model is loaded before serving, so the first requests do not wait for it
+    final_pipe = load_final_pipe(get_topic_cache_path(args), args.topic_cache_size,
+                                 shared_docs=get_shared_docs_options(args), lazy=False)
+    # protocol pages are fetched while topics are predicted, so the store is only used to predict them
+    topics_batcher = MicroBatcher(with_wikidata_store(final_pipe.transform, args), args.max_batch_size,
+                                  args.max_wait)
+    summaries_batcher = None
+    if not args.no_summaries:
+        from run_track_summaries import get_model_predictions, load_summary_model
+
+        logger.info('Loading summarization model...')
+        model, tokenizer = load_summary_model(args.summary_model)
+        summaries_batcher = MicroBatcher(lambda docs: get_model_predictions(model, tokenizer, docs),
+                                         args.max_batch_size, args.max_wait)
+    scrapper = BioProtocolScrapper(cache=PageCache(args.cache_dir, args.cache_ttl, PROTOCOLS_DIR))
+    service = PredictionService(topics_batcher, summaries_batcher, scrapper)
+    server = create_server(service, args.host, args.port, args.unix_socket)
+    logger.info(f'Serving predictions on {args.unix_socket or f"{args.host}:{args.port}"}...')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
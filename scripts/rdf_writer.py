@@ -0,0 +1,109 @@
+import hashlib
+
+from rdflib import Dataset, Graph, URIRef
+from rdflib.namespace import RDF
+
+from herc_common.utils import EDMA, ITSRDF, NIF
+
+
+STREAMING_RDF_FORMATS = {'nt', 'nquads', 'turtle'}
+
+
+class CollectionHasher():
+    """ Incrementally build the identifier of a collection of protocols.
+
+    The identifier is the sha1 of the id and text of every protocol
+    of the collection, in the order they were added.
+    """
+    def __init__(self):
+        self._sha1 = hashlib.sha1()
+
+    def update(self, pr_id, text):
+        self._sha1.update(f"{pr_id}\0{text}\0".encode('utf-8'))
+
+    def uri(self):
+        return URIRef(f"{EDMA}{self._sha1.hexdigest()}")
+
+
+class StreamingGraphWriter():
+    """ Write the NIF graph of a collection of protocols one protocol at a time.
+
+    The triples of each protocol are serialized as soon as it is added,
+    so only the context uris of the protocols are kept in memory. Since
+    the collection identifier depends on every protocol, the collection
+    triples are written when the writer is closed. With the nquads format,
+    the triples of each protocol are placed in a named graph identified
+    by its context, and the collection triples in the default graph. With
+    turtle, each protocol is written as a chunk that only repeats the
+    prefixes that were not declared before.
+    """
+    def __init__(self, f, format):
+        if format not in STREAMING_RDF_FORMATS:
+            raise ValueError(f"Results in {format} format can not be streamed")
+        self.f = f
+        self.format = format
+        self.hasher = CollectionHasher()
+        self.contexts = []
+        self._prefixes = {}
+
+    def add_protocol(self, pr_id, text, add_to_graph):
+        """ Write the triples of a protocol.
+
+        add_to_graph receives an empty graph, adds the triples of the
+        protocol to it and returns the uri of the protocol context.
+        """
+        g = create_nif_graph()
+        context_element = add_to_graph(g)
+        self.hasher.update(pr_id, text)
+        self.contexts.append(context_element)
+        self._write_graph(g, context_element)
+
+    def close(self):
+        g = create_nif_graph()
+        collection_element = self.hasher.uri()
+        g.add((collection_element, RDF.type, NIF.ContextCollection))
+        for context_element in self.contexts:
+            g.add((collection_element, NIF.hasContext, context_element))
+        self._write_graph(g, None)
+        self.f.flush()
+
+    def _write_graph(self, g, graph_name):
+        if self.format == 'turtle':
+            self._write_turtle_chunk(g)
+            return
+        if self.format == 'nquads' and graph_name is not None:
+            ds = Dataset()
+            named_graph = ds.graph(graph_name)
+            for triple in g:
+                named_graph.add(triple)
+            self.f.write(serialize_graph(ds, 'nquads'))
+            return
+        self.f.write(serialize_graph(g, 'nt'))
+
+    def _write_turtle_chunk(self, g):
+        # literals may contain line breaks, so only the header of the chunk is read as prefixes
+        lines = serialize_graph(g, 'turtle').split('\n')
+        num_prefix_lines = 0
+        while num_prefix_lines < len(lines) and lines[num_prefix_lines].startswith('@prefix'):
+            num_prefix_lines += 1
+        new_prefixes = []
+        for line in lines[:num_prefix_lines]:
+            prefix = line.split()[1]
+            if self._prefixes.get(prefix) != line:
+                self._prefixes[prefix] = line
+                new_prefixes.append(line)
+        statements = lines[num_prefix_lines:]
+        self.f.write('\n'.join(new_prefixes + statements).strip('\n') + '\n\n')
+
+
+def create_nif_graph():
+    g = Graph()
+    g.bind('edma', EDMA)
+    g.bind('itsrdf', ITSRDF)
+    g.bind('nif', NIF)
+    return g
+
+def serialize_graph(g, format):
+    data = g.serialize(format=format)
+    # older versions of rdflib return the serialized graph as bytes
+    return data.decode('utf-8') if isinstance(data, bytes) else data
@@ -0,0 +1,163 @@
+import csv
+import json
+import sys
+
+from contextlib import contextmanager
+
+
+RESULTS_FORMATS = {'csv', 'json', 'jsonl', 'parquet'}
+
+
+def get_results_columns(protocols_df, value_field, values, format):
+    """ Build the columns of the results of a batch of protocols.
+
+    The fields of the protocols are pulled from the dataframe once, as
+    whole columns, and followed by a column with the value computed for
+    each protocol. Since the csv format only has the protocol id and the
+    value, the other fields are not built for it. Authors are taken as
+    lists, and only the ones joined with '|', like in the protocols
+    dataframe saved by the notebooks, are split.
+    """
+    pr_ids = protocols_df['pr_id'].tolist()
+    columns = {'protocol_id': [str(pr_id) for pr_id in pr_ids]}
+    if format != 'csv':
+        columns['source_url'] = [f"https://bio-protocol.org/{pr_id}" for pr_id in pr_ids]
+        columns['authors'] = [authors.split('|') if isinstance(authors, str) else list(authors)
+                              for authors in protocols_df['authors'].tolist()]
+        columns['title'] = protocols_df['title'].tolist()
+    columns[value_field] = list(values)
+    return columns
+
+def iter_entries(columns):
+    """ Yield the (protocol id, entry) pair of each row of the columns. """
+    names = list(columns)[1:]
+    for pr_id, *values in zip(*columns.values()):
+        yield pr_id, dict(zip(names, values))
+
+def get_topics_parquet_type():
+    import pyarrow as pa
+
+    return pa.list_(pa.struct([
+        ('labels', pa.list_(pa.string())),
+        ('external_ids', pa.list_(pa.string())),
+        ('descriptions', pa.list_(pa.string())),
+        ('score', pa.float64())
+    ]))
+
+@contextmanager
+def open_output(out_file):
+    if out_file is None:
+        yield sys.stdout
+    else:
+        with open(out_file, 'w', encoding='utf-8') as f:
+            yield f
+
+@contextmanager
+def open_results_writer(out_file, format, value_field, get_value_type=None):
+    """ Open a writer of results in one of the RESULTS_FORMATS.
+
+    Results are written with the write method of the writer, which
+    receives the columns of a batch of protocols. get_value_type returns
+    the Arrow type of the value column, and is only used for parquet
+    output. If it is not set, values are stored as strings.
+    """
+    if format == 'parquet':
+        if out_file is None:
+            raise ValueError("Results in parquet format can only be written to a file")
+        writer = ParquetResultsWriter(out_file, value_field, get_value_type)
+        try:
+            yield writer
+        finally:
+            writer.close()
+        return
+    if format not in RESULTS_FORMATS:
+        raise ValueError(f"Unknown results format: {format}")
+    with open_output(out_file) as f:
+        if format == 'csv':
+            writer = CsvResultsWriter(f, ['protocol_id', value_field])
+        elif format == 'jsonl':
+            writer = JsonLinesResultsWriter(f)
+        else:
+            writer = JsonResultsWriter(f)
+        yield writer
+        writer.close()
+        if out_file is None and format == 'json':
+            f.write('\n')
+
+
+class CsvResultsWriter():
+    def __init__(self, f, fieldnames):
+        self.f = f
+        self.fieldnames = fieldnames
+        self.csvwriter = csv.writer(f)
+        self.csvwriter.writerow(fieldnames)
+
+    def write(self, columns):
+        self.csvwriter.writerows(zip(*(columns[name] for name in self.fieldnames)))
+        self.f.flush()
+
+    def close(self):
+        pass
+
+
+class JsonResultsWriter():
+    """ Write results as a JSON object with an entry per protocol id.
+
+    The output is the same one produced by json.dump with indent=2 for
+    the whole object, but entries are written one batch at a time.
+    """
+    def __init__(self, f):
+        self.f = f
+        self._separator = '{\n'
+
+    def write(self, columns):
+        for pr_id, entry in iter_entries(columns):
+            entry_json = json.dumps(entry, indent=2, ensure_ascii=False)
+            self.f.write(f"{self._separator}  {json.dumps(pr_id, ensure_ascii=False)}: " +
+                         entry_json.replace('\n', '\n  '))
+            self._separator = ',\n'
+        self.f.flush()
+
+    def close(self):
+        self.f.write('{}' if self._separator == '{\n' else '\n}')
+
+
+class JsonLinesResultsWriter():
+    """ Write results as JSON Lines, with an object per protocol. """
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, columns):
+        names = list(columns)
+        # without indent, json uses its C encoder
+        self.f.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n'
+                          for row in zip(*columns.values()))
+        self.f.flush()
+
+    def close(self):
+        pass
+
+
+class ParquetResultsWriter():
+    """ Write results as a Parquet file with a row group per batch. """
+    def __init__(self, out_file, value_field, get_value_type=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        value_type = get_value_type() if get_value_type is not None else pa.string()
+        self.schema = pa.schema([
+            ('protocol_id', pa.string()),
+            ('source_url', pa.string()),
+            ('authors', pa.list_(pa.string())),
+            ('title', pa.string()),
+            (value_field, value_type)
+        ])
+        self._writer = pq.ParquetWriter(out_file, self.schema)
+
+    def write(self, columns):
+        import pyarrow as pa
+
+        self._writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
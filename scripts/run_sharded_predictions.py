@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from common import NOTEBOOK_6_RESULTS_DIR, OUTPUT_FORMATS, load_final_pipe, load_protocols_corpus, \
+    add_labelling_args, add_metrics_args, add_shared_docs_args, add_topic_cache_args, \
+    add_wikidata_store_args, collect_metrics, get_final_pipe_path, get_labelling_options, \
+    get_pipe_options, get_shared_docs_options, get_topic_cache_path, setup_wikidata_store, show_results
+from instrumentation import Metrics, transform_documents
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SHARDS_DIR = os.path.join(NOTEBOOK_6_RESULTS_DIR, 'prediction_shards')
+# numeric libraries use a thread per core by default, which competes with the other workers
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+_worker_pipe = None
+_worker_metrics = None
+
+
+def get_shard_idx(pr_id, num_shards):
+    """ Assign a protocol to a shard from its id, so shards keep their protocols across runs. """
+    return zlib.crc32(str(pr_id).encode('utf-8')) % num_shards
+
+def split_shards(pr_ids, num_shards):
+    """ Return the positions of the protocols of each shard. """
+    shards = [[] for _ in range(num_shards)]
+    for pos, pr_id in enumerate(pr_ids):
+        shards[get_shard_idx(pr_id, num_shards)].append(pos)
+    return shards
+
+def get_run_key(shared_docs, labelling):
+    """ Identify the model and options that the topics of a run depend on. """
+    pipe_path = get_final_pipe_path()
+    stat = os.stat(pipe_path)
+    return ':'.join([os.path.abspath(pipe_path), str(stat.st_size), str(stat.st_mtime_ns)] +
+                    get_pipe_options(shared_docs, labelling))
+
+def get_shard_key(run_key, pr_ids, protocols):
+    sha1 = hashlib.sha1(run_key.encode('utf-8'))
+    for pr_id, text in zip(pr_ids, protocols):
+        sha1.update(f"\0{pr_id}\0{text}".encode('utf-8'))
+    return sha1.hexdigest()
+
+def get_checkpoint_path(checkpoint_dir, shard_idx, num_shards):
+    return os.path.join(checkpoint_dir, f"shard-{shard_idx:05d}-of-{num_shards:05d}.pkl")
+
+def load_checkpoint(path, shard_key):
+    """ Return the topics saved in a checkpoint, or None if it is missing or outdated. """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        key, topics = checkpoint['key'], checkpoint['topics']
+    except Exception:
+        # a damaged file can fail to unpickle in many ways, and the shard is predicted again anyway
+        logger.warning(f'Ignoring corrupted checkpoint {path}')
+        return None
+    return topics if key == shard_key else None
+
+def save_checkpoint(path, shard_key, topics):
+    # the checkpoint is written in full before replacing any previous one
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'key': shard_key, 'topics': topics}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def init_worker(args):
+    """ Load the topic extraction model once in each worker process. """
+    global _worker_pipe, _worker_metrics
+    _worker_metrics = Metrics(enabled=args.metrics_out is not None)
+    setup_wikidata_store(args)
+    _worker_pipe = load_final_pipe(get_topic_cache_path(args), args.topic_cache_size,
+                                   shared_docs=get_shared_docs_options(args),
+                                   labelling=get_labelling_options(args), metrics=_worker_metrics)
+
+def run_shard(checkpoint_path, shard_key, shard_ids, protocols, document_batch_size):
+    """ Predict and checkpoint the topics of a shard, and return them with the metrics of the shard. """
+    start = time.perf_counter()
+    topics = list(transform_documents(_worker_pipe.transform, protocols, shard_ids, _worker_metrics,
+                                      document_batch_size))
+    save_checkpoint(checkpoint_path, shard_key, topics)
+    return topics, time.perf_counter() - start, _worker_metrics.pop()
+
+def predict_shards(shards, pr_ids, protocols, run_key, args, metrics=None, initializer=init_worker):
+    """ Return the topics of every protocol, predicting only the shards without a valid checkpoint.
+
+    Shards are predicted in args.processes worker processes, set up by
+    calling initializer with args, and each one is checkpointed as soon
+    as it finishes. If a shard fails, the rest are still predicted and
+    checkpointed before raising an error. The metrics collected by the
+    workers are added to metrics.
+    """
+    metrics = metrics or Metrics(enabled=False)
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    topics = [None] * len(protocols)
+    pending = {}
+    for shard_idx, positions in enumerate(shards):
+        if not positions:
+            continue
+        shard_ids = [pr_ids[pos] for pos in positions]
+        shard_protocols = [protocols[pos] for pos in positions]
+        shard_key = get_shard_key(run_key, shard_ids, shard_protocols)
+        checkpoint_path = get_checkpoint_path(args.checkpoint_dir, shard_idx, len(shards))
+        shard_topics = None if args.restart else load_checkpoint(checkpoint_path, shard_key)
+        if shard_topics is None:
+            pending[shard_idx] = (checkpoint_path, shard_key, shard_ids, shard_protocols,
+                                  args.document_batch_size)
+        else:
+            for pos, protocol_topics in zip(positions, shard_topics):
+                topics[pos] = protocol_topics
+    num_shards = sum(1 for positions in shards if positions)
+    logger.info(f'{num_shards - len(pending)} of {num_shards} shards restored from ' +
+                f'{args.checkpoint_dir}, predicting {len(pending)} shards...')
+    if not pending:
+        return topics
+    for var in THREAD_ENV_VARS:
+        os.environ.setdefault(var, '1')
+    failed_shards = []
+    with ProcessPoolExecutor(max_workers=min(args.processes, len(pending)),
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=initializer, initargs=(args,)) as executor:
+        # larger shards are sent first, so no worker is left with a large one at the end
+        futures = {executor.submit(run_shard, *pending[shard_idx]): shard_idx
+                   for shard_idx in sorted(pending, key=lambda idx: len(shards[idx]), reverse=True)}
+        for num_done, future in enumerate(as_completed(futures), 1):
+            shard_idx = futures[future]
+            try:
+                shard_topics, elapsed, shard_metrics = future.result()
+            except Exception:
+                logger.exception(f'Shard {shard_idx} failed')
+                failed_shards.append(shard_idx)
+                continue
+            for pos, protocol_topics in zip(shards[shard_idx], shard_topics):
+                topics[pos] = protocol_topics
+            metrics.merge(shard_metrics)
+            logger.info(f'Shard {shard_idx} finished: {len(shard_topics)} protocols in ' +
+                        f'{elapsed:.1f}s ({num_done}/{len(pending)} shards)')
+    if failed_shards:
+        raise RuntimeError(f"Shards {sorted(failed_shards)} failed. Run the script again to " +
+                           "predict only the shards without a checkpoint.")
+    return topics
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Run predictions for the protocols track dataset " +
+        "in several processes, checkpointing the topics of each shard of protocols so interrupted " +
+        "runs can be resumed")
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, help="Output format of the results. " +
+        "If no output format is specified, results are returned in JSON by default.",
+        nargs='?', default='json')
+    parser.add_argument('-o', '--output', help="Name of the file where the results will be saved. " +
+        "If no output file is specified, results will be written to the console instead.",
+        nargs='?', default=None)
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count(), help="Number of " +
+        "worker processes, each of them loading the model once. By default, a process per core " +
+        "is used.")
+    parser.add_argument('-n', '--num-shards', type=int, default=64, help="Number of shards the " +
+        "protocols are split into by their id. Smaller shards lose less work when a run is " +
+        "interrupted. By default, 64 shards are used.")
+    parser.add_argument('--checkpoint-dir', default=SHARDS_DIR, help="Directory where the topics " +
+        f"of each finished shard are saved. If no directory is specified, {SHARDS_DIR} is used " +
+        "by default.")
+    parser.add_argument('--restart', action='store_true', default=False, help="If present, " +
+        "existing checkpoints are ignored and every shard is predicted again.")
+    add_topic_cache_args(parser)
+    add_shared_docs_args(parser)
+    add_labelling_args(parser)
+    add_wikidata_store_args(parser)
+    # the prediction runs in the worker processes, which are not profiled
+    add_metrics_args(parser, profile=False)
+    args = parser.parse_args()
+    # each process would start its own labelling or parsing processes on top of the others
+    if args.processes > 1 and (args.workers > 1 or args.nlp_processes > 1):
+        parser.error("--workers and --nlp-processes can not be combined with more than one " +
+                     "process (-p), which already use the available cores")
+    return args
+
+def main(args):
+    with collect_metrics(args) as metrics:
+        logger.info('Reading track dataset...')
+        with metrics.span('Reading track dataset'):
+            protocols_df = load_protocols_corpus(['pr_id', 'title', 'authors', 'full_text_cleaned'])
+        protocols = protocols_df['full_text_cleaned'].values
+        pr_ids = list(protocols_df['pr_id'].values)
+        shards = split_shards(pr_ids, args.num_shards)
+        run_key = get_run_key(get_shared_docs_options(args), get_labelling_options(args))
+        logger.info(f'Predicting topics of {len(protocols)} protocols in {args.processes} processes...')
+        start = time.perf_counter()
+        with metrics.span('Predicting topics'):
+            topics = predict_shards(shards, pr_ids, protocols, run_key, args, metrics)
+        logger.info(f'Topics predicted in {time.perf_counter() - start:.1f}s')
+        logger.info('Writting results...')
+        with metrics.span('Writting results'):
+            show_results(protocols_df, protocols, topics, args.output, args.format)
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
@@ -2,9 +2,11 @@ import argparse
 import logging
 import pickle
 
-import pandas as pd
-
-from common import PROTOCOLS_FILE_PATH, OUTPUT_FORMATS, load_final_pipe, show_results
+from common import OUTPUT_FORMATS, load_final_pipe, load_protocols_corpus, add_topic_cache_args, \
+    add_wikidata_store_args, add_shared_docs_args, add_labelling_args, add_metrics_args, \
+    collect_metrics, get_topic_cache_path, get_shared_docs_options, get_labelling_options, \
+    show_results, use_wikidata_store, PhaseTimer
+from instrumentation import transform_documents
 
 
 logging.basicConfig(level=logging.INFO)
@@ -18,18 +20,34 @@ def parseargs():
     parser.add_argument('-o', '--output', help="Name of the file where the results will be saved. " +
         "If no output file is specified, results will be written to the console instead.",
         nargs='?', default=None)
+    parser.add_argument('--profile-startup', action='store_true', default=False, help="If present, " +
+        "the time spent in each phase of the script is reported once it finishes.")
+    add_topic_cache_args(parser)
+    add_shared_docs_args(parser)
+    add_labelling_args(parser)
+    add_wikidata_store_args(parser)
+    add_metrics_args(parser)
     return parser.parse_args()
 
 def main(args):
-    logger.info('Reading track dataset...')
-    protocols_df = pd.read_pickle(PROTOCOLS_FILE_PATH)
-    logger.info('Loading topic extraction model...')
-    final_pipe = load_final_pipe()
-    protocols = protocols_df['full_text_cleaned'].values
-    logger.info('Predicting topics...')
-    topics = final_pipe.transform(protocols)
-    logger.info('Writting results...')
-    show_results(protocols_df, protocols, topics, args.output, args.format)
+    with collect_metrics(args) as metrics:
+        timer = PhaseTimer(enabled=args.profile_startup, metrics=metrics)
+        logger.info('Reading track dataset...')
+        with timer.phase('Reading track dataset'):
+            protocols_df = load_protocols_corpus(['pr_id', 'title', 'authors', 'full_text_cleaned'])
+        logger.info('Loading topic extraction model...')
+        final_pipe = load_final_pipe(get_topic_cache_path(args), args.topic_cache_size, timer,
+                                     get_shared_docs_options(args), get_labelling_options(args),
+                                     metrics)
+        protocols = protocols_df['full_text_cleaned'].values
+        logger.info('Predicting topics...')
+        with timer.phase('Predicting topics'), use_wikidata_store(args):
+            topics = transform_documents(final_pipe.transform, protocols, protocols_df['pr_id'].values,
+                                         metrics, args.document_batch_size)
+        logger.info('Writting results...')
+        with timer.phase('Writting results'):
+            show_results(protocols_df, protocols, topics, args.output, args.format)
+        timer.report()
 
 if __name__ == '__main__':
     args = parseargs()
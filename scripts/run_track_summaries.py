@@ -1,8 +1,9 @@
 import argparse
-import joblib
+import functools
 import logging
 import pickle
 import os
+import re
 
 import pandas as pd
 import torch
@@ -12,8 +13,12 @@ from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 from rdflib import BNode, Graph, Literal, Namespace, URIRef
 from rdflib.namespace import RDF, RDFS
 
-from common import PROTOCOLS_FILE_PATH, OUTPUT_FORMATS, RDF_FORMATS, load_final_pipe, _write_json_contents
+from common import OUTPUT_FORMATS, RDF_FORMATS, STREAMED_RDF_FORMATS, load_final_pipe, \
+    load_protocols_corpus, add_metrics_args, collect_metrics
 from herc_common.utils import EDMA, ITSRDF, NIF
+from instrumentation import transform_documents
+from rdf_writer import CollectionHasher, StreamingGraphWriter, create_nif_graph, serialize_graph
+from results_writer import get_results_columns, iter_entries, open_output, open_results_writer
 
 DEFAULT_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
@@ -22,6 +27,11 @@ BASE_MODEL_DIR = os.path.join(DATA_DIR, 'text_summarization_models')
 SUMMARY_MODELS = ['facebook/bart-large-cnn',
                   'distillbart_cnn_protocols',
                   'distillbart_xsum_protocols']
+SUMMARY_BACKENDS = ['torch', 'quantized', 'onnx']
+QUANTIZED_MODEL_FILE_NAME = 'model.pt'
+LONG_DOCUMENT_MODES = ['truncate', 'map-reduce']
+MAX_MAP_REDUCE_ROUNDS = 4
+SENTENCE_BOUNDARY_REGEX = re.compile(r'(?<=[.!?;])\s+')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,119 +42,243 @@ def chunks(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i : i + n]
 
-def trim_batch(input_ids, pad_token_id, attention_mask=None):
-    """Remove columns that are populated exclusively by pad_token_id"""
-    keep_column_mask = input_ids.ne(pad_token_id).any(dim=0)
-    if attention_mask is None:
-        return input_ids[:, keep_column_mask]
-    else:
-        return (input_ids[:, keep_column_mask], attention_mask[:, keep_column_mask])
-
-def get_model_predictions(model, tokenizer, x):
-    return [_predict(model, tokenizer, doc) for doc in x]
-
-def _predict(model, tokenizer, doc):
-    batch = tokenizer(doc, return_tensors="pt", truncation=True, padding="max_length").to(DEFAULT_DEVICE)
-    input_ids, attention_mask = trim_batch(**batch, pad_token_id=tokenizer.pad_token_id)
-    summaries = model.generate(
-        input_ids=input_ids,
-        attention_mask=attention_mask,
-        decoder_start_token_id=None
-    )
-    dec = tokenizer.batch_decode(summaries, skip_special_tokens=True, clean_up_tokenization_spaces=False)
-    return dec[0]
-
-def compute_summaries(protocols, model_name):
-    model_path = name if 'distillbart' not in model_name \
+def length_sorted_batches(lengths, batch_size, max_tokens=None):
+    """Yield batches of indices of the documents sorted by decreasing length.
+
+    Each batch has at most batch_size documents and, if max_tokens is
+    set, at most max_tokens tokens once padded to its longest document.
+    Documents longer than max_tokens are placed in a batch of their own.
+    """
+    order = sorted(range(len(lengths)), key=lambda idx: lengths[idx], reverse=True)
+    if max_tokens is None:
+        yield from chunks(order, batch_size)
+        return
+    batch = []
+    for idx in order:
+        # the first document of a batch is its longest one
+        padded_length = lengths[batch[0]] if batch else lengths[idx]
+        if batch and (len(batch) == batch_size or (len(batch) + 1) * padded_length > max_tokens):
+            yield batch
+            batch = []
+        batch.append(idx)
+    if batch:
+        yield batch
+
+def get_model_predictions(model, tokenizer, x, batch_size=8, max_tokens=None):
+    x = list(x)
+    lengths = [len(input_ids) for input_ids in tokenizer(x, truncation=True)['input_ids']]
+    res = [None] * len(x)
+    for batch_idxs in length_sorted_batches(lengths, batch_size, max_tokens):
+        summaries = _predict_batch(model, tokenizer, [x[idx] for idx in batch_idxs])
+        for idx, summary in zip(batch_idxs, summaries):
+            res[idx] = summary
+    return res
+
+def _predict_batch(model, tokenizer, docs):
+    batch = tokenizer(docs, return_tensors="pt", truncation=True, padding="longest").to(model.device)
+    with torch.inference_mode():
+        summaries = model.generate(
+            input_ids=batch['input_ids'],
+            attention_mask=batch['attention_mask'],
+            decoder_start_token_id=None
+        )
+    return tokenizer.batch_decode(summaries, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+
+def split_windows(tokenizer, doc, window_tokens):
+    """Split a document into windows of at most window_tokens tokens.
+
+    Windows are made of whole sentences, split after a '.', '!', '?'
+    or ';' followed by whitespace. Cleaned protocols have no step
+    boundaries left, so a sentence longer than window_tokens is split
+    between its words instead, and only a single word longer than that
+    makes a window of its own.
+    """
+    sentences = [sentence for sentence in SENTENCE_BOUNDARY_REGEX.split(doc) if sentence]
+    if not sentences:
+        return [doc]
+    pieces = []
+    for sentence, length in zip(sentences, _get_piece_lengths(tokenizer, sentences)):
+        if length <= window_tokens:
+            pieces.append((sentence, length))
+            continue
+        words = sentence.split()
+        pieces.extend(_pack_pieces(list(zip(words, _get_piece_lengths(tokenizer, words))),
+                                   window_tokens))
+    return [window for window, _ in _pack_pieces(pieces, window_tokens)]
+
+def _get_piece_lengths(tokenizer, pieces):
+    # pieces are preceded by a space once joined in a window
+    return [len(input_ids) for input_ids in
+            tokenizer([' ' + piece for piece in pieces], add_special_tokens=False)['input_ids']]
+
+def _pack_pieces(pieces, max_length):
+    """Join consecutive (text, length) pieces into pieces of at most max_length tokens."""
+    packed = []
+    texts = []
+    packed_length = 0
+    for text, length in pieces:
+        if texts and packed_length + length > max_length:
+            packed.append((' '.join(texts), packed_length))
+            texts = []
+            packed_length = 0
+        texts.append(text)
+        packed_length += length
+    if texts:
+        packed.append((' '.join(texts), packed_length))
+    return packed
+
+def get_map_reduce_predictions(model, tokenizer, x, batch_size=8, max_tokens=None, window_tokens=None,
+                               max_rounds=MAX_MAP_REDUCE_ROUNDS):
+    """Summarize documents of any length without truncating them.
+
+    Documents longer than the input of the model are split into windows
+    that are summarized in batches, and the summaries of the windows of
+    each document are joined and summarized again until they fit in a
+    single window. If the joined summaries of a document are not shorter
+    than the document they come from (e.g. when the windows are shorter
+    than the summaries), or they do not fit after max_rounds rounds, they
+    are summarized once more with truncation.
+    """
+    if window_tokens is None:
+        max_input_length = min(tokenizer.model_max_length, model.config.max_position_embeddings)
+        window_tokens = max_input_length - tokenizer.num_special_tokens_to_add()
+    res = list(x)
+    pending_idxs = list(range(len(res)))
+    truncated_idxs = []
+    for _ in range(max_rounds):
+        if not pending_idxs:
+            break
+        doc_windows = [split_windows(tokenizer, res[idx], window_tokens) for idx in pending_idxs]
+        summaries = iter(get_model_predictions(model, tokenizer,
+                                               [window for windows in doc_windows for window in windows],
+                                               batch_size, max_tokens))
+        next_pending_idxs = []
+        for idx, windows in zip(pending_idxs, doc_windows):
+            summary = ' '.join(next(summaries) for _ in windows)
+            if len(windows) > 1:
+                if _get_length(tokenizer, summary) < _get_length(tokenizer, res[idx]):
+                    next_pending_idxs.append(idx)
+                else:
+                    truncated_idxs.append(idx)
+            res[idx] = summary
+        pending_idxs = next_pending_idxs
+    truncated_idxs += pending_idxs
+    if truncated_idxs:
+        logger.warning(f'The summaries of {len(truncated_idxs)} protocols could not be reduced to ' +
+                       f'a window of {window_tokens} tokens, so they are truncated')
+        summaries = get_model_predictions(model, tokenizer, [res[idx] for idx in truncated_idxs],
+                                          batch_size, max_tokens)
+        for idx, summary in zip(truncated_idxs, summaries):
+            res[idx] = summary
+    return res
+
+def _get_length(tokenizer, doc):
+    return len(tokenizer(doc, add_special_tokens=False)['input_ids'])
+
+def get_model_path(model_name):
+    return model_name if 'distillbart' not in model_name \
                       else os.path.join(os.path.join(BASE_MODEL_DIR, model_name), 'best_tfmr')
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_path).to(DEFAULT_DEVICE)
-    tokenizer = AutoTokenizer.from_pretrained(model_path)
-    return get_model_predictions(model, tokenizer, protocols)
+
+def get_exported_model_dir(model_name, backend):
+    return os.path.join(BASE_MODEL_DIR, model_name.replace('/', '_'), backend)
+
+def load_summary_model(model_name, backend='torch'):
+    """ Load a summarization model and its tokenizer.
+
+    The quantized and onnx backends load the versions of the model
+    written by export_summary_models.py, which are meant to speed up
+    the computation of summaries on CPU.
+    """
+    if backend == 'torch':
+        model_path = get_model_path(model_name)
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_path).to(DEFAULT_DEVICE)
+        return model, AutoTokenizer.from_pretrained(model_path)
+    model_dir = get_exported_model_dir(model_name, backend)
+    if not os.path.isdir(model_dir):
+        raise FileNotFoundError(f"No {backend} version of {model_name} was found in {model_dir}. " +
+                                "It can be created with the export_summary_models.py script.")
+    if backend == 'quantized':
+        # quantized modules are pickled as a whole, since they can not be rebuilt from a config
+        model = torch.load(os.path.join(model_dir, QUANTIZED_MODEL_FILE_NAME), weights_only=False)
+    elif backend == 'onnx':
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_dir)
+    else:
+        raise ValueError(f"Unknown summarization backend: {backend}")
+    return model, AutoTokenizer.from_pretrained(model_dir)
+
+def compute_summaries(protocols, model_name, batch_size=8, max_tokens=None, backend='torch',
+                      long_document_mode='truncate', window_tokens=None):
+    model, tokenizer = load_summary_model(model_name, backend)
+    return predict_summaries(model, tokenizer, protocols, batch_size, max_tokens, long_document_mode,
+                             window_tokens)
+
+def predict_summaries(model, tokenizer, protocols, batch_size=8, max_tokens=None,
+                      long_document_mode='truncate', window_tokens=None):
+    if long_document_mode == 'map-reduce':
+        return get_map_reduce_predictions(model, tokenizer, protocols, batch_size, max_tokens,
+                                          window_tokens)
+    return get_model_predictions(model, tokenizer, protocols, batch_size, max_tokens)
 
 def show_summary_results(protocols_df, protocols, summaries, out_file, format):
     if format in RDF_FORMATS:
         show_protocols_graph_summaries(protocols_df, protocols, summaries, format, out_file)
-    elif format == 'csv':
-        show_protocols_csv_summaries(protocols_df, protocols, summaries, out_file)
     else:
-        show_protocols_json_summaries(protocols_df, protocols, summaries, out_file)
+        show_protocols_table_summaries(protocols_df, summaries, format, out_file)
 
-def create_protocols_summary_graph(protocols_df, protocols, summaries):
-    g = Graph()
-    g.bind('edma', EDMA)
-    g.bind('itsrdf', ITSRDF)
-    g.bind('nif', NIF)
-    collection_element = URIRef(f"{EDMA}{joblib.hash(protocols_df)}")
-    g.add((collection_element, RDF.type, NIF.ContextCollection))
-    for idx, summary in enumerate(summaries):
-        text = protocols[idx]
-        protocols_row = protocols_df.loc[idx]
-        pr_id = protocols_row['pr_id']
-        uri = f"https://bio-protocol.org/{pr_id}"
+def add_protocol_summary_to_graph(uri, pr_id, text, summary, g):
+    context_element = URIRef(f"{EDMA}{pr_id}")
+    text_element = Literal(text)
+    g.add((context_element, NIF.isString, text_element))
+    g.add((context_element, NIF.sourceURL, URIRef(uri)))
+    g.add((context_element, NIF.predominantLanguage, Literal('en')))
 
-        context_element = URIRef(f"{EDMA}{pr_id}")
-        text_element = Literal(text)
-        g.add((context_element, NIF.isString, text_element))
-        g.add((context_element, NIF.sourceURL, URIRef(uri)))
-        g.add((context_element, NIF.predominantLanguage, Literal('en')))
+    summary_element = BNode()
+    g.add((summary_element, RDF.type, NIF.Context))
+    g.add((summary_element, NIF.isString, Literal(summary)))
+    g.add((context_element, NIF.inter, summary_element))
+    return context_element
 
-        summary_element = BNode()
-        g.add((summary_element, RDF.type, NIF.Context))
-        g.add((summary_element, NIF.isString, Literal(summary)))
-        g.add((context_element, NIF.inter, summary_element))
+def create_protocols_summary_graph(protocols_df, protocols, summaries):
+    g = create_nif_graph()
+    hasher = CollectionHasher()
+    context_elements = []
+    for pr_id, text, summary in zip(protocols_df['pr_id'].values, protocols, summaries):
+        uri = f"https://bio-protocol.org/{pr_id}"
+        context_elements.append(add_protocol_summary_to_graph(uri, pr_id, text, summary, g))
+        hasher.update(pr_id, text)
+    collection_element = hasher.uri()
+    g.add((collection_element, RDF.type, NIF.ContextCollection))
+    for context_element in context_elements:
         g.add((collection_element, NIF.hasContext, context_element))
     return g
 
-def load_final_pipe():
-    import string
-    import en_core_sci_lg
-    from collections import Counter
-    from tqdm import tqdm
-
-    en_core_sci_lg.load()
-    return load_object(FINAL_PIPE_FILE_PATH)
-
-def show_protocols_csv_results(protocols_df, protocols, summaries, out_file):
-    fieldnames = ['protocol_id', 'summary']
-    if out_file is not None:
-        with open(out_file, 'w', encoding='utf-8') as f:
-            csvwriter = csv.DictWriter(f, fieldnames=fieldnames)
-            _write_csv_contents(csvwriter, protocols_df, protocols, topics)
-    else:
-        csvwriter = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-        _write_csv_contents(csvwriter, protocols_df, protocols, topics)
-
 def show_protocols_graph_summaries(protocols_df, protocols, summaries, format, out_file):
+    if format in STREAMED_RDF_FORMATS:
+        _stream_graph_summaries(protocols_df, protocols, summaries, format, out_file)
+        return
     g = create_protocols_summary_graph(protocols_df, protocols, summaries)
     if out_file is not None:
         g.serialize(destination=out_file, format=format)
     else:
-        print(g.serialize(format=format).decode("utf-8"))
-
-def show_protocols_json_summaries(protocols_df, protocols, summaries, out_file):
-    res = {}
-    for idx, summary in enumerate(summaries):
-        protocol_row = protocols_df.loc[idx]
-        protocol_id = protocol_row['pr_id']
-        protocol_title = protocol_row['title']
-        protocol_authors = protocol_row['authors'].split('|')
-        source_url = f"https://bio-protocol.org/{protocol_id}"
-        res[str(protocol_id)] = {
-            'source_url': source_url,
-            'authors': protocol_authors,
-            'title': protocol_title,
-            'summary': summary
-        }
-    _write_json_contents(res, out_file)
-
-def _write_csv_contents(csvwriter, protocols_df, protocols, summaries):
-    csvwriter.writeheader()
-    for idx, summary in enumerate(summaries):
-        protocol_id = protocols_df.loc[idx]['pr_id']
-        csvwriter.writerow({
-            'protocol_id': protocol_id,
-            'summary': summary
-        })
+        print(serialize_graph(g, format))
+
+def _stream_graph_summaries(protocols_df, protocols, summaries, format, out_file):
+    with open_output(out_file) as f:
+        writer = StreamingGraphWriter(f, format)
+        for pr_id, text, summary in zip(protocols_df['pr_id'].values, protocols, summaries):
+            uri = f"https://bio-protocol.org/{pr_id}"
+            writer.add_protocol(pr_id, text, functools.partial(add_protocol_summary_to_graph, uri,
+                                                               pr_id, text, summary))
+        writer.close()
+
+def show_protocols_table_summaries(protocols_df, summaries, format, out_file):
+    with open_results_writer(out_file, format, 'summary') as writer:
+        writer.write(get_results_columns(protocols_df, 'summary', summaries, format))
+
+def _get_protocols_json_summaries(protocols_df, summaries):
+    return iter_entries(get_results_columns(protocols_df, 'summary', summaries, 'json'))
 
 def parseargs():
     parser = argparse.ArgumentParser(description="Run predictions for the protocol track dataset")
@@ -157,16 +291,45 @@ def parseargs():
     parser.add_argument('-o', '--output', help="Name of the file where the results will be saved. " +
         "If no output file is specified, results will be written to the console instead.",
         nargs='?', default=None)
+    parser.add_argument('-b', '--batch-size', type=int, default=8, help="Maximum number of " +
+        "protocols summarized together. By default, up to 8 protocols are batched.")
+    parser.add_argument('--max-tokens', type=int, default=None, help="Maximum number of tokens " +
+        "in a batch once padded to its longest protocol. By default, batches are only limited " +
+        "by their number of protocols.")
+    parser.add_argument('--backend', choices=SUMMARY_BACKENDS, default='torch', help="Backend used " +
+        "to run the summarization model. The quantized and onnx backends require the model to be " +
+        "exported first with export_summary_models.py. By default, the torch backend is used.")
+    parser.add_argument('--long-documents', choices=LONG_DOCUMENT_MODES, default='truncate',
+        help="How protocols longer than the input of the model are summarized. With truncate, " +
+        "the end of the protocol is ignored. With map-reduce, the protocol is split into windows " +
+        "whose summaries are summarized again. By default, protocols are truncated.")
+    parser.add_argument('--window-tokens', type=int, default=None, help="Maximum number of tokens " +
+        "of each window in the map-reduce mode. By default, the maximum input length of the model " +
+        "is used.")
+    add_metrics_args(parser)
     return parser.parse_args()
 
 def main(args):
-    logger.info('Reading track dataset...')
-    protocols_df = pd.read_pickle(PROTOCOLS_FILE_PATH)
-    protocols = protocols_df['full_text_no_abstract_cleaned'].values
-    logger.info('Predicting topics...')
-    summaries = compute_summaries(protocols, args.model)
-    logger.info('Writting results...')
-    show_summary_results(protocols_df, protocols, summaries, args.output, args.format)
+    with collect_metrics(args) as metrics:
+        logger.info('Reading track dataset...')
+        with metrics.span('Reading track dataset'):
+            protocols_df = load_protocols_corpus(['pr_id', 'title', 'authors',
+                                                  'full_text_no_abstract_cleaned'])
+        protocols = protocols_df['full_text_no_abstract_cleaned'].values
+        logger.info('Loading summarization model...')
+        with metrics.span('Loading summarization model'):
+            model, tokenizer = load_summary_model(args.model, args.backend)
+        logger.info('Computing summaries...')
+        with metrics.span('Computing summaries'):
+            predict = functools.partial(predict_summaries, model, tokenizer, batch_size=args.batch_size,
+                                        max_tokens=args.max_tokens,
+                                        long_document_mode=args.long_documents,
+                                        window_tokens=args.window_tokens)
+            summaries = transform_documents(predict, protocols, protocols_df['pr_id'].values, metrics,
+                                            args.document_batch_size, stage='summarize')
+        logger.info('Writting results...')
+        with metrics.span('Writting results'):
+            show_summary_results(protocols_df, protocols, summaries, args.output, args.format)
 
 if __name__ == '__main__':
     args = parseargs()
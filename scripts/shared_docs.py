@@ -0,0 +1,108 @@
+import logging
+
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class ParsedDocsNlp():
+    """ Stand-in of a spaCy model that returns already parsed documents.
+
+    Texts parsed beforehand are returned without running the model
+    again, and any other text or attribute is handled by the wrapped
+    model. The returned documents are shared, so they must not be
+    modified by the components that receive them.
+    """
+    def __init__(self, nlp, docs):
+        self.nlp = nlp
+        self.docs = docs
+
+    def __call__(self, text, *args, **kwargs):
+        if not args and not kwargs and text in self.docs:
+            return self.docs[text]
+        return self.nlp(text, *args, **kwargs)
+
+    def pipe(self, texts, *args, **kwargs):
+        for text in texts:
+            yield self(text)
+
+    def __getattr__(self, name):
+        return getattr(self.nlp, name)
+
+
+class SharedDocsPipe():
+    """ Wrap the topic extraction pipeline to parse each document only once.
+
+    The NER and LDA branches of the pipeline hold their own spaCy
+    model and parse every document separately, one at a time. Before
+    the pipeline is run, each distinct document is parsed once with
+    nlp.pipe, in batches of batch_size documents and n_process processes,
+    and the models of every step are replaced with a ParsedDocsNlp that
+    returns those documents. Documents are parsed and run through the
+    pipeline max_docs at a time, so only the parsed documents of those
+    are kept in memory. Components in disable are not run. The results
+    are the same ones returned by the wrapped pipeline, as long as the
+    disabled components are not used by any step.
+    """
+    def __init__(self, final_pipe, batch_size=32, n_process=1, disable=(), max_docs=1024):
+        self.final_pipe = final_pipe
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.disable = list(disable)
+        self.max_docs = max_docs
+        self.nlp_attrs = find_nlp_attrs(final_pipe)
+        if not self.nlp_attrs:
+            logger.warning('No spaCy model was found in the steps of the topic extraction model, ' +
+                           'so each step parses the protocols on its own')
+
+    def transform(self, X):
+        if not self.nlp_attrs:
+            return self.final_pipe.transform(X)
+        X = list(X)
+        results = []
+        for chunk_start in range(0, len(X), self.max_docs):
+            chunk = X[chunk_start:chunk_start + self.max_docs]
+            with self._parsed_docs(chunk):
+                results.extend(self.final_pipe.transform(chunk))
+        return results
+
+    @contextmanager
+    def _parsed_docs(self, X):
+        texts = list(dict.fromkeys(X))
+        docs_by_model = {}
+        for step, attr, nlp in self.nlp_attrs:
+            key = get_nlp_key(nlp)
+            if key not in docs_by_model:
+                docs_by_model[key] = dict(zip(texts, nlp.pipe(texts, batch_size=self.batch_size,
+                                                              n_process=self.n_process,
+                                                              disable=self.disable)))
+            setattr(step, attr, ParsedDocsNlp(nlp, docs_by_model[key]))
+        try:
+            yield
+        finally:
+            for step, attr, nlp in self.nlp_attrs:
+                setattr(step, attr, nlp)
+
+
+def find_nlp_attrs(estimator):
+    """ Return the (step, attribute, model) of the spaCy models used by a pipeline.
+
+    Pipelines and feature unions are explored recursively, and models
+    are looked up in the attributes of each of their steps.
+    """
+    from spacy.language import Language
+
+    if hasattr(estimator, 'steps'):
+        children = [step for _, step in estimator.steps]
+    elif hasattr(estimator, 'transformer_list'):
+        children = [transformer for _, transformer in estimator.transformer_list]
+    else:
+        return [(estimator, attr, value) for attr, value in getattr(estimator, '__dict__', {}).items()
+                if isinstance(value, Language)]
+    return [nlp_attr for child in children for nlp_attr in find_nlp_attrs(child)]
+
+def get_nlp_key(nlp):
+    """ Identify the models that give the same documents, even if they were loaded separately. """
+    return (nlp.meta.get('lang'), nlp.meta.get('name'), nlp.meta.get('version'),
+            tuple(nlp.pipe_names))
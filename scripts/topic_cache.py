@@ -0,0 +1,123 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+
+
+class TopicCache():
+    """ On-disk store of the topics predicted for each document.
+
+    Entries are pickled topic lists saved in a SQLite database and
+    keyed by the hash of the document text and the fingerprint of
+    the pipeline that produced them, so results from an older model
+    are never returned. Once the size of the stored entries goes over
+    max_size bytes, the least recently used ones are evicted. The cache
+    can be shared by several processes, like the workers of
+    run_sharded_predictions.py.
+    """
+    def __init__(self, db_path, max_size=1024 ** 3):
+        self.db_path = db_path
+        self.max_size = max_size
+        self._pid = None
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS topics (key TEXT PRIMARY KEY, "
+                          "value BLOB, size INTEGER, last_access REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS topics_last_access ON topics (last_access)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS fingerprints (path TEXT PRIMARY KEY, "
+                          "size INTEGER, mtime INTEGER, fingerprint TEXT)")
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        # sqlite connections cannot be used after a fork, so each process opens its own
+        if self._pid != os.getpid():
+            # the cache can be created and used from different threads, but never concurrently
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_many(self, keys):
+        res = {}
+        for start in range(0, len(keys), 500):
+            keys_chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(keys_chunk))
+            rows = self.conn.execute(f"SELECT key, value FROM topics WHERE key IN ({placeholders})",
+                                     keys_chunk)
+            res.update((key, pickle.loads(value)) for key, value in rows)
+        now = time.time()
+        self.conn.executemany("UPDATE topics SET last_access = ? WHERE key = ?",
+                              [(now, key) for key in res])
+        self.conn.commit()
+        return res
+
+    def put_many(self, items):
+        now = time.time()
+        rows = []
+        for key, topics in items:
+            value = pickle.dumps(topics, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((key, value, len(value), now))
+        self.conn.executemany("INSERT OR REPLACE INTO topics VALUES (?, ?, ?, ?)", rows)
+        self._evict()
+        self.conn.commit()
+
+    def file_fingerprint(self, path):
+        """ Return the sha1 of the file, only hashing it again if it changed. """
+        # common imports this module
+        from common import get_file_signature
+
+        signature = get_file_signature(path, with_hash=False)
+        row = self.conn.execute("SELECT size, mtime, fingerprint FROM fingerprints WHERE path = ?",
+                                (os.path.abspath(path),)).fetchone()
+        if row is not None and row[:2] == (signature['size'], signature['mtime']):
+            return row[2]
+        signature = get_file_signature(path)
+        self.conn.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                          (os.path.abspath(path), signature['size'], signature['mtime'],
+                           signature['sha1']))
+        self.conn.commit()
+        return signature['sha1']
+
+    def _evict(self):
+        total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM topics").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        rows = self.conn.execute("SELECT key, size FROM topics ORDER BY last_access")
+        evicted_keys = []
+        for key, size in rows:
+            if total_size <= self.max_size:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        self.conn.executemany("DELETE FROM topics WHERE key = ?", evicted_keys)
+
+
+class CachedTopicPipe():
+    """ Wrap the topic extraction pipeline with a TopicCache.
+
+    Only the documents whose topics are not cached yet are sent
+    to the pipeline, and repeated documents are only predicted once.
+    The results are the same ones returned by the wrapped pipeline.
+    """
+    def __init__(self, final_pipe, cache, pipe_fingerprint):
+        self.final_pipe = final_pipe
+        self.cache = cache
+        self.pipe_fingerprint = pipe_fingerprint
+
+    def transform(self, X):
+        keys = [self._get_key(doc) for doc in X]
+        cached_topics = self.cache.get_many(list(set(keys)))
+        missing_docs = {}
+        for key, doc in zip(keys, X):
+            if key not in cached_topics:
+                missing_docs.setdefault(key, doc)
+        if missing_docs:
+            predicted_topics = self.final_pipe.transform(list(missing_docs.values()))
+            new_topics = list(zip(missing_docs.keys(), predicted_topics))
+            self.cache.put_many(new_topics)
+            cached_topics.update(new_topics)
+        return [cached_topics[key] for key in keys]
+
+    def _get_key(self, doc):
+        doc_hash = hashlib.sha1(doc.encode('utf-8')).hexdigest()
+        return f"{self.pipe_fingerprint}:{doc_hash}"
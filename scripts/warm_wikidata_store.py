@@ -0,0 +1,38 @@
+import argparse
+import bz2
+import gzip
+import logging
+
+from common import WIKIDATA_STORE_FILE_PATH
+from wikidata_store import WikidataStore
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Add the entities of a Wikidata JSON dump to " +
+        "the Wikidata store, so they are never requested to Wikidata")
+    parser.add_argument('input', help="Wikidata JSON dump, with an entity per line. It can be " +
+        "compressed with gzip or bzip2.")
+    parser.add_argument('-s', '--store', default=WIKIDATA_STORE_FILE_PATH, help="Wikidata store " +
+        f"to be warmed. If no file is specified, {WIKIDATA_STORE_FILE_PATH} is used by default.")
+    return parser.parse_args()
+
+def main(args):
+    store = WikidataStore(args.store)
+    logger.info(f'Reading entities from {args.input}...')
+    with open_dump(args.input) as f:
+        num_entities = store.warm_from_dump(f)
+    logger.info(f'{num_entities} entities added to {args.store}')
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
@@ -0,0 +1,79 @@
+import argparse
+import json
+import logging
+
+import requests
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import WIKIDATA_STORE_FILE_PATH
+from wikidata_store import WikidataStore
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class WikidataEndpointRequestHandler(BaseHTTPRequestHandler):
+    """ Answer Wikidata API requests with the responses of a WikidataStore.
+
+    Requests are sent to /<host>/<path>, like the ones sent by a
+    WikidataStoreAdapter with an endpoint, and requests whose response
+    is not stored get a 404 error.
+    """
+    def do_GET(self):
+        self._send_stored_response()
+
+    def do_POST(self):
+        self._send_stored_response()
+
+    def _send_stored_response(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else None
+        url = f"https://{self.path.lstrip('/')}"
+        request = requests.Request(self.command, url, data=body,
+                                   headers={'Content-Type': self.headers.get('Content-Type', '')})
+        stored_response = self.server.store.lookup(request.prepare())
+        if stored_response is None:
+            content_type = 'application/json; charset=utf-8'
+            data = json.dumps({'error': f"{url} is not available in the Wikidata store"}).encode('utf-8')
+            status = 404
+        else:
+            content_type, data = stored_response
+            status = 200
+        self.send_response(status)
+        self.send_header('Content-Type', content_type or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def create_server(store, host='127.0.0.1', port=8001):
+    server = ThreadingHTTPServer((host, port), WikidataEndpointRequestHandler)
+    server.store = store
+    return server
+
+def parseargs():
+    parser = argparse.ArgumentParser(description="Serve the responses of a Wikidata store as a " +
+        "local stand-in of the Wikidata API, for tests and runs without network access")
+    parser.add_argument('-s', '--store', default=WIKIDATA_STORE_FILE_PATH, help="Wikidata store " +
+        f"to be served. If no file is specified, {WIKIDATA_STORE_FILE_PATH} is used by default.")
+    parser.add_argument('--host', default='127.0.0.1', help="Host the server listens on. " +
+        "By default, the server only listens on 127.0.0.1.")
+    parser.add_argument('-p', '--port', type=int, default=8001, help="Port the server listens on. " +
+        "By default, port 8001 is used.")
+    return parser.parse_args()
+
+def main(args):
+    server = create_server(WikidataStore(args.store), args.host, args.port)
+    logger.info(f'Serving {args.store} on {args.host}:{args.port}...')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    args = parseargs()
+    exit(main(args))
@@ -0,0 +1,292 @@
+import hashlib
+import io
+import json
+import os
+import re
+import socket
+import sqlite3
+import threading
+import urllib.request
+import urllib.response
+
+import requests
+
+from contextlib import contextmanager
+from http.client import HTTPMessage
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+
+WIKIDATA_URL_PREFIXES = ('https://www.wikidata.org/', 'https://query.wikidata.org/')
+WIKIDATA_DOMAIN = 'wikidata.org'
+ENTITY_DATA_REGEX = re.compile(r'/wiki/Special:EntityData/([QPL]\d+)\.json$')
+# parameters of wbgetentities that do not filter the data of the entities
+ENTITY_REQUEST_PARAMS = {'action', 'ids', 'format', 'utf8', 'origin'}
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+
+class WikidataOfflineError(LookupError):
+    pass
+
+
+class WikidataStore():
+    """ On-disk store of the responses of the Wikidata API.
+
+    Entities are stored one per row keyed by their id, whatever request
+    fetched them, so the neighbours of an entity are only downloaded
+    once and stores can be warmed from a Wikidata JSON dump. Any other
+    response, like the wbsearchentities results that link a label to
+    an entity, is stored under the method, url and body of its request.
+    The store can be shared by several processes, like the workers of a
+    ParallelTopicLabeller, so the entities fetched by any of them are
+    reused by the others.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._pid = None
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entities (id TEXT PRIMARY KEY, entity TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+                          "content_type TEXT, body BLOB)")
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        self._open()
+        return self._conn
+
+    @property
+    def lock(self):
+        self._open()
+        return self._lock
+
+    def _open(self):
+        # sqlite connections and locks cannot be used after a fork, so each process opens its own
+        if self._pid != os.getpid():
+            # the store is shared by every session, which may live in different threads
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+    def lookup(self, request):
+        """ Return the (content_type, body) of the stored response to a request, or None. """
+        entity_ids = get_entity_ids(request)
+        if entity_ids is None:
+            with self.lock:
+                return self.conn.execute("SELECT content_type, body FROM responses WHERE key = ?",
+                                         (get_request_key(request),)).fetchone()
+        entities = self.get_entities(entity_ids)
+        if len(entities) < len(set(entity_ids)):
+            return None
+        return JSON_CONTENT_TYPE, json.dumps({'entities': entities}, ensure_ascii=False).encode('utf-8')
+
+    def save(self, request, content_type, body):
+        """ Store the response to a request, unless it is an error of the API. """
+        try:
+            content = json.loads(body)
+        except ValueError:
+            content = None
+        if isinstance(content, dict) and 'error' in content:
+            return
+        entity_ids = get_entity_ids(request)
+        if entity_ids is not None and isinstance(content, dict):
+            self.put_entities(content.get('entities', {}))
+            return
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                              (get_request_key(request), content_type, body))
+            self.conn.commit()
+
+    def get_entities(self, entity_ids):
+        entity_ids = list(set(entity_ids))
+        placeholders = ','.join('?' * len(entity_ids))
+        with self.lock:
+            rows = self.conn.execute(f"SELECT id, entity FROM entities WHERE id IN ({placeholders})",
+                                     entity_ids).fetchall()
+        return {entity_id: json.loads(entity) for entity_id, entity in rows}
+
+    def put_entities(self, entities):
+        # entities reported as missing are stored too, so they are not requested again
+        rows = [(entity_id, json.dumps(entity, ensure_ascii=False))
+                for entity_id, entity in entities.items()]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?)", rows)
+            self.conn.commit()
+
+    def warm_from_dump(self, f, batch_size=1000):
+        """ Store the entities of a Wikidata JSON dump and return their number.
+
+        f is a text file in the format of the official dumps: a JSON
+        array with an entity per line.
+        """
+        num_entities = 0
+        batch = {}
+        for line in f:
+            line = line.strip().rstrip(',')
+            if line in ('', '[', ']'):
+                continue
+            entity = json.loads(line)
+            batch[entity['id']] = entity
+            if len(batch) == batch_size:
+                self.put_entities(batch)
+                num_entities += len(batch)
+                batch = {}
+        self.put_entities(batch)
+        return num_entities + len(batch)
+
+
+class WikidataStoreAdapter(HTTPAdapter):
+    """ Transport adapter that answers Wikidata requests from a WikidataStore.
+
+    Only the responses missing from the store are fetched, and the
+    successful ones are added to it. In offline mode, a missing response
+    raises a WikidataOfflineError instead. If endpoint is set, missing
+    responses are fetched from it instead of from Wikidata, which allows
+    running against a local stand-in of the API.
+    """
+    def __init__(self, store, offline=False, endpoint=None, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.offline = offline
+        self.endpoint = endpoint.rstrip('/') if endpoint is not None else None
+
+    def send(self, request, **kwargs):
+        stored_response = self.store.lookup(request)
+        if stored_response is not None:
+            content_type, body = stored_response
+            raw = HTTPResponse(body=io.BytesIO(body), headers={'Content-Type': content_type or ''},
+                               status=200, reason='OK', preload_content=False)
+            return self.build_response(request, raw)
+        if self.offline:
+            raise WikidataOfflineError(f"{request.url} is not available in the Wikidata store")
+        remote_request = request.copy()
+        if self.endpoint is not None:
+            remote_request.url = get_endpoint_url(self.endpoint, request.url)
+        response = super().send(remote_request, **kwargs)
+        if response.status_code == 200:
+            self.store.save(request, response.headers.get('Content-Type'), response.content)
+        return response
+
+
+def get_entity_ids(request):
+    """ Return the ids of the entities requested, or None for other requests.
+
+    Requests that only return part of the data of the entities are
+    not considered entity requests, so their responses are stored as
+    regular responses.
+    """
+    if request.method != 'GET':
+        return None
+    url = urlsplit(request.url)
+    match = ENTITY_DATA_REGEX.search(url.path)
+    if match is not None and not url.query:
+        return [match.group(1)]
+    params = dict(parse_qsl(url.query))
+    if params.get('action') == 'wbgetentities' and params.get('format') == 'json' and \
+            'ids' in params and set(params) <= ENTITY_REQUEST_PARAMS:
+        return params['ids'].split('|')
+    return None
+
+def get_request_key(request):
+    url = urlsplit(request.url)
+    query = urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))
+    body = request.body.encode('utf-8') if isinstance(request.body, str) else request.body or b''
+    body_hash = hashlib.sha1(body).hexdigest()
+    return f"{request.method} {urlunsplit(url._replace(query=query, fragment=''))} {body_hash}"
+
+def get_endpoint_url(endpoint, url):
+    """ Map a Wikidata url to the url of a local stand-in of the API.
+
+    The host of the url becomes the first segment of its path, so
+    https://www.wikidata.org/w/api.php is sent to
+    <endpoint>/www.wikidata.org/w/api.php.
+    """
+    url = urlsplit(url)
+    return f"{endpoint}/{url.netloc}{urlunsplit(url._replace(scheme='', netloc=''))}"
+
+
+class WikidataStoreHandler(urllib.request.BaseHandler):
+    """ urllib handler that answers Wikidata requests through a WikidataStoreAdapter.
+
+    It covers the clients that open urls with urllib instead of
+    requests, like SPARQLWrapper. Other urls are left to the default
+    handlers.
+    """
+    # the default http and https handlers have an order of 500
+    handler_order = 100
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+
+    def http_open(self, req):
+        if not req.full_url.lower().startswith(WIKIDATA_URL_PREFIXES):
+            return None
+        request = requests.Request(req.get_method(), req.full_url, headers=dict(req.header_items()),
+                                   data=req.data).prepare()
+        timeout = req.timeout if isinstance(req.timeout, (int, float)) else None
+        response = self.adapter.send(request, timeout=timeout)
+        headers = HTTPMessage()
+        for name, value in response.headers.items():
+            headers[name] = value
+        res = urllib.response.addinfourl(io.BytesIO(response.content), headers, req.full_url,
+                                         response.status_code)
+        res.msg = response.reason
+        return res
+
+    https_open = http_open
+
+
+@contextmanager
+def install_wikidata_store(store, offline=False, endpoint=None):
+    """ Send the Wikidata requests of every requests session and of urllib through the store.
+
+    The entity linker and graph builder of herc_common send their own
+    requests, and may keep sessions pickled along with the pipeline, so
+    the adapter is returned by get_adapter for the Wikidata urls of any
+    session instead of being mounted on a given one, and urlopen gets a
+    WikidataStoreHandler. In offline mode, Wikidata hosts can not be
+    resolved either, so a client reaching Wikidata in any other way
+    fails instead of silently going to the network.
+
+    These patches affect every thread of the process, so the store is
+    installed as a context manager that yields the adapter and restores
+    the original get_adapter, urllib opener and getaddrinfo on exit.
+    Scripts only install it while the topic extraction model links
+    entities, so other clients, like the scrapper, are never affected.
+    """
+    adapter = WikidataStoreAdapter(store, offline, endpoint)
+    get_adapter = requests.Session.get_adapter
+    # urllib has no getter for the installed opener
+    opener = urllib.request._opener
+    getaddrinfo = socket.getaddrinfo
+
+    def get_wikidata_adapter(session, url):
+        if url.lower().startswith(WIKIDATA_URL_PREFIXES):
+            return adapter
+        return get_adapter(session, url)
+
+    def offline_getaddrinfo(host, *args, **kwargs):
+        if is_wikidata_host(host):
+            raise WikidataOfflineError(f"{host} can not be reached in offline mode")
+        return getaddrinfo(host, *args, **kwargs)
+
+    requests.Session.get_adapter = get_wikidata_adapter
+    urllib.request.install_opener(urllib.request.build_opener(WikidataStoreHandler(adapter)))
+    if offline:
+        socket.getaddrinfo = offline_getaddrinfo
+    try:
+        yield adapter
+    finally:
+        requests.Session.get_adapter = get_adapter
+        urllib.request.install_opener(opener)
+        socket.getaddrinfo = getaddrinfo
+
+def is_wikidata_host(host):
+    if isinstance(host, bytes):
+        host = host.decode('ascii', 'ignore')
+    if not isinstance(host, str):
+        return False
+    host = host.lower().rstrip('.')
+    return host == WIKIDATA_DOMAIN or host.endswith(f".{WIKIDATA_DOMAIN}")
@@ -1,10 +1,15 @@
 import functools
 import re
 
+from concurrent.futures import ProcessPoolExecutor
+
 from bs4 import BeautifulSoup, NavigableString
 
+from . import lxml_reader
 from .protocol import Protocol
 
+PARSER_BACKENDS = ['soup', 'fast']
+
 def optional(function):
     """ Return a default value if an exception is raised.
 
@@ -20,8 +25,11 @@ def optional(function):
             return ""
     return wrapper
 
+SECTION_PATTERNS = {section: re.compile(f"\s*{section}\s*")
+                    for section in ["Materials", "Equipment", "Procedure"]}
+
 def _find_element(protocol_soup, text):
-    return protocol_soup.find('p', text = re.compile(f"\s*{text}\s*"),
+    return protocol_soup.find('p', text = SECTION_PATTERNS[text],
                               attrs= {'class': 'pptt'})
 
 def parse_title(protocol_soup):
@@ -65,9 +73,39 @@ def parse_procedure(protocol_soup):
     return [procedure.text.strip()
             for procedure in procedure_element.find_next('ol').find_all('li', recursive=False)]
 
-def parse_protocol(protocol_html, protocol_id):
+def parse_protocol(protocol_html, protocol_id, backend='soup'):
+    """ Parse the html of a protocol page.
+
+    The soup backend looks up each section in a BeautifulSoup tree,
+    while the fast backend extracts every section in a single walk
+    over an lxml tree. Both backends return the same protocol.
+    """
+    if backend == 'fast':
+        return lxml_reader.parse_protocol(protocol_html, protocol_id)
+    if backend != 'soup':
+        raise ValueError(f"Unknown parser backend: {backend}")
     soup = BeautifulSoup(protocol_html, 'lxml') # use lxml parser to fix some broken tags
     return Protocol(protocol_id, parse_title(soup), parse_abstract(soup),
                     parse_materials(soup), parse_procedure(soup),
                     parse_equipment(soup), parse_background(soup),
                     parse_categories(soup), parse_authors(soup))
+
+def parse_protocols(protocols, workers=1, chunksize=16, backend='soup', executor=None):
+    """ Parse every (protocol_id, protocol_html) pair from protocols.
+
+    If more than one worker is used, pages are sent in chunks of
+    chunksize pages to a pool of processes. If executor is set, its
+    processes are used instead of starting new ones. Protocols are
+    returned in the same order they were given.
+    """
+    parse_item = functools.partial(_parse_protocol_item, backend=backend)
+    if executor is not None:
+        return list(executor.map(parse_item, protocols, chunksize=chunksize))
+    if workers == 1:
+        return [parse_item(item) for item in protocols]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(parse_item, protocols, chunksize=chunksize))
+
+def _parse_protocol_item(item, backend):
+    protocol_id, protocol_html = item
+    return parse_protocol(protocol_html, protocol_id, backend)
@@ -0,0 +1,162 @@
+from lxml import etree
+
+from .protocol import Protocol
+
+
+SECTION_HEADERS = ["Materials", "Equipment", "Procedure"]
+# BeautifulSoup keeps the whitespace of these tags and collapses the one of any other
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+ASCII_SPACES = ' \n\t\x0c\r'
+
+HTML_PARSER = etree.HTMLParser(encoding='utf-8')
+
+
+class _ProtocolSectionExtractor():
+    """ Collect every section of a protocol while walking its tree once.
+
+    Elements must be visited in document order. The rules applied to
+    each element replicate the lookups done by the functions from
+    data_reader over a BeautifulSoup tree, so both backends return
+    the same values (including the empty strings returned by the
+    optional sections).
+    """
+    def __init__(self):
+        self.title = None
+        self._title_found = False
+        self.authors = None
+        self.categories = None
+        self.abstract = ""
+        self.abstract_header = None
+        self.background = ""
+        self.sections = {}
+        self._background_found = False
+        self._pending_p = []
+        self._pending_ol = []
+
+    def visit(self, element):
+        tag = element.tag
+        if tag == 'p':
+            self._visit_p(element)
+        elif tag == 'ol':
+            for section in self._pending_ol:
+                self.sections[section] = element
+            self._pending_ol = []
+        elif tag == 'div':
+            self._visit_div(element)
+
+    def to_protocol(self, protocol_id):
+        return Protocol(protocol_id, self._get_title(), self._get_abstract(),
+                        self._get_materials(), self._get_procedure(),
+                        self._get_equipment(), self.background,
+                        self._get_categories(), self._get_authors())
+
+    def _visit_p(self, element):
+        for field in self._pending_p:
+            setattr(self, field, _get_text(element).strip())
+        self._pending_p = []
+        if self.abstract_header is None and element.get('id') == 'biaoti0':
+            self.abstract_header = element
+            self._pending_p.append('abstract')
+        string = _get_string(element)
+        if string is None:
+            return
+        if not self._background_found and string == "Background":
+            self._background_found = True
+            self._pending_p.append('background')
+        if _has_class(element, 'pptt'):
+            for section in SECTION_HEADERS:
+                if section not in self.sections and section in string:
+                    self.sections[section] = None
+                    self._pending_ol.append(section)
+
+    def _visit_div(self, element):
+        if not self._title_found and _has_class(element, 'topbar'):
+            self._title_found = True
+            self.title = next(element.iter('h1'), None)
+        if self.authors is None and _has_class(element, 'authordiv'):
+            self.authors = element
+        if self.categories is None and _has_class(element, 'categories_a'):
+            self.categories = element
+
+    def _get_title(self):
+        return _get_text(self.title).strip()
+
+    def _get_abstract(self):
+        if self.abstract_header is not None:
+            assert "Abstract" == _get_text(self.abstract_header)
+        return self.abstract
+
+    def _get_authors(self):
+        return [_get_text(author).strip()
+                for author in _get_element(self.authors).iter('a')]
+
+    def _get_categories(self):
+        return [_get_text(category).strip()
+                for category in _get_element(self.categories).iter('a')]
+
+    def _get_materials(self):
+        materials_list = self.sections.get("Materials")
+        if materials_list is None:
+            return ""
+        return [_get_text(material).strip() for material in materials_list.iter('li')]
+
+    def _get_equipment(self):
+        equipment_list = _get_element(self.sections.get("Equipment"))
+        return [_get_text(equipment).strip() for equipment in equipment_list.iter('li')]
+
+    def _get_procedure(self):
+        procedure_list = _get_element(self.sections.get("Procedure"))
+        return [_get_text(step).strip() for step in procedure_list
+                if step.tag == 'li']
+
+
+def _get_element(element):
+    if element is None:
+        raise AttributeError("Element not found in protocol")
+    return element
+
+def _get_text(element):
+    """ Equivalent of the text property of a BeautifulSoup tag. """
+    return ''.join(_iter_strings(_get_element(element)))
+
+def _iter_strings(element, preserve_whitespace=False):
+    preserve_whitespace = preserve_whitespace or element.tag in PRESERVE_WHITESPACE_TAGS
+    if element.text:
+        yield _collapse_whitespace(element.text, preserve_whitespace)
+    for child in element:
+        # the text of comments and processing instructions is not part of the text of a tag
+        if isinstance(child.tag, str):
+            yield from _iter_strings(child, preserve_whitespace)
+        if child.tail:
+            yield _collapse_whitespace(child.tail, preserve_whitespace)
+
+def _collapse_whitespace(string, preserve_whitespace):
+    """ Replace strings made only of whitespace with a single newline or space, like BeautifulSoup. """
+    if preserve_whitespace or string.strip(ASCII_SPACES):
+        return string
+    return '\n' if '\n' in string else ' '
+
+def _get_string(element):
+    """ Equivalent of the string property of a BeautifulSoup tag. """
+    children = [child for child in element]
+    num_contents = len(children) + sum(1 for child in children if child.tail)
+    if element.text:
+        num_contents += 1
+    if num_contents != 1:
+        return None
+    if element.text:
+        return element.text
+    child = children[0]
+    if not isinstance(child.tag, str):
+        return child.text
+    return _get_string(child)
+
+def _has_class(element, class_name):
+    return class_name in element.get('class', '').split()
+
+def parse_protocol(protocol_html, protocol_id):
+    root = etree.fromstring(protocol_html.encode('utf-8'), HTML_PARSER)
+    extractor = _ProtocolSectionExtractor()
+    for element in root.iter(etree.Element):
+        extractor.visit(element)
+    return extractor.to_protocol(protocol_id)
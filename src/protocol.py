@@ -1,4 +1,7 @@
 class Protocol():
+    __slots__ = ['id', 'title', 'abstract', 'materials', 'procedure',
+                 'equipment', 'background', 'categories', 'authors']
+
     def __init__(self, protocol_id, title, abstract, materials,
                  procedure, equipment, background,
                  categories, authors):
@@ -11,7 +14,16 @@ class Protocol():
         self.background = background
         self.categories = categories
         self.authors = authors
-    
+
+    def __eq__(self, other):
+        if not isinstance(other, Protocol):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field)
+                   for field in self.__slots__)
+
+    def __repr__(self):
+        return f"Protocol(id={self.id!r}, title={self.title!r})"
+
     def to_dict(self):
         return {
             'pr_id': self.id,
@@ -25,3 +37,126 @@ class Protocol():
             'authors': '|'.join(self.authors)
         }
 
+
+class ProtocolTable():
+    """ Columnar batch of protocols.
+
+    Text fields are stored as one list per field. List fields follow
+    the layout of Arrow list arrays: the items of every protocol are
+    concatenated in a single values list, and the items of the i-th
+    protocol are values[offsets[i]:offsets[i + 1]]. Optional sections
+    missing from a page (returned as an empty string by the parser)
+    are kept as null entries, so tables round-trip losslessly.
+    """
+    TEXT_FIELDS = ['id', 'title', 'abstract', 'background']
+    LIST_FIELDS = ['materials', 'procedure', 'equipment', 'categories', 'authors']
+    COLUMN_NAMES = {'id': 'pr_id'}
+
+    def __init__(self):
+        self.texts = {field: [] for field in self.TEXT_FIELDS}
+        self.values = {field: [] for field in self.LIST_FIELDS}
+        self.offsets = {field: [0] for field in self.LIST_FIELDS}
+        self.nulls = {field: [] for field in self.LIST_FIELDS}
+
+    @classmethod
+    def from_protocols(cls, protocols):
+        table = cls()
+        for protocol in protocols:
+            table.append(protocol)
+        return table
+
+    @classmethod
+    def from_arrow(cls, arrow_table):
+        table = cls()
+        for field in cls.TEXT_FIELDS:
+            table.texts[field] = arrow_table.column(cls._column_name(field)).to_pylist()
+        for field in cls.LIST_FIELDS:
+            column = arrow_table.column(field).combine_chunks()
+            offsets = column.offsets.to_pylist()
+            table.values[field] = column.values.to_pylist()[offsets[0]:offsets[-1]]
+            table.offsets[field] = [offset - offsets[0] for offset in offsets]
+            table.nulls[field] = column.is_null().to_pylist()
+        return table
+
+    def append(self, protocol):
+        for field in self.TEXT_FIELDS:
+            self.texts[field].append(getattr(protocol, field))
+        for field in self.LIST_FIELDS:
+            items = getattr(protocol, field)
+            is_null = isinstance(items, str)
+            if is_null:
+                items = []
+            self.values[field].extend(items)
+            self.offsets[field].append(len(self.values[field]))
+            self.nulls[field].append(is_null)
+
+    def __len__(self):
+        return len(self.texts['id'])
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("Protocol index out of range")
+        texts = {field: self.texts[field][idx] for field in self.TEXT_FIELDS}
+        lists = {field: self.get_items(field, idx) for field in self.LIST_FIELDS}
+        return Protocol(texts['id'], texts['title'], texts['abstract'],
+                        lists['materials'], lists['procedure'],
+                        lists['equipment'], texts['background'],
+                        lists['categories'], lists['authors'])
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+    def get_items(self, field, idx):
+        if self.nulls[field][idx]:
+            return ""
+        offsets = self.offsets[field]
+        return self.values[field][offsets[idx]:offsets[idx + 1]]
+
+    def list_column(self, field):
+        return [self.get_items(field, idx) for idx in range(len(self))]
+
+    def join_column(self, field, separator='|'):
+        offsets = self.offsets[field]
+        values = self.values[field]
+        return [separator.join(values[start:end])
+                for start, end in zip(offsets, offsets[1:])]
+
+    def to_arrow(self):
+        import pyarrow as pa
+
+        columns = {self._column_name(field): pa.array(self.texts[field], pa.string())
+                   for field in self.TEXT_FIELDS}
+        for field in self.LIST_FIELDS:
+            # a null offset makes its list null, which older pyarrow releases support too
+            offsets = [None if is_null else offset
+                       for offset, is_null in zip(self.offsets[field], self.nulls[field])]
+            offsets.append(self.offsets[field][-1])
+            columns[field] = pa.ListArray.from_arrays(pa.array(offsets, pa.int32()),
+                                                      pa.array(self.values[field], pa.string()))
+        return pa.table(columns)
+
+    def to_pandas(self, join_lists=True, list_fields=()):
+        """ Build a dataframe with a column per field.
+
+        If join_lists is set, list fields are joined with '|', which
+        gives the same dataframe as the one built from the to_dict
+        output of each protocol, except for the fields in list_fields,
+        which are kept as lists of items. Otherwise every list column is
+        returned as Arrow-backed lists of items.
+        """
+        import pandas as pd
+
+        if not join_lists:
+            return self.to_arrow().to_pandas()
+        columns = {self._column_name(field): self.texts[field] for field in self.TEXT_FIELDS}
+        columns.update({field: self.list_column(field) if field in list_fields
+                        else self.join_column(field) for field in self.LIST_FIELDS})
+        column_order = ['pr_id', 'title', 'abstract', 'materials', 'procedure',
+                        'equipment', 'background', 'categories', 'authors']
+        return pd.DataFrame({column: columns[column] for column in column_order})
+
+    @classmethod
+    def _column_name(cls, field):
+        return cls.COLUMN_NAMES.get(field, field)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the scripts import their sibling modules, like they do when run from the scripts folder
+sys.path.insert(0, os.path.join(ROOT_DIR, 'scripts'))
+sys.path.insert(0, ROOT_DIR)
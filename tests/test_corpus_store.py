@@ -0,0 +1,97 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import build_corpus
+
+from build_corpus import get_corpus_order, list_protocol_pages, update_corpus
+from corpus_store import CorpusStore
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROTOCOLS_DIR = os.path.join(TESTS_DIR, 'data', 'protocols')
+
+
+@pytest.fixture
+def protocols_dir(tmp_path):
+    protocols_dir = tmp_path / 'protocols'
+    shutil.copytree(PROTOCOLS_DIR, str(protocols_dir))
+    return protocols_dir
+
+
+@pytest.fixture
+def parsed_ids(monkeypatch):
+    """ Record the ids of the protocols parsed by update_corpus. """
+    parsed_ids = []
+    parse_protocols = build_corpus.parse_protocols
+
+    def parse_and_record(protocols, *args, **kwargs):
+        parsed_ids.extend(pr_id for pr_id, _ in protocols)
+        return parse_protocols(protocols, *args, **kwargs)
+
+    monkeypatch.setattr(build_corpus, 'parse_protocols', parse_and_record)
+    return parsed_ids
+
+
+def update(store, protocols_dir, protocols_file_path):
+    """ Update the corpus like the main function of build_corpus.py. """
+    pages = list_protocol_pages(str(protocols_dir))
+    num_parsed = update_corpus(store, pages)
+    store.remove_missing([pr_id for pr_id, _ in pages])
+    store.set_positions(get_corpus_order([pr_id for pr_id, _ in pages], store.get_positions(),
+                                         str(protocols_file_path)))
+    return num_parsed
+
+
+def test_unchanged_pages_are_not_parsed_again(tmp_path, protocols_dir, parsed_ids):
+    store = CorpusStore(str(tmp_path / 'corpus.sqlite'))
+    protocols_file_path = tmp_path / 'protocols_dataframe.pkl'
+    assert update(store, protocols_dir, protocols_file_path) == 3
+    assert sorted(parsed_ids) == ['Bio-101', 'Bio-102', 'Bio-103']
+
+    # touched pages are read again, but not parsed when their content did not change
+    parsed_ids.clear()
+    touched_path = str(protocols_dir / 'Bio-101.html')
+    stat = os.stat(touched_path)
+    os.utime(touched_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert update(store, protocols_dir, protocols_file_path) == 0
+    assert update(store, protocols_dir, protocols_file_path) == 0
+    assert parsed_ids == []
+    stored_mtime, = store.conn.execute("SELECT mtime FROM protocols WHERE pr_id = 'Bio-101'").fetchone()
+    assert stored_mtime == os.stat(touched_path).st_mtime_ns
+
+    with open(str(protocols_dir / 'Bio-102.html'), 'a', encoding='utf-8') as f:
+        f.write('\n')
+    assert update(store, protocols_dir, protocols_file_path) == 1
+    assert parsed_ids == ['Bio-102']
+
+
+def test_corpus_keeps_the_order_of_the_protocols_dataframe(tmp_path, protocols_dir, monkeypatch):
+    store = CorpusStore(str(tmp_path / 'corpus.sqlite'))
+    protocols_file_path = tmp_path / 'protocols_dataframe.pkl'
+    order = ['Bio-103', 'Bio-101', 'Bio-102']
+    pd.DataFrame({'pr_id': order}).to_pickle(str(protocols_file_path))
+    update(store, protocols_dir, protocols_file_path)
+    assert store.read(['pr_id'])['pr_id'].tolist() == order
+
+    # once the corpus has positions, new protocols follow them without reading the dataframe
+    def fail_to_read_pickle(*args, **kwargs):
+        raise AssertionError("The protocols dataframe was read")
+
+    monkeypatch.setattr(pd, 'read_pickle', fail_to_read_pickle)
+    shutil.copy(str(protocols_dir / 'Bio-102.html'), str(protocols_dir / 'Bio-100.html'))
+    update(store, protocols_dir, protocols_file_path)
+    assert store.read(['pr_id'])['pr_id'].tolist() == order + ['Bio-100']
+
+
+def test_read_selected_columns(tmp_path, protocols_dir):
+    store = CorpusStore(str(tmp_path / 'corpus.sqlite'))
+    update(store, protocols_dir, tmp_path / 'protocols_dataframe.pkl')
+    protocols_df = store.read(['title', 'pr_id'])
+    assert protocols_df.columns.tolist() == ['title', 'pr_id']
+    assert len(protocols_df) == len(store) == 3
+    assert store.read().columns.tolist() == store.read(None).columns.tolist()
+    with pytest.raises(ValueError, match='Unknown corpus columns: size'):
+        store.read(['pr_id', 'size'])
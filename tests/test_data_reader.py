@@ -0,0 +1,52 @@
+import glob
+import os
+
+import pytest
+
+from src.data_reader import PARSER_BACKENDS, parse_protocol, parse_protocols
+from src.protocol import Protocol
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# pages saved by the data fetching notebook are checked too when they are available
+PAGE_PATHS = sorted(glob.glob(os.path.join(TESTS_DIR, 'data', 'protocols', '*.html')) +
+                    glob.glob(os.path.join(TESTS_DIR, '..', 'data', 'protocols', '*.html')))
+
+
+def read_page(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return os.path.basename(path)[:-len('.html')], f.read()
+
+
+@pytest.mark.parametrize('path', PAGE_PATHS, ids=os.path.basename)
+def test_fast_backend_matches_soup_backend(path):
+    protocol_id, html = read_page(path)
+    soup_protocol = parse_protocol(html, protocol_id, backend='soup')
+    fast_protocol = parse_protocol(html, protocol_id, backend='fast')
+    for field in Protocol.__slots__:
+        assert getattr(fast_protocol, field) == getattr(soup_protocol, field), field
+
+
+def test_fast_backend_parses_every_section():
+    protocol = parse_protocol(read_page(PAGE_PATHS[0])[1], 'Bio-101', backend='fast')
+    assert protocol.title == 'Isolation of Mouse Bone Marrow-derived Macrophages'
+    assert protocol.authors == ['Jane Doe', 'John Smith', 'Ana Pérez']
+    assert protocol.categories == ['Immunology', 'Cell Biology']
+    assert protocol.abstract.startswith('Bone marrow-derived macrophages')
+    assert protocol.background.startswith('Macrophages are phagocytic cells')
+    assert len(protocol.materials) == 4
+    assert protocol.equipment == ['Centrifuge', 'CO2 incubator']
+    assert len(protocol.procedure) == 5
+
+
+@pytest.mark.parametrize('backend', PARSER_BACKENDS)
+def test_parse_protocols_keeps_the_order(backend):
+    pages = [read_page(path) for path in PAGE_PATHS]
+    protocols = parse_protocols(pages, workers=2, chunksize=1, backend=backend)
+    assert [protocol.id for protocol in protocols] == [protocol_id for protocol_id, _ in pages]
+    assert protocols == [parse_protocol(html, protocol_id, backend) for protocol_id, html in pages]
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        parse_protocol('<html></html>', 'Bio-101', backend='regex')
@@ -0,0 +1,60 @@
+import logging
+import time
+
+import instrumentation
+
+from instrumentation import DOCUMENT_BATCH_SIZE, METRICS_DOCUMENT_BATCH_SIZE, Metrics, \
+    ProgressLogger, transform_documents
+
+
+def transform_in_batches(num_docs, metrics, batch_size=None):
+    batch_sizes = []
+
+    def transform(batch):
+        batch_sizes.append(len(batch))
+        time.sleep(.01 * len(batch))
+        return [doc * 2 for doc in batch]
+
+    docs = list(range(num_docs))
+    results = transform_documents(transform, docs, [f"Bio-{doc}" for doc in docs], metrics, batch_size)
+    assert results == [doc * 2 for doc in docs]
+    return batch_sizes
+
+
+def test_batch_latencies_keep_their_ids():
+    metrics = Metrics()
+    assert transform_in_batches(5, metrics, batch_size=2) == [2, 2, 1]
+    batches = metrics.to_dict()['batches']['predict']
+    assert batches['count'] == 3
+    assert batches['documents'] == 5
+    assert [batch['ids'] for batch in batches['slowest']][:2] in ([['Bio-0', 'Bio-1'], ['Bio-2', 'Bio-3']],
+                                                                 [['Bio-2', 'Bio-3'], ['Bio-0', 'Bio-1']])
+    assert batches['slowest'][-1]['ids'] == ['Bio-4']
+    prometheus = metrics.to_prometheus()
+    assert 'hercules_protocols_batch_latency_seconds_count{stage="predict"} 3' in prometheus
+    assert 'hercules_protocols_documents_total{stage="predict"} 5' in prometheus
+
+
+def test_default_batch_size_depends_on_metrics():
+    num_docs = METRICS_DOCUMENT_BATCH_SIZE + 1
+    assert transform_in_batches(num_docs, Metrics()) == [METRICS_DOCUMENT_BATCH_SIZE, 1]
+    assert transform_in_batches(num_docs, Metrics(enabled=False)) == [num_docs]
+    assert DOCUMENT_BATCH_SIZE > num_docs
+
+
+def test_progress_logs_completion(monkeypatch, caplog):
+    now = [0.]
+    monkeypatch.setattr(instrumentation.time, 'perf_counter', lambda: now[0])
+    progress = ProgressLogger('predict', total=10, interval=30)
+    with caplog.at_level(logging.INFO, logger='instrumentation'):
+        now[0] = 5.
+        progress.update(4)
+        assert caplog.messages == []
+        now[0] = 40.
+        progress.update(4)
+        assert caplog.messages == ['predict: 8/10 protocols (0.20 protocols/s, 0m10s left)']
+        # the completion is logged even if the last line was logged just before
+        now[0] = 50.
+        progress.update(2)
+    assert caplog.messages[-1] == 'predict: 10/10 protocols (0.20 protocols/s, 0m00s left)'
+    assert len(caplog.messages) == 2
@@ -0,0 +1,49 @@
+import copy
+import os
+import pickle
+
+from parallel_labelling import ParallelTopicLabeller
+
+
+class PidLabeller():
+    """ Label each document with the id of the process that labelled it. """
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        return [(doc, os.getpid()) for doc in X]
+
+
+def test_worker_processes_are_reused():
+    labeller = ParallelTopicLabeller(PidLabeller(), workers=2, chunksize=2)
+    try:
+        docs = list(range(8))
+        first = labeller.transform(docs)
+        executor = labeller.executor
+        second = labeller.transform(docs)
+        assert [doc for doc, _ in first] == docs
+        assert [doc for doc, _ in second] == docs
+        assert labeller.executor is executor
+        pids = {pid for _, pid in first + second}
+        assert os.getpid() not in pids
+        assert len(pids) <= 2
+    finally:
+        labeller.close()
+    assert labeller._executor is None
+
+
+def test_copies_do_not_share_the_executor():
+    labeller = ParallelTopicLabeller(PidLabeller(), workers=2, chunksize=2)
+    try:
+        labeller.transform(list(range(4)))
+        for labeller_copy in [copy.copy(labeller), pickle.loads(pickle.dumps(labeller))]:
+            assert labeller_copy._executor is None
+            assert labeller_copy.chunksize == 2
+    finally:
+        labeller.close()
+
+
+def test_small_inputs_are_labelled_in_process():
+    labeller = ParallelTopicLabeller(PidLabeller(), workers=2, chunksize=4)
+    assert labeller.transform([1, 2]) == [(1, os.getpid()), (2, os.getpid())]
+    assert labeller._executor is None
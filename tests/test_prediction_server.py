@@ -0,0 +1,100 @@
+import json
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+import prediction_server
+
+from prediction_server import MicroBatcher, PredictionService, create_server
+
+
+class Topic():
+    def __init__(self, label):
+        self.labels = [label]
+        self.uris = [f"http://www.wikidata.org/entity/{label}"]
+        self.descs = ['']
+        self.score = 1.
+
+
+def predict_topics(docs):
+    """ Return a topic per word, and fail on the documents containing 'index' or 'value'. """
+    if any('index' in doc for doc in docs):
+        raise IndexError("list index out of range")
+    if any('value' in doc for doc in docs):
+        raise ValueError("could not convert string to float")
+    return [[(Topic(word), None) for word in doc.split()] for doc in docs]
+
+
+@pytest.fixture
+def server():
+    service = PredictionService(MicroBatcher(predict_topics), None, None)
+    server = create_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    server.url = f"http://{host}:{port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, body):
+    data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+    try:
+        with urlopen(Request(url, data=data, method='POST')) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_topics(server):
+    status, res = post(f"{server.url}/topics", {'texts': {'Bio-1': 'cell  culture'}})
+    assert status == 200
+    assert [topic['labels'] for topic in res['Bio-1']['topics']] == [['cell'], ['culture']]
+    assert res['Bio-1']['authors'] == []
+
+
+@pytest.mark.parametrize('body', [b'not json', b'[]', {}, {'texts': ['cell']}, {'urls': 'Bio-1'},
+                                  {'pages': {'Bio-1': '<html></html>'}}])
+def test_bad_requests(server, body):
+    assert post(f"{server.url}/topics", body)[0] == 400
+
+
+def test_unparseable_pages_are_bad_requests(server, monkeypatch):
+    def parse_protocols(pages):
+        raise ValueError("invalid literal for int()")
+
+    monkeypatch.setattr(prediction_server, 'parse_protocols', parse_protocols)
+    status, res = post(f"{server.url}/topics", {'pages': {'Bio-1': '<html><h1>Bio</h1></html>'}})
+    assert status == 400
+    assert 'not valid protocol pages' in res['error']
+
+
+def test_unknown_endpoints(server):
+    assert post(f"{server.url}/labels", {'texts': {'Bio-1': 'cell'}})[0] == 404
+    assert post(f"{server.url}/summaries", {'texts': {'Bio-1': 'cell'}})[0] == 404
+
+
+@pytest.mark.parametrize('text', ['index', 'value'])
+def test_model_errors_are_server_errors(server, text):
+    assert post(f"{server.url}/topics", {'texts': {'Bio-1': text}})[0] == 500
+
+
+def test_failing_document_does_not_fail_its_batch():
+    batch_sizes = []
+
+    def predict(docs):
+        batch_sizes.append(len(docs))
+        return predict_topics(docs)
+
+    batcher = MicroBatcher(predict, max_batch_size=8, max_wait=.5)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(batcher.predict, [doc]) for doc in ['a', 'b', 'index', 'c']]
+    with pytest.raises(IndexError):
+        futures[2].result()
+    for future, doc in zip(futures[:2] + futures[3:], ['a', 'b', 'c']):
+        assert future.result()[0][0][0].labels == [doc]
+    assert batch_sizes[0] == 4
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from src.protocol import Protocol, ProtocolTable
+
+
+def get_protocols():
+    return [
+        Protocol('Bio-1', 'Title 1', 'Abstract 1', ['Tubes', 'Water'], ['Step 1', 'Step 2'],
+                 ['Centrifuge'], 'Background 1', ['Biology'], ['Ann', 'Bob']),
+        # optional sections missing from the page are returned as empty strings by the parser
+        Protocol('Bio-2', 'Title 2', 'Abstract 2', '', ['Only step'], '', '', [], ['Carl']),
+        Protocol('Bio-3', 'Title | 3', '', ['Salt'], '', ['Scale', 'Pipette'], 'Background 3',
+                 ['Chemistry', 'Biology'], []),
+        Protocol('Bio-4', 'Title 4', 'Abstract 4', [], ['Step a', 'Step b', 'Step c'], [],
+                 'Background 4', '', ['Dana'])
+    ]
+
+
+def test_table_keeps_protocols():
+    protocols = get_protocols()
+    table = ProtocolTable.from_protocols(protocols)
+    assert len(table) == len(protocols)
+    assert list(table) == protocols
+    assert table[-1] == protocols[-1]
+    assert table.list_column('materials') == [protocol.materials for protocol in protocols]
+    with pytest.raises(IndexError):
+        table[len(protocols)]
+
+
+@pytest.mark.parametrize('start,length', [(0, 4), (1, 2), (2, 2), (3, 1)])
+def test_arrow_round_trip(start, length):
+    pytest.importorskip('pyarrow')
+    protocols = get_protocols()
+    arrow_table = ProtocolTable.from_protocols(protocols).to_arrow()
+    assert arrow_table.column('materials').null_count == 1
+    table = ProtocolTable.from_arrow(arrow_table.slice(start, length))
+    assert list(table) == protocols[start:start + length]
+    # tables read from a slice can be converted again
+    assert list(ProtocolTable.from_arrow(table.to_arrow())) == protocols[start:start + length]
+
+
+def test_to_pandas_matches_to_dict():
+    protocols = get_protocols()
+    table = ProtocolTable.from_protocols(protocols)
+    expected = pd.DataFrame([protocol.to_dict() for protocol in protocols])
+    pd.testing.assert_frame_equal(table.to_pandas(), expected)
+    df = table.to_pandas(list_fields=['authors'])
+    assert df['authors'].tolist() == [protocol.authors for protocol in protocols]
+    pd.testing.assert_frame_equal(df.drop(columns='authors'), expected.drop(columns='authors'))
+
+
+def test_full_text_joins_procedure_steps_with_spaces():
+    from predict_protocol import build_protocols_df
+
+    df = build_protocols_df(get_protocols())
+    assert df['full_text'][0] == 'Title 1. Abstract 1. Step 1 Step 2. Background 1'
+    assert df['full_text_no_abstract_cleaned'][1] == 'Title 2. Only step.'
+    assert df['procedure'][0] == 'Step 1|Step 2'
+    assert df['authors'][2] == []
@@ -0,0 +1,83 @@
+import collections
+import io
+
+import pandas as pd
+import pytest
+
+from rdflib import BNode, Dataset, Graph, Literal, URIRef
+from rdflib.compare import isomorphic
+
+herc_utils = pytest.importorskip('herc_common.utils')
+
+from common import _stream_graph_results, create_protocols_graph
+from rdf_writer import StreamingGraphWriter
+
+
+Topic = collections.namedtuple('Topic', ['labels', 'uris', 'descs', 'score'])
+
+
+def add_stand_in_topics_to_graph(uri, pr_id, text, topics, g):
+    """ Stand-in of herc_common.utils.add_text_topics_to_graph, with a blank node per topic. """
+    context = URIRef(f"{herc_utils.EDMA}{pr_id}")
+    g.add((context, herc_utils.NIF.isString, Literal(text)))
+    g.add((context, herc_utils.NIF.sourceUrl, URIRef(uri)))
+    for t, *_ in topics:
+        topic = BNode()
+        g.add((context, herc_utils.NIF.topic, topic))
+        g.add((topic, herc_utils.ITSRDF.taIdentRef, URIRef(f"http://www.wikidata.org/entity/{t.uris[0]}")))
+        g.add((topic, herc_utils.ITSRDF.taClassRef, Literal(t.labels[0], lang='en')))
+    return context
+
+
+@pytest.fixture
+def protocols(monkeypatch):
+    monkeypatch.setattr(herc_utils, 'add_text_topics_to_graph', add_stand_in_topics_to_graph)
+    texts = ['Extract the DNA.', 'Grow "E. coli" cells\novernight.\n@prefix in a literal', 'Stain cells.']
+    protocols_df = pd.DataFrame({'pr_id': [f"Bio-{idx}" for idx in range(len(texts))]})
+    topics = [[(Topic([word], [f"Q{len(word)}"], [''], 1.),) for word in text.split()[:2]]
+              for text in texts]
+    return protocols_df, texts, topics
+
+
+def stream(tmp_path, protocols, format):
+    """ Stream the results in two chunks, like the predictions of a streamed run. """
+    protocols_df, texts, topics = protocols
+    out_file = str(tmp_path / f"results.{format}")
+    _stream_graph_results([(protocols_df.iloc[:2], texts[:2], topics[:2]),
+                           (protocols_df.iloc[2:], texts[2:], topics[2:])], out_file, format)
+    with open(out_file, encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('format', ['nt', 'turtle'])
+def test_streamed_graph_is_isomorphic_to_batch_graph(tmp_path, protocols, format):
+    batch_graph = create_protocols_graph(*protocols)
+    streamed_graph = Graph().parse(data=stream(tmp_path, protocols, format), format=format)
+    assert isomorphic(streamed_graph, batch_graph)
+
+
+def test_nquads_have_the_quads_of_the_batch_graph(tmp_path, protocols):
+    batch_graph = create_protocols_graph(*protocols)
+    dataset = Dataset()
+    dataset.parse(data=stream(tmp_path, protocols, 'nquads'), format='nquads')
+    union = Graph()
+    for s, p, o, _ in dataset.quads((None, None, None)):
+        union.add((s, p, o))
+    assert isomorphic(union, batch_graph)
+    # the triples of each protocol are in the named graph of its context
+    for pr_id in protocols[0]['pr_id']:
+        context = URIRef(f"{herc_utils.EDMA}{pr_id}")
+        named_graph = dataset.graph(context)
+        assert set(named_graph.subjects(herc_utils.NIF.isString, None)) == {context}
+
+
+def test_turtle_prefixes_are_not_repeated(tmp_path, protocols):
+    output = stream(tmp_path, protocols, 'turtle')
+    prefix_lines = [line for line in output.split('\n') if line.startswith('@prefix')]
+    assert len(prefix_lines) > 0
+    assert len(prefix_lines) == len({line.split()[1] for line in prefix_lines})
+
+
+def test_only_streaming_formats_are_accepted():
+    with pytest.raises(ValueError):
+        StreamingGraphWriter(io.StringIO(), 'xml')
@@ -0,0 +1,100 @@
+import argparse
+import logging
+
+import pytest
+
+import run_sharded_predictions
+
+from instrumentation import Metrics
+from run_sharded_predictions import get_checkpoint_path, get_shard_key, load_checkpoint, \
+    predict_shards, save_checkpoint, split_shards
+
+
+class StandInPipe():
+    """ Label each protocol with the run it was predicted in, and fail on protocols with 'fail'. """
+    def __init__(self, run):
+        self.run = run
+
+    def transform(self, X):
+        if any('fail' in doc for doc in X):
+            raise ValueError("Protocol failed")
+        return [(doc.upper(), self.run) for doc in X]
+
+
+def init_stand_in_worker(args):
+    run_sharded_predictions._worker_pipe = StandInPipe(args.run)
+    run_sharded_predictions._worker_metrics = Metrics(enabled=args.metrics_out is not None)
+
+
+def get_args(checkpoint_dir, run, restart=False):
+    return argparse.Namespace(checkpoint_dir=str(checkpoint_dir), restart=restart, processes=2,
+                              document_batch_size=None, metrics_out='metrics.json', run=run)
+
+
+def predict(shards, pr_ids, protocols, args, metrics=None):
+    return predict_shards(shards, pr_ids, protocols, 'run-key', args, metrics,
+                          initializer=init_stand_in_worker)
+
+
+def test_split_shards_is_stable():
+    pr_ids = [f"Bio-{idx}" for idx in range(100)]
+    shards = split_shards(pr_ids, 8)
+    assert sorted(pos for positions in shards for pos in positions) == list(range(100))
+    # a protocol stays in its shard when others are added
+    more_shards = split_shards(pr_ids + ['Bio-new'], 8)
+    assert [positions for positions in more_shards if 100 in positions][0][:-1] in shards
+
+
+def test_checkpoints(tmp_path, caplog):
+    path = str(tmp_path / 'shard.pkl')
+    assert load_checkpoint(path, 'key') is None
+    save_checkpoint(path, 'key', [['topic']])
+    assert load_checkpoint(path, 'key') == [['topic']]
+    assert load_checkpoint(path, 'other-key') is None
+    with open(path, 'rb') as f:
+        data = f.read()
+    for corrupted_data in [data[:len(data) // 2], b'not a pickle', b'N.']:
+        with open(path, 'wb') as f:
+            f.write(corrupted_data)
+        with caplog.at_level(logging.WARNING):
+            assert load_checkpoint(path, 'key') is None
+        assert 'Ignoring corrupted checkpoint' in caplog.text
+        caplog.clear()
+
+
+def test_failed_shards_are_resumed(tmp_path):
+    pr_ids = [f"Bio-{idx}" for idx in range(20)]
+    protocols = [f"protocol {idx}" for idx in range(20)]
+    protocols[3] = 'protocol fail'
+    shards = split_shards(pr_ids, 4)
+    failed_shard = [idx for idx, positions in enumerate(shards) if 3 in positions][0]
+
+    metrics = Metrics()
+    with pytest.raises(RuntimeError, match=f"Shards \\[{failed_shard}\\] failed"):
+        predict(shards, pr_ids, protocols, get_args(tmp_path, run=1), metrics)
+    for shard_idx in range(len(shards)):
+        checkpoint_exists = (tmp_path / f"shard-{shard_idx:05d}-of-00004.pkl").exists()
+        assert checkpoint_exists == (shard_idx != failed_shard)
+    # the latency of every predicted shard is collected from the workers
+    assert metrics.to_dict()['batches']['predict']['documents'] == 20 - len(shards[failed_shard])
+
+    # a corrupted checkpoint is predicted again too
+    corrupted_shard = (failed_shard + 1) % len(shards)
+    with open(get_checkpoint_path(str(tmp_path), corrupted_shard, len(shards)), 'wb') as f:
+        f.write(b'corrupted')
+    protocols[3] = 'protocol 3'
+    topics = predict(shards, pr_ids, protocols, get_args(tmp_path, run=2))
+    for shard_idx, positions in enumerate(shards):
+        expected_run = 2 if shard_idx in (failed_shard, corrupted_shard) else 1
+        assert [topics[pos] for pos in positions] == \
+            [(protocols[pos].upper(), expected_run) for pos in positions]
+
+    topics = predict(shards, pr_ids, protocols, get_args(tmp_path, run=3, restart=True))
+    assert {run for _, run in topics} == {3}
+
+
+def test_shard_key_depends_on_run_and_protocols():
+    key = get_shard_key('run-key', ['Bio-1'], ['text'])
+    assert key == get_shard_key('run-key', ['Bio-1'], ['text'])
+    assert key != get_shard_key('other-run-key', ['Bio-1'], ['text'])
+    assert key != get_shard_key('run-key', ['Bio-1'], ['other text'])
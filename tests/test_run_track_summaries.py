@@ -0,0 +1,131 @@
+import logging
+
+import pytest
+
+# the script imports the summarization models and the NIF namespaces
+for module in ['torch', 'transformers', 'herc_common']:
+    pytest.importorskip(module)
+
+import run_track_summaries
+
+from run_track_summaries import MAX_MAP_REDUCE_ROUNDS, _pack_pieces, get_map_reduce_predictions, \
+    get_model_predictions, length_sorted_batches, split_windows
+
+
+class StandInTokenizer():
+    """ Tokenize texts into words, with a start and end token like BART. """
+    model_max_length = 16
+
+    def __call__(self, texts, truncation=False, add_special_tokens=True):
+        if isinstance(texts, str):
+            return {'input_ids': self._tokenize(texts, truncation, add_special_tokens)}
+        return {'input_ids': [self._tokenize(text, truncation, add_special_tokens) for text in texts]}
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def _tokenize(self, text, truncation, add_special_tokens):
+        ids = list(range(len(text.split())))
+        if add_special_tokens:
+            ids = [-1] + ids + [-2]
+        return ids[:self.model_max_length] if truncation else ids
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """ Summarize each document with its first word in upper case, recording the batches. """
+    batches = []
+
+    def predict_batch(model, tokenizer, docs):
+        batches.append(list(docs))
+        return [doc.split()[0].upper() for doc in docs]
+
+    monkeypatch.setattr(run_track_summaries, '_predict_batch', predict_batch)
+    return batches
+
+
+def test_length_sorted_batches():
+    lengths = [3, 10, 1, 7, 7, 2]
+    batches = list(length_sorted_batches(lengths, 2))
+    assert batches == [[1, 3], [4, 0], [5, 2]]
+    assert all(lengths[a] >= lengths[b] for batch in batches for a, b in zip(batch, batch[1:]))
+
+
+def test_length_sorted_batches_with_max_tokens():
+    lengths = [3, 20, 1, 7, 7, 2, 4]
+    batches = list(length_sorted_batches(lengths, 3, max_tokens=14))
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(lengths)))
+    # the document longer than max_tokens is placed in a batch of its own
+    assert batches[0] == [1]
+    for batch in batches[1:]:
+        assert len(batch) <= 3
+        assert len(batch) * max(lengths[idx] for idx in batch) <= 14
+
+
+def test_predictions_keep_the_order_of_the_documents(batches):
+    docs = ['one', 'two words', 'a b c d e f', 'three word doc', 'x y']
+    assert get_model_predictions(None, StandInTokenizer(), docs, batch_size=2) == \
+        ['ONE', 'TWO', 'A', 'THREE', 'X']
+    assert batches == [['a b c d e f', 'three word doc'], ['two words', 'x y'], ['one']]
+
+
+@pytest.fixture
+def rounds(monkeypatch):
+    """ Summarize each window without its last word, recording the windows of each round. """
+    rounds = []
+
+    def predict(model, tokenizer, x, batch_size=8, max_tokens=None):
+        rounds.append(list(x))
+        return [' '.join(doc.split()[:-1] if len(doc.split()) > 1 else doc.split()) for doc in x]
+
+    monkeypatch.setattr(run_track_summaries, 'get_model_predictions', predict)
+    return rounds
+
+
+def test_pack_pieces_never_exceeds_the_maximum_length():
+    pieces = [('a', 2), ('b', 3), ('c', 1), ('d', 5), ('e', 4), ('f', 1)]
+    packed = _pack_pieces(pieces, 5)
+    assert packed == [('a b', 5), ('c', 1), ('d', 5), ('e f', 5)]
+    # a piece longer than the maximum length is kept on its own
+    assert _pack_pieces([('a', 1), ('b', 7), ('c', 1)], 5) == [('a', 1), ('b', 7), ('c', 1)]
+
+
+def test_split_windows_never_exceeds_the_window():
+    tokenizer = StandInTokenizer()
+    long_sentence = ' '.join(f"word{idx}" for idx in range(12))
+    doc = f"First short sentence. Second one! {long_sentence}; Then a last sentence here."
+    windows = split_windows(tokenizer, doc, 5)
+    assert ' '.join(windows).split() == doc.split()
+    assert all(run_track_summaries._get_length(tokenizer, window) <= 5 for window in windows)
+    # the long sentence is split on its words
+    assert 'word0 word1 word2 word3 word4' in windows
+    assert split_windows(tokenizer, 'Short doc.', 5) == ['Short doc.']
+
+
+def test_map_reduce_stops_after_max_rounds(rounds, caplog):
+    tokenizer = StandInTokenizer()
+    short_doc = 'a short doc'
+    long_doc = ' '.join(f"w{idx}" for idx in range(200))
+    with caplog.at_level(logging.WARNING):
+        summaries = get_map_reduce_predictions(None, tokenizer, [short_doc, long_doc], window_tokens=5)
+    # the rounds of map-reduce are followed by a last round with truncation
+    assert len(rounds) == MAX_MAP_REDUCE_ROUNDS + 1
+    assert rounds[-1] == [rounds[-1][0]] and len(rounds[-1][0].split()) > 5
+    assert 'could not be reduced' in caplog.text
+    assert summaries[0] == 'a short'
+    assert len(summaries[1].split()) == len(rounds[-1][0].split()) - 1
+
+
+def test_map_reduce_truncates_summaries_that_do_not_shrink(monkeypatch, caplog):
+    rounds = []
+
+    def predict(model, tokenizer, x, batch_size=8, max_tokens=None):
+        rounds.append(list(x))
+        return [doc + ' more' for doc in x]
+
+    monkeypatch.setattr(run_track_summaries, 'get_model_predictions', predict)
+    long_doc = ' '.join(f"w{idx}" for idx in range(12))
+    with caplog.at_level(logging.WARNING):
+        get_map_reduce_predictions(None, StandInTokenizer(), [long_doc], window_tokens=5)
+    assert len(rounds) == 2
+    assert 'could not be reduced' in caplog.text
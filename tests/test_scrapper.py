@@ -0,0 +1,136 @@
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from common import BioProtocolScrapper
+from page_cache import PageCache
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """ Answer /<id> with a page of the id after a short delay.
+
+    /fail-<status>-<n>/<id> answers with the given status the first n
+    times it is requested, and /fail-<status>/<id> always does. Requests
+    with an If-None-Match header are answered with a 304.
+    """
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, time.monotonic()))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            num_requests = sum(1 for path, _ in server.requests if path == self.path)
+        try:
+            time.sleep(server.delay)
+            status = 200
+            parts = self.path.strip('/').split('/')
+            if self.headers.get('If-None-Match'):
+                status = 304
+            elif parts[0].startswith('fail-'):
+                fail_params = parts[0].split('-')[1:]
+                if len(fail_params) == 1 or num_requests <= int(fail_params[1]):
+                    status = int(fail_params[0])
+            body = f"<html>{parts[-1]}</html>" if status == 200 else f"error {status}"
+            self.send_response(status)
+            if status == 304:
+                self.end_headers()
+                return
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', f'"{parts[-1]}"')
+            self.end_headers()
+            self.wfile.write(body.encode('utf-8'))
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInRequestHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = server.max_in_flight = 0
+    server.delay = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    server.url = f"http://{host}:{port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_urls_concurrently(server):
+    server.delay = .2
+    urls = [f"{server.url}/Bio-protocol{idx}" for idx in range(8)]
+    scrapper = BioProtocolScrapper(throttle_time=0, concurrency=4)
+    start = time.monotonic()
+    pages = scrapper.fetch_urls(urls)
+    elapsed = time.monotonic() - start
+    assert list(pages.items()) == [(f"Bio-protocol{idx}", f"<html>Bio-protocol{idx}</html>")
+                                   for idx in range(8)]
+    assert server.max_in_flight > 1
+    assert elapsed < 8 * server.delay
+
+
+def test_fetch_urls_throttles_each_host(server):
+    urls = [f"{server.url}/Bio-protocol{idx}" for idx in range(5)]
+    scrapper = BioProtocolScrapper(throttle_time=.1, concurrency=4)
+    start = time.monotonic()
+    scrapper.fetch_urls(urls)
+    request_times = sorted(request_time for _, request_time in server.requests)
+    # requests can arrive later than their slot, on a busy machine, but never before it
+    # (sleeps can wake up slightly earlier than the monotonic clock)
+    for idx, request_time in enumerate(request_times):
+        assert request_time - start >= idx * .1 - .01
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_fetch_url_retries_with_backoff(server, status):
+    scrapper = BioProtocolScrapper(throttle_time=0, retries=3, backoff_factor=.1)
+    url = f"{server.url}/fail-{status}-3/Bio-protocol1"
+    assert scrapper.fetch_url(url) == ('Bio-protocol1', '<html>Bio-protocol1</html>')
+    request_times = [request_time for _, request_time in server.requests]
+    assert len(request_times) == 4
+    gaps = [end - start for start, end in zip(request_times, request_times[1:])]
+    # the first retry is immediate, and the wait doubles for each of the next ones
+    assert gaps[1] >= .2 * .9 and gaps[2] >= .4 * .9
+
+
+def test_fetch_url_raises_once_retries_are_exhausted(server):
+    scrapper = BioProtocolScrapper(throttle_time=0, retries=2, backoff_factor=0)
+    with pytest.raises(requests.HTTPError):
+        scrapper.fetch_url(f"{server.url}/fail-503/Bio-protocol1")
+    assert len(server.requests) == 3
+
+
+def test_fetch_url_does_not_retry_client_errors(server):
+    scrapper = BioProtocolScrapper(throttle_time=0, retries=2, backoff_factor=0)
+    with pytest.raises(requests.HTTPError):
+        scrapper.fetch_url(f"{server.url}/fail-404/Bio-protocol1")
+    assert len(server.requests) == 1
+
+
+def test_fetch_url_caches_and_revalidates_pages(server, tmp_path):
+    scrapper = BioProtocolScrapper(throttle_time=0, cache=PageCache(str(tmp_path), ttl=0))
+    url = f"{server.url}/Bio-protocol1"
+    assert scrapper.fetch_url(url) == ('Bio-protocol1', '<html>Bio-protocol1</html>')
+    assert scrapper.fetch_url(url) == ('Bio-protocol1', '<html>Bio-protocol1</html>')
+    assert len(server.requests) == 2
+
+
+def test_fetch_url_serves_the_cached_page_on_errors(server, tmp_path):
+    cache = PageCache(str(tmp_path), ttl=0)
+    url = f"{server.url}/fail-503/Bio-protocol1"
+    cache.put('Bio-protocol1', url, '<html>cached</html>')
+    scrapper = BioProtocolScrapper(throttle_time=0, retries=1, backoff_factor=0, cache=cache)
+    assert scrapper.fetch_url(url) == ('Bio-protocol1', '<html>cached</html>')
+    with pytest.raises(requests.HTTPError):
+        scrapper.fetch_url(f"{server.url}/fail-503/Bio-protocol2")
@@ -0,0 +1,46 @@
+import logging
+
+import spacy
+
+from shared_docs import ParsedDocsNlp, SharedDocsPipe
+
+
+class TokenCounter():
+    """ Step that parses each document with its own model, like the branches of the pipeline. """
+    def __init__(self, nlp):
+        self.nlp = nlp
+        self.max_parsed_docs = 0
+
+    def transform(self, X):
+        if isinstance(self.nlp, ParsedDocsNlp):
+            self.max_parsed_docs = max(self.max_parsed_docs, len(self.nlp.docs))
+        return [len(self.nlp(text)) for text in X]
+
+
+class StandInPipeline():
+    """ Chain the transform of its steps, like a scikit-learn pipeline. """
+    def __init__(self, steps):
+        self.steps = steps
+
+    def transform(self, X):
+        for _, step in self.steps:
+            X = step.transform(X)
+        return X
+
+
+def test_docs_are_parsed_in_bounded_chunks():
+    counter = TokenCounter(spacy.blank('en'))
+    final_pipe = StandInPipeline([('inner', StandInPipeline([('counter', counter)]))])
+    texts = ['one two', 'three', 'four five six', 'one two', 'seven eight']
+    shared_docs_pipe = SharedDocsPipe(final_pipe, batch_size=2, max_docs=2)
+    assert shared_docs_pipe.transform(texts) == [len(text.split()) for text in texts]
+    assert counter.max_parsed_docs == 2
+    # the original model is restored after each chunk
+    assert not isinstance(counter.nlp, ParsedDocsNlp)
+
+
+def test_warns_without_spacy_models(caplog):
+    final_pipe = StandInPipeline([('counter', TokenCounter(None))])
+    with caplog.at_level(logging.WARNING):
+        SharedDocsPipe(final_pipe)
+    assert 'No spaCy model' in caplog.text
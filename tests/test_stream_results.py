@@ -0,0 +1,83 @@
+import collections
+import json
+
+import pandas as pd
+import pytest
+
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.compare import isomorphic
+
+from common import show_results, stream_results
+
+
+Topic = collections.namedtuple('Topic', ['labels', 'uris', 'descs', 'score'])
+
+
+class StandInPipe():
+    """ Return a topic per word of each protocol, like the topic extraction model. """
+    def transform(self, X):
+        return [[(Topic([word], [f"Q{len(word)}"], [f"{word} description"], 1 / (idx + 1)),)
+                 for idx, word in enumerate(text.split()[:3])] for text in X]
+
+
+def add_stand_in_topics_to_graph(uri, pr_id, text, topics, g):
+    """ Stand-in of herc_common.utils.add_text_topics_to_graph, with a blank node per topic. """
+    context = URIRef(f"http://edma.org/{pr_id}")
+    g.add((context, URIRef('http://example.org/isString'), Literal(text)))
+    g.add((context, URIRef('http://example.org/sourceUrl'), URIRef(uri)))
+    for t, *_ in topics:
+        topic = BNode()
+        g.add((context, URIRef('http://example.org/topic'), topic))
+        g.add((topic, URIRef('http://example.org/label'), Literal(t.labels[0], lang='en')))
+    return context
+
+
+def get_protocols_dfs():
+    texts = ['Extract the DNA. Run a gel.', 'Grow "E. coli" cells\novernight.', 'Stain the cells.',
+             'Count the colonies.', 'Measure the absorbance.']
+    protocols_df = pd.DataFrame({
+        'pr_id': [f"Bio-{idx}" for idx in range(len(texts))],
+        'title': [f"Protocol {idx}" for idx in range(len(texts))],
+        'authors': [[f"Author {idx}", 'Other Author'] if idx % 2 else [] for idx in range(len(texts))],
+        'full_text_cleaned': texts
+    })
+    return protocols_df, [protocols_df.iloc[start:start + 2] for start in range(0, len(texts), 2)]
+
+
+def write_results(tmp_path, format):
+    protocols_df, protocols_dfs = get_protocols_dfs()
+    pipe = StandInPipe()
+    batch_path = str(tmp_path / f"batch.{format}")
+    protocols = protocols_df['full_text_cleaned'].values
+    show_results(protocols_df, protocols, pipe.transform(protocols), batch_path, format)
+    stream_path = str(tmp_path / f"stream.{format}")
+    stream_results(((df, df['full_text_cleaned'].values, pipe.transform(df['full_text_cleaned'].values))
+                    for df in protocols_dfs), stream_path, format)
+    return batch_path, stream_path
+
+
+@pytest.mark.parametrize('format', ['json', 'jsonl', 'csv'])
+def test_streamed_table_results_match_batch_results(tmp_path, format):
+    batch_path, stream_path = write_results(tmp_path, format)
+    with open(batch_path, encoding='utf-8') as f:
+        batch_output = f.read()
+    with open(stream_path, encoding='utf-8') as f:
+        assert f.read() == batch_output
+    if format == 'json':
+        assert json.loads(batch_output)['Bio-0']['authors'] == []
+
+
+def test_streamed_parquet_results_match_batch_results(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    batch_path, stream_path = write_results(tmp_path, 'parquet')
+    assert pq.read_table(stream_path).equals(pq.read_table(batch_path))
+
+
+@pytest.mark.parametrize('format', ['nt', 'turtle'])
+def test_streamed_graph_results_match_batch_results(tmp_path, monkeypatch, format):
+    herc_utils = pytest.importorskip('herc_common.utils')
+    monkeypatch.setattr(herc_utils, 'add_text_topics_to_graph', add_stand_in_topics_to_graph)
+    batch_path, stream_path = write_results(tmp_path, format)
+    batch_graph = Graph().parse(batch_path, format=format)
+    assert len(batch_graph) > 0
+    assert isomorphic(Graph().parse(stream_path, format=format), batch_graph)
@@ -0,0 +1,87 @@
+import itertools
+import multiprocessing
+import os
+
+import topic_cache
+
+from common import get_pipe_fingerprint
+from topic_cache import CachedTopicPipe, TopicCache
+
+
+class CountingPipe():
+    """ Return the words of each document, counting the documents it is sent. """
+    def __init__(self):
+        self.docs = []
+
+    def transform(self, X):
+        self.docs.extend(X)
+        return [doc.split() for doc in X]
+
+
+def put_topics(db_path, worker_idx):
+    cache = TopicCache(db_path)
+    for idx in range(50):
+        cache.put_many([(f"{worker_idx}:{idx}", [f"topic {idx}"])])
+    return len(cache.get_many([f"{worker_idx}:{idx}" for idx in range(50)]))
+
+
+def test_cached_pipe_returns_the_topics_of_the_pipe(tmp_path):
+    pipe = CountingPipe()
+    cached_pipe = CachedTopicPipe(pipe, TopicCache(str(tmp_path / 'topics.sqlite')), 'fingerprint')
+    docs = ['a b', 'c', 'a b', 'd e f']
+    assert cached_pipe.transform(docs) == CountingPipe().transform(docs)
+    # repeated documents are only predicted once
+    assert pipe.docs == ['a b', 'c', 'd e f']
+    assert cached_pipe.transform(['c', 'g', 'a b']) == [['c'], ['g'], ['a', 'b']]
+    assert pipe.docs == ['a b', 'c', 'd e f', 'g']
+
+
+def test_changing_the_pipe_fingerprint_misses_the_cache(tmp_path):
+    cache = TopicCache(str(tmp_path / 'topics.sqlite'))
+    pipe_path = str(tmp_path / 'final_pipe.pkl')
+    with open(pipe_path, 'wb') as f:
+        f.write(b'pipe 1')
+    fingerprint = get_pipe_fingerprint(cache, pipe_path)
+    labelling_fingerprint = get_pipe_fingerprint(cache, pipe_path, labelling={'centrality_error': .1})
+    disable_fingerprint = get_pipe_fingerprint(cache, pipe_path, shared_docs={'disable': ['parser']})
+    assert len({fingerprint, labelling_fingerprint, disable_fingerprint}) == 3
+    # options that do not change the topics keep the fingerprint
+    assert get_pipe_fingerprint(cache, pipe_path, {'batch_size': 8, 'disable': []},
+                                {'workers': 4, 'centrality_error': None}) == fingerprint
+    with open(pipe_path, 'wb') as f:
+        f.write(b'pipe 2')
+    # the modification time of the file may not change in such a short time
+    os.utime(pipe_path, ns=(0, 0))
+    retrained_fingerprint = get_pipe_fingerprint(cache, pipe_path)
+    assert retrained_fingerprint != fingerprint
+
+    pipe = CountingPipe()
+    CachedTopicPipe(pipe, cache, fingerprint).transform(['a b'])
+    for other_fingerprint in [labelling_fingerprint, disable_fingerprint, retrained_fingerprint]:
+        CachedTopicPipe(pipe, cache, other_fingerprint).transform(['a b'])
+    CachedTopicPipe(pipe, cache, fingerprint).transform(['a b'])
+    assert pipe.docs == ['a b'] * 4
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(topic_cache.time, 'time', lambda: next(clock))
+    cache = TopicCache(str(tmp_path / 'topics.sqlite'))
+    cache.put_many([('a', ['x' * 100])])
+    entry_size = cache.conn.execute("SELECT size FROM topics").fetchone()[0]
+    cache.max_size = 2 * entry_size
+    cache.put_many([('b', ['y' * 100])])
+    assert set(cache.get_many(['a'])) == {'a'}
+    cache.put_many([('c', ['z' * 100])])
+    assert set(cache.get_many(['a', 'b', 'c'])) == {'a', 'c'}
+    cache.put_many([('d', ['w' * 100]), ('e', ['v' * 100])])
+    assert set(cache.get_many(['a', 'b', 'c', 'd', 'e'])) == {'d', 'e'}
+
+
+def test_cache_is_shared_by_processes(tmp_path):
+    db_path = str(tmp_path / 'topics.sqlite')
+    cache = TopicCache(db_path)
+    assert cache.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    with multiprocessing.get_context('spawn').Pool(4) as pool:
+        assert pool.starmap(put_topics, [(db_path, worker_idx) for worker_idx in range(4)]) == [50] * 4
+    assert cache.get_many(['3:49']) == {'3:49': ['topic 49']}
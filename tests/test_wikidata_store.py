@@ -0,0 +1,137 @@
+import argparse
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+import requests
+
+from common import with_wikidata_store
+from wikidata_endpoint import create_server
+from wikidata_store import WikidataOfflineError, WikidataStore, install_wikidata_store
+
+
+ENTITY_URL = 'https://www.wikidata.org/wiki/Special:EntityData/Q42.json'
+SEARCH_URL = 'https://www.wikidata.org/w/api.php?action=wbsearchentities&search=adams&format=json'
+SPARQL_URL = 'https://query.wikidata.org/sparql?query=SELECT%20%3Fx&format=json'
+MISSING_URL = 'https://www.wikidata.org/wiki/Special:EntityData/Q1.json'
+ENTITIES_URL = 'https://www.wikidata.org/w/api.php?action=wbgetentities&ids=Q42|Q1&format=json'
+
+
+@pytest.fixture
+def remote_endpoint(tmp_path):
+    """ Serve a store with an entity, a search and a SPARQL response as a stand-in of Wikidata. """
+    remote_store = WikidataStore(str(tmp_path / 'remote.sqlite'))
+    remote_store.put_entities({'Q42': {'id': 'Q42', 'labels': {'en': {'value': 'Douglas Adams'}}}})
+    for url, content in [(SEARCH_URL, {'search': [{'id': 'Q42'}]}),
+                         (SPARQL_URL, {'results': {'bindings': []}})]:
+        request = requests.Request('GET', url).prepare()
+        remote_store.save(request, 'application/json', json.dumps(content).encode('utf-8'))
+    server = create_server(remote_store, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_all():
+    """ Fetch the test urls with requests and with urllib, like SPARQLWrapper does. """
+    with requests.Session() as session:
+        entity = session.get(ENTITY_URL).json()
+        search = session.get(SEARCH_URL).json()
+    with urllib.request.urlopen(SPARQL_URL, timeout=5) as response:
+        sparql = json.loads(response.read())
+    return entity, search, sparql
+
+
+def test_record_and_replay_offline(tmp_path, remote_endpoint):
+    store = WikidataStore(str(tmp_path / 'store.sqlite'))
+    with install_wikidata_store(store, endpoint=remote_endpoint):
+        recorded = fetch_all()
+    assert recorded[0]['entities']['Q42']['labels']['en']['value'] == 'Douglas Adams'
+    assert recorded[1] == {'search': [{'id': 'Q42'}]}
+    assert recorded[2] == {'results': {'bindings': []}}
+
+    with install_wikidata_store(store, offline=True):
+        assert fetch_all() == recorded
+
+
+def test_offline_misses_raise(tmp_path):
+    with install_wikidata_store(WikidataStore(str(tmp_path / 'store.sqlite')), offline=True):
+        with pytest.raises(WikidataOfflineError):
+            requests.get(MISSING_URL)
+        with pytest.raises(WikidataOfflineError):
+            urllib.request.urlopen(MISSING_URL)
+        # clients that bypass both requests and urlopen can not resolve Wikidata hosts either
+        with pytest.raises(WikidataOfflineError):
+            socket.getaddrinfo('query.wikidata.org', 443)
+
+
+def test_missing_endpoint_responses_are_not_stored(tmp_path, remote_endpoint):
+    store = WikidataStore(str(tmp_path / 'store.sqlite'))
+    with install_wikidata_store(store, endpoint=remote_endpoint):
+        assert requests.get(MISSING_URL).status_code == 404
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(MISSING_URL)
+    assert store.lookup(requests.Request('GET', MISSING_URL).prepare()) is None
+
+
+def test_missing_entities_are_stored(tmp_path, remote_endpoint):
+    missing_entity = {'id': 'Q1', 'missing': ''}
+    remote_store = WikidataStore(str(tmp_path / 'remote.sqlite'))
+    remote_store.put_entities({'Q1': missing_entity})
+    store = WikidataStore(str(tmp_path / 'store.sqlite'))
+    with install_wikidata_store(store, endpoint=remote_endpoint):
+        recorded = requests.get(ENTITIES_URL).json()
+    assert recorded['entities']['Q1'] == missing_entity
+    assert store.get_entities(['Q1']) == {'Q1': missing_entity}
+    # missing entities are answered from the store instead of being requested again
+    with install_wikidata_store(store, offline=True):
+        assert requests.get(ENTITIES_URL).json() == recorded
+
+
+def test_originals_are_restored(tmp_path):
+    getaddrinfo = socket.getaddrinfo
+    get_adapter = requests.Session.get_adapter
+    opener = urllib.request._opener
+    store = WikidataStore(str(tmp_path / 'store.sqlite'))
+    with install_wikidata_store(store, offline=True):
+        with install_wikidata_store(store, offline=True):
+            pass
+        # leaving a nested block restores the store installed by the outer one
+        with pytest.raises(WikidataOfflineError):
+            requests.get(MISSING_URL)
+    with pytest.raises(ValueError):
+        with install_wikidata_store(store, offline=True):
+            raise ValueError("Prediction failed")
+    assert socket.getaddrinfo is getaddrinfo
+    assert requests.Session.get_adapter is get_adapter
+    assert urllib.request._opener is opener
+
+
+def test_other_hosts_are_not_sent_through_the_store(tmp_path, remote_endpoint):
+    with install_wikidata_store(WikidataStore(str(tmp_path / 'store.sqlite')), offline=True):
+        with requests.Session() as session:
+            assert session.get_adapter(remote_endpoint) is not session.get_adapter(ENTITY_URL)
+        assert socket.getaddrinfo('127.0.0.1', 80)
+
+
+def test_store_is_scoped_to_the_transform(tmp_path):
+    args = argparse.Namespace(no_wikidata_store=False, wikidata_store=str(tmp_path / 'store.sqlite'),
+                              wikidata_offline=True, wikidata_endpoint=None)
+    get_adapter = requests.Session.get_adapter
+
+    def transform(X):
+        assert requests.Session.get_adapter is not get_adapter
+        with pytest.raises(WikidataOfflineError):
+            requests.get(MISSING_URL)
+        return [x.upper() for x in X]
+
+    assert with_wikidata_store(transform, args)(['a', 'b']) == ['A', 'B']
+    assert requests.Session.get_adapter is get_adapter
+    args.no_wikidata_store = True
+    with pytest.raises(ValueError, match='offline mode'):
+        with_wikidata_store(transform, args)